@@ -2,13 +2,20 @@ import time
 import logging
 import streamlit as st
 from langchain_core.prompts import PromptTemplate
-from langchain_groq import ChatGroq
 from langchain_core.output_parsers import StrOutputParser
-from langchain_community.tools import DuckDuckGoSearchRun
-from utils.llms import llm1, llm2, llm3, llm4, llm5, llm6
+from utils.router import routed, AllModelsFailed
+from utils.pipeline import Pipeline, Stage
+from utils.prompt_packer import pack, Section
+from utils.search import SearchService
+from utils.streaming import run_in_streamlit
+from utils.telemetry import Telemetry
+from ingest import DocumentIngester, documents_text
 
 logger = logging.getLogger(__name__)
 
+# Uploaded documents are read once, reruns and re-uploads of the same file come from its cache
+ingester = DocumentIngester()
+
 
 #TODO: insert webscraping of legal publications by OAB Number
 #TODO: output the doc file on word format
@@ -46,77 +53,62 @@ power_of_attorney_template = "Generate a Power of Attorney document based on the
 declaration_of_poverty_template = "Generate a Declaration of Poverty document based on the given facts: {facts}"
 
 
-def new_lawsuit_research_section(st_callback, theme, facts, docs):
-    groq_api_key = get_api_keys()["groq_api_key"]
-    draft_chain = ChatGroq(temperature=0.5, model="llama3-70b-8192", api_key=groq_api_key) | StrOutputParser()
-
+# Research and drafting graph shared by both sections: the two searches run in parallel, the draft waits for both
+def run_research_section(st_callback, draft_template, theme, facts, docs):
     # Prompts
     draft_prompt = PromptTemplate(
         input_variables=["theme", "facts", "docs", "research"],
-        template=new_lawsuit_draft_template
+        template=draft_template
     )
+    draft_llm = routed("llm1")
+    # The search dumps are ranked down first, then the document chunks, the client's facts are cut last
+    draft_sections = {
+        "research": Section(priority=0, strategy="rank"),
+        "docs": Section(priority=1, strategy="rank"),
+        "facts": Section(priority=2),
+    }
+    draft_chain = pack(draft_prompt, draft_llm, draft_sections) | draft_llm | StrOutputParser()
+
+    # Both searches run at once and share their deduplicated results
+    search = SearchService()
+
+    def research(theme):
+        return search.search_text({"articles": f"{theme} legal articles and books",
+                                   "decisions": f"{theme} previous legal decisions"})
+
+    pipeline = Pipeline([
+        Stage("searches", research, ["theme"]),
+        # Research articles and books
+        Stage("search_articles", lambda searches: searches["articles"], ["searches"],
+              title="Pesquisas de Artigos e Livros"),
+        # Research previous decisions
+        Stage("search_decisions", lambda searches: searches["decisions"], ["searches"],
+              title="Pesquisa de Decisões Anteriores"),
+        Stage("research", lambda articles, decisions: f"{articles}\n{decisions}",
+              {"articles": "search_articles", "decisions": "search_decisions"}),
+        # First Draft of the Petition
+        Stage("draft", draft_chain, ["theme", "facts", "docs", "research"], title="Primeiro Rascunho da Petição"),
+    ])
+
+    result = run_in_streamlit(pipeline, {"theme": theme, "facts": facts, "docs": docs}, st_callback, summary=False,
+                              telemetry=Telemetry("AILawyer"))
+    logger.info("Primeiro rascunho da petição concluído")
 
-    research_prompt = DuckDuckGoSearchRun() | StrOutputParser()
-
-    # Research articles and books
-    search_articles_output = research_prompt.invoke({"query": f"{theme} legal articles and books"})
-    st_callback.write(f"Pesquisas de Artigos e Livros:\n{search_articles_output}")
-    logger.info("Pesquisa de artigos e livros concluída")
+    return result.outputs.get("draft")
 
-    # Research previous decisions
-    search_decisions_output = research_prompt.invoke({"query": f"{theme} previous legal decisions"})
-    st_callback.write(f"Pesquisa de Decisões Anteriores:\n{search_decisions_output}")
-    logger.info("Pesquisa de decisões anteriores concluída")
 
+def new_lawsuit_research_section(st_callback, theme, facts, docs):
     # Process uploaded documents
-    doc_names = [doc.name for doc in docs] if docs else []
-    doc_info = ", ".join(doc_names) if doc_names else "No documents uploaded"
-
-    # First Draft of the Lawsuit Petition
-    draft_output = draft_chain.invoke(draft_prompt.format(
-        theme=theme,
-        facts=facts,
-        docs=doc_info,
-        research=f"{search_articles_output}\n{search_decisions_output}"
-    ))
-    st_callback.write(f"Primeiro Rascunho da Petição:\n{draft_output}")
-    logger.info("Primeiro rascunho da petição concluído")
-
-    return draft_output
+    doc_info = documents_text(ingester.ingest(docs or []))
 
-def existing_lawsuit_research_section(st_callback, theme, facts, docs):
-    groq_api_key = get_api_keys()["groq_api_key"]
-    draft_chain = ChatGroq(temperature=0.5, model="llama3-70b-8192", api_key=groq_api_key) | StrOutputParser()
-
-    # Prompts
-    draft_prompt = PromptTemplate(
-        input_variables=["theme", "facts", "docs", "research"],
-        template=existing_lawsuit_draft_template
-    )
+    return run_research_section(st_callback, new_lawsuit_draft_template, theme, facts, doc_info)
 
-    research_prompt = DuckDuckGoSearchRun() | StrOutputParser()
-
-    # Research books and articles
-    search_articles_output = research_prompt.invoke({"query": f"{theme} legal articles and books"})
-    st_callback.write(f"Pesquisas de Artigos e Livros:\n{search_articles_output}")
-    logger.info("Pesquisa de artigos e livros concluída")
-
-    # Research previous decisions about the case
-    search_decisions_output = research_prompt.invoke({"query": f"{theme} previous legal decisions"})
-    st_callback.write(f"Pesquisa de Decisões Anteriores:\n{search_decisions_output}")
-    logger.info("Pesquisa de decisões anteriores concluída")
-
-    # First Draft of the Petition
-    draft_output = draft_chain.invoke(draft_prompt.format({
-        "theme": theme,
-        "facts": facts,
-        "docs": docs,
-        "research": f"{search_articles_output}\n{search_decisions_output}"
-    }))
-    st_callback.write(f"Primeiro Rascunho da Petição:\n{draft_output}")
-    logger.info("Primeiro rascunho da petição concluído")
 
-    return draft_output
+# `docs` are uploaded files, or their text already
+def existing_lawsuit_research_section(st_callback, theme, facts, docs):
+    if not isinstance(docs, str):
+        docs = documents_text(ingester.ingest(docs or []))
+    return run_research_section(st_callback, existing_lawsuit_draft_template, theme, facts, docs)
 
 
 def nova_acao_judicial():
@@ -156,18 +148,26 @@ def nova_acao_judicial():
                 st_callback.write(f"Pesquisa Completa e Primeiro Rascunho: {draft_output}")
 
         if gerar_po_btn:
-            poa_chain = ChatGroq(temperature=0.5, model="llama3-70b-8192",
-                                 api_key=get_api_keys()["groq_api_key"]) | StrOutputParser()
+            poa_llm = routed("llm1")
             poa_prompt = PromptTemplate(input_variables=["facts"], template=power_of_attorney_template)
-            poa_output = poa_chain.invoke(poa_prompt.format(facts=fatos))
-            st.write(f"Procuração Gerada:\n{poa_output}")
+            poa_chain = pack(poa_prompt, poa_llm) | poa_llm | StrOutputParser()
+            try:
+                poa_output = poa_chain.invoke({"facts": fatos}, Telemetry("AILawyer").config("power_of_attorney"))
+                st.write(f"Procuração Gerada:\n{poa_output}")
+            except AllModelsFailed as e:
+                logger.error(f"Erro ao gerar a procuração: {e}")
+                st.error("Nenhum modelo está disponível no momento, tente novamente em alguns minutos.")
 
         if gerar_decl_pobreza_btn:
-            poverty_chain = ChatGroq(temperature=0.5, model="llama3-70b-8192",
-                                     api_key=get_api_keys()["groq_api_key"]) | StrOutputParser()
+            poverty_llm = routed("llm1")
             poverty_prompt = PromptTemplate(input_variables=["facts"], template=declaration_of_poverty_template)
-            poverty_output = poverty_chain.invoke(poverty_prompt.format(facts=fatos))
-            st.write(f"Declaração de Pobreza Gerada:\n{poverty_output}")
+            poverty_chain = pack(poverty_prompt, poverty_llm) | poverty_llm | StrOutputParser()
+            try:
+                poverty_output = poverty_chain.invoke({"facts": fatos}, Telemetry("AILawyer").config("declaration_of_poverty"))
+                st.write(f"Declaração de Pobreza Gerada:\n{poverty_output}")
+            except AllModelsFailed as e:
+                logger.error(f"Erro ao gerar a declaração de pobreza: {e}")
+                st.error("Nenhum modelo está disponível no momento, tente novamente em alguns minutos.")
 
 def acao_judicial_existente():
     st.title("Seção de Ação Judicial Existente")
@@ -224,7 +224,8 @@ def acao_judicial_existente():
     if st.button("Gerar Pesquisa e Petição"):
         with st.spinner("Gerando pesquisa e petição..."):
             st_callback = st.container()
-            draft_output = existing_lawsuit_research_section(st_callback, objetivo, leis, docs_contexto)
+            docs = ([doc_decisao] if doc_decisao else []) + (docs_contexto or [])
+            draft_output = existing_lawsuit_research_section(st_callback, objetivo, leis, docs)
             st_callback.write(f"Pesquisa Completa e Primeiro Rascunho: {draft_output}")
 
 
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from concurrent.futures import Future, ProcessPoolExecutor
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+INGEST_CACHE_PATH = os.environ.get("INGEST_CACHE_PATH", os.path.expanduser("~/.cache/personall/ingest.sqlite"))
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", os.cpu_count() or 2))
+# PDF pages extracted per worker task. Shorter PDFs are read in the calling process.
+PAGES_PER_TASK = int(os.environ.get("INGEST_PAGES_PER_TASK", 8))
+CHUNK_TOKENS = int(os.environ.get("INGEST_CHUNK_TOKENS", 800))
+# Uploads are hashed and spooled to disk in blocks of this size, never read whole into memory
+BLOCK_SIZE = 1024 * 1024
+
+# Bumped when extraction or chunking changes, so cached results of the old version are not reused
+EXTRACTOR_VERSION = 2
+
+
+@dataclass
+class Document:
+    name: str
+    content_hash: str
+    kind: str
+    text: str = ""
+    chunks: list = field(default_factory=list)
+    pages: int = 0
+    error: str = None
+
+
+@contextmanager
+def _connect(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS documents (
+        key TEXT PRIMARY KEY, kind TEXT, text TEXT, chunks TEXT, pages INTEGER, created_at REAL)""")
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _kind(name, mime):
+    extension = os.path.splitext(name or "")[1].lower()
+    if extension == ".pdf" or mime == "application/pdf":
+        return "pdf"
+    if extension == ".docx" or (mime or "").endswith("wordprocessingml.document"):
+        return "docx"
+    if extension in (".txt", ".md", ".csv") or (mime or "").startswith("text/"):
+        return "txt"
+    return None
+
+
+# Copies an upload (or any binary file object) to a temporary file while hashing it
+def _spool(upload, suffix):
+    digest = hashlib.sha256()
+    upload.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as spooled:
+        for block in iter(lambda: upload.read(BLOCK_SIZE), b""):
+            digest.update(block)
+            spooled.write(block)
+    upload.seek(0)
+    return spooled.name, digest.hexdigest()
+
+
+def _pdf_pages(path, start, stop):
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    return [reader.pages[index].extract_text() or "" for index in range(start, stop)]
+
+
+def _pdf_page_count(path):
+    from pypdf import PdfReader
+
+    return len(PdfReader(path).pages)
+
+
+def _docx_text(path):
+    from docx import Document as DocxDocument
+
+    document = DocxDocument(path)
+    paragraphs = [paragraph.text for paragraph in document.paragraphs]
+    for table in document.tables:
+        for row in table.rows:
+            paragraphs.append(" | ".join(cell.text for cell in row.cells))
+    return "\n\n".join(paragraph for paragraph in paragraphs if paragraph.strip())
+
+
+# Text files are decoded a line at a time, UTF-8 first and Latin-1 when that fails
+def _txt_paragraphs(path):
+    encoding = "utf-8"
+    try:
+        with open(path, encoding=encoding) as text:
+            for _ in text:
+                pass
+    except UnicodeDecodeError:
+        encoding = "latin-1"
+    paragraph = []
+    with open(path, encoding=encoding) as text:
+        for line in text:
+            if line.strip():
+                paragraph.append(line.rstrip())
+            elif paragraph:
+                yield "\n".join(paragraph)
+                paragraph = []
+    if paragraph:
+        yield "\n".join(paragraph)
+
+
+# Packs paragraphs into chunks of about CHUNK_TOKENS, paragraphs longer than that are cut on line breaks
+def chunk_paragraphs(paragraphs, max_tokens=CHUNK_TOKENS):
+    chunks, current, used = [], [], 0
+    for paragraph in paragraphs:
+        pieces = [paragraph] if estimate_tokens(paragraph) <= max_tokens else paragraph.splitlines()
+        for piece in pieces:
+            cost = estimate_tokens(piece)
+            if current and used + cost > max_tokens:
+                chunks.append("\n\n".join(current))
+                current, used = [], 0
+            current.append(piece)
+            used += cost
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=INGEST_WORKERS)
+        return _pool
+
+
+def _done(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class DocumentIngester:
+    def __init__(self, path=INGEST_CACHE_PATH):
+        self.path = path
+
+    def _key(self, content_hash):
+        return f"{EXTRACTOR_VERSION}:{CHUNK_TOKENS}:{content_hash}"
+
+    def _cached(self, name, content_hash):
+        with _connect(self.path) as conn:
+            row = conn.execute("SELECT kind, text, chunks, pages FROM documents WHERE key = ?",
+                               (self._key(content_hash),)).fetchone()
+        if row is None:
+            return None
+        return Document(name, content_hash, row[0], row[1], json.loads(row[2]), row[3])
+
+    def _store(self, document):
+        with _connect(self.path) as conn:
+            conn.execute("INSERT OR REPLACE INTO documents (key, kind, text, chunks, pages, created_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", (self._key(document.content_hash), document.kind, document.text,
+                                                        json.dumps(document.chunks), document.pages, time.time()))
+
+    # Documents for Streamlit uploads (or any objects with name, read and seek), in the same order. Files already
+    # seen are served from the cache by content hash. The pages of every new PDF are extracted in the process
+    # pool at the same time, DOCX files take one task each and text files are read in this process.
+    def ingest(self, uploads):
+        documents, pending, hits = [], [], 0
+        # Every spooled file is removed once ingestion ends, also when it ends with an exception
+        spooled = []
+        try:
+            for upload in uploads:
+                kind = _kind(upload.name, getattr(upload, "type", None))
+                path, content_hash = _spool(upload, os.path.splitext(upload.name)[1])
+                spooled.append(path)
+                cached = self._cached(upload.name, content_hash)
+                if cached is not None:
+                    documents.append(cached)
+                    hits += 1
+                    continue
+                document = Document(upload.name, content_hash, kind)
+                documents.append(document)
+                if kind is None:
+                    document.error = "unsupported file type"
+                else:
+                    pending.append((document, path))
+
+            tasks = []
+            for document, path in pending:
+                try:
+                    if document.kind == "pdf":
+                        document.pages = _pdf_page_count(path)
+                        if document.pages <= PAGES_PER_TASK:
+                            tasks.append((document, [_done(_pdf_pages(path, 0, document.pages))]))
+                        else:
+                            tasks.append((document, [_executor().submit(_pdf_pages, path, start,
+                                                                        min(start + PAGES_PER_TASK, document.pages))
+                                                     for start in range(0, document.pages, PAGES_PER_TASK)]))
+                    elif document.kind == "docx":
+                        tasks.append((document, [_executor().submit(_docx_text, path)]))
+                    else:
+                        document.chunks = chunk_paragraphs(_txt_paragraphs(path))
+                        document.text = "\n\n".join(document.chunks)
+                except Exception as e:
+                    logger.warning(f"Could not read {document.name}: {e}")
+                    document.error = str(e)
+
+            for document, parts in tasks:
+                try:
+                    if document.kind == "pdf":
+                        paragraphs = [page for part in parts for page in part.result() if page.strip()]
+                    else:
+                        paragraphs = [paragraph for paragraph in parts[0].result().split("\n\n") if paragraph.strip()]
+                    document.chunks = chunk_paragraphs(paragraphs)
+                    document.text = "\n\n".join(document.chunks)
+                except Exception as e:
+                    logger.warning(f"Could not read {document.name}: {e}")
+                    document.error = str(e)
+        finally:
+            for path in spooled:
+                os.unlink(path)
+
+        for document, _ in pending:
+            if document.error is None:
+                self._store(document)
+        if pending:
+            logger.info(f"Ingested {len(pending)} documents, {hits} from the cache")
+        return documents
+
+
+# Text for the prompt, one section per document. Chunks are separated by blank lines so the prompt
+# packer can rank them.
+def documents_text(documents):
+    if not documents:
+        return "No documents uploaded"
+    sections = []
+    for document in documents:
+        if document.error:
+            sections.append(f"### {document.name}\n(could not be read: {document.error})")
+        else:
+            sections.append(f"### {document.name}\n" + "\n\n".join(document.chunks))
+    return "\n\n".join(sections)
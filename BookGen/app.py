@@ -1,27 +1,40 @@
-import time
+import os
 import logging
 import streamlit as st
 from langchain_core.prompts import PromptTemplate
 from langchain.agents import create_openai_tools_agent, AgentExecutor
 from langchain_groq import ChatGroq
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableBranch, RunnableLambda
 from langchain_community.callbacks.streamlit import StreamlitCallbackHandler
 from langchain_community.tools import DuckDuckGoSearchRun
 from langchain_community.tools import DuckDuckGoSearchResults
-from utils.llms import llm1, llm2, llm3, llm4, llm5, llm6
+from utils.llms import context_window
+from utils.router import routed, AllModelsFailed
+from utils.hedging import hedged, HedgeBudget
+from utils.pipeline import Pipeline, Stage
+from utils.prompt_packer import pack, Section
+from utils.prompts import shared_context_prompt, outline_slice, outline_slicer, draft_slicer
+from utils.tokens import estimate_tokens
+from utils.run_store import RunStore, content_hash
+from utils.streaming import run_in_streamlit
+from utils.telemetry import Telemetry
+from utils.job_client import JOB_SERVER_URL, submit_job, follow_job
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+# Bounded concurrency for the pipeline and retries for each chapter group when every model is unavailable
+MAX_WORKERS = int(os.environ.get("BOOKGEN_MAX_WORKERS", 3))
+CHAPTER_WRITING_MAX_RETRIES = 3
 
-# Function to get API keys
-def get_api_keys():
-    return {"groq_api_key": "your_groq_api_key"}
+# Structure stages prefer the larger model, writing stages the faster one; both fail over to substitutes
+llm1 = routed("llm1")
+llm3 = routed("llm3")
 
 
 # Function to execute the pipeline
-def run_pipeline(theme, st_callback):
-    start_time = time.time()
+def run_pipeline(theme, st_callback, stream=True, resume=True, chapter_outlines=None):
     logger.info("Iniciando o processamento da rota /book/generate/")
 
     
@@ -67,71 +80,96 @@ def run_pipeline(theme, st_callback):
         - Conclusion: Provide a strategy for concluding each chapter effectively.
     """
 
+    # The outlines and the alignment are rendered once at the top of each writing prompt (see
+    # shared_context_prompt), the instructions below only refer to them
     writing_chapters_prompt_template = """
-    Based on the chapter outlines ({chapter_outlines}) and considering the alignment guidelines ({alignment}), draft 
-    the content for chapters 1 and 2.
+    Based on the chapter outlines and considering the alignment guidelines above, draft the content for chapters 1 and 2.
     For each chapter, follow these guidelines:
         - Introduction: Provide a compelling opening that hooks the reader.
         - Main Points: Cover the key points as outlined. Ensure logical flow and coherence.
-        - Tone and Style: Adhere to the specified tone and style, both suggested in the ({alignment}) phase.
-        - Target Length: Aim for a chapter length suggested on the ({alignment}).
-        - Conclusion: End with a strong conclusion that reinforces the main points and provides a seamless transition to the next chapter.
+        - Tone and Style: Adhere to the tone and style specified in the alignment guidelines.
+        - Target Length: Aim for the chapter length suggested in the alignment guidelines.
+        - Conclusion: End with a strong conclusion that reinforces the main points and provides a seamless transition 
+        to the next chapter.
     """
 
     writing_chapters2_prompt_template = """
-    Based on the chapter outlines ({chapter_outlines}) and considering the alignment guidelines ({alignment}), draft the content for chapters 3 and 4.
+    Based on the chapter outlines and considering the alignment guidelines above, draft the content for chapters 3 and 4.
     For each chapter, follow these guidelines:
         - Introduction: Provide a compelling opening that hooks the reader.
         - Main Points: Cover the key points as outlined. Ensure logical flow and coherence.
-        - Tone and Style: Adhere to the specified tone and style, both suggested in the ({alignment}) phase.
-        - Target Length: Aim for a chapter length suggested on the ({alignment}).
-        - Conclusion: End with a strong conclusion that reinforces the main points and provides a seamless transition to the next chapter.
+        - Tone and Style: Adhere to the tone and style specified in the alignment guidelines.
+        - Target Length: Aim for the chapter length suggested in the alignment guidelines.
+        - Conclusion: End with a strong conclusion that reinforces the main points and provides a seamless transition 
+        to the next chapter.
     """
 
     writing_chapters3_prompt_template = """
-    Based on the chapter outlines ({chapter_outlines}) and considering the alignment guidelines ({alignment}), draft the content for chapters 5 and 6.
+    Based on the chapter outlines and considering the alignment guidelines above, draft the content for chapters 5 and 6.
     For each chapter, follow these guidelines:
         - Introduction: Provide a compelling opening that hooks the reader.
         - Main Points: Cover the key points as outlined. Ensure logical flow and coherence.
-        - Tone and Style: Adhere to the specified tone and style, both suggested in the ({alignment}) phase.
-        - Target Length: Aim for a chapter length suggested on the ({alignment}).
-        - Conclusion: End with a strong conclusion that reinforces the main points and provides a seamless transition to the next chapter.
+        - Tone and Style: Adhere to the tone and style specified in the alignment guidelines.
+        - Target Length: Aim for the chapter length suggested in the alignment guidelines.
+        - Conclusion: End with a strong conclusion that reinforces the main points and provides a seamless transition 
+        to the next chapter.
     """
 
     writing_chapters4_prompt_template = """
-    Based on the chapter outlines ({chapter_outlines}) and considering the alignment guidelines ({alignment}), draft 
-    the content for chapters 7 and 8.
+    Based on the chapter outlines and considering the alignment guidelines above, draft the content for chapters 7 and 8.
     For each chapter, follow these guidelines:
         - Introduction: Provide a compelling opening that hooks the reader.
         - Main Points: Cover the key points as outlined. Ensure logical flow and coherence.
-        - Tone and Style: Adhere to the specified tone and style, both suggested in the ({alignment}) phase.
-        - Target Length: Aim for a chapter length suggested on the ({alignment}).
+        - Tone and Style: Adhere to the tone and style specified in the alignment guidelines.
+        - Target Length: Aim for the chapter length suggested in the alignment guidelines.
         - Conclusion: End with a strong conclusion that reinforces the main points and provides a seamless transition 
         to the next chapter.
     """
 
     writing_chapters5_prompt_template = """
-    Based on the chapter outlines ({chapter_outlines}) and considering the alignment guidelines ({alignment}), draft 
-    the content for chapters 9 and 10.
+    Based on the chapter outlines and considering the alignment guidelines above, draft the content for chapters 9 and 10.
     For each chapter, follow these guidelines:
         - Introduction: Provide a compelling opening that hooks the reader.
         - Main Points: Cover the key points as outlined. Ensure logical flow and coherence.
-        - Tone and Style: Adhere to the specified tone and style, both suggested in the ({alignment}) phase.
-        - Target Length: Aim for a chapter length suggested on the ({alignment}).
+        - Tone and Style: Adhere to the tone and style specified in the alignment guidelines.
+        - Target Length: Aim for the chapter length suggested in the alignment guidelines.
         - Conclusion: End with a strong conclusion that reinforces the main points and provides a seamless transition 
         to the next chapter.
     """
 
+    # The revision is split so every call stays well inside the model context window: the alignment is
+    # condensed into a style digest, each chapter is revised on its own, and a consistency pass
+    # reads only short summaries of the revised chapters
+    style_digest_prompt_template = """
+    Condense the following alignment guidelines into a style digest of at most 200 words. Keep only what a reviser
+    needs: tone, style, target chapter length, how chapters open and how they conclude.
+    Alignment guidelines: {alignment}
+    """
+
     revision_prompt_template = """
-    Considering what has been gathered on {writing_chapters}, {writing_chapters2}, {writing_chapters3}, {writing_chapters4}, and {writing_chapters5},
-    present a final version of the content drafted, having in mind that that you should respect the follow guidelines:
+    Considering the draft of {chapters} below, present a final version of the content drafted, having in mind that you 
+    should respect the follow guidelines:
         - Grammar and punctuation: Correct any grammatical errors and ensure proper punctuation throughout the text.
         - Spelling: Correct all spelling mistakes.
-        - Tone and Style: Maintain the tone and style described in the {alignment} guidelines.
+        - Tone and Style: Maintain the tone and style described in the style digest ({style_digest}).
         - Cohesion and Coherence: Ensure a logical flow of ideas and smooth transitions between sections within each chapter.
         - Chapter Length: Ensure that each chapter have, at least, 15 paragraphs.
         - Engagement: Make sure that the content remains engaging and compelling for the reader.
         - Formatting: Ensure that the formatting is consistent and professional.
+    Draft: {draft}
+    """
+
+    chapter_summary_prompt_template = """
+    Summarize the revised {chapters} below in at most 150 words. List the key terms, names and claims introduced and 
+    describe how the chapter closes.
+    Revised chapter: {revised}
+    """
+
+    consistency_prompt_template = """
+    These are summaries of every part of the book, in order:
+    {summaries}
+    Considering the style digest ({style_digest}), list any inconsistencies in terminology, facts, tone or transitions 
+    between chapters, and how to fix each one. Be brief.
     """
 
     # Create PromptTemplates
@@ -142,91 +180,162 @@ def run_pipeline(theme, st_callback):
     book_structure_prompt = PromptTemplate(input_variables=["theme", "key_takeaways_results"], template=book_structure_prompt_template)
     chapter_outlines_prompt = PromptTemplate(input_variables=["book_structure"], template=chapter_outlines_prompt_template)
     alignment_chapters_prompt = PromptTemplate(input_variables=["chapter_outlines"], template=alignment_chapters_prompt_template)
-    writing_chapters_prompt = PromptTemplate(input_variables=["chapter_outlines", "alignment"], template=writing_chapters_prompt_template)
-    writing_chapters2_prompt = PromptTemplate(input_variables=["chapter_outlines", "alignment"], template=writing_chapters2_prompt_template)
-    writing_chapters3_prompt = PromptTemplate(input_variables=["chapter_outlines", "alignment"], template=writing_chapters3_prompt_template)
-    writing_chapters4_prompt = PromptTemplate(input_variables=["chapter_outlines", "alignment"], template=writing_chapters4_prompt_template)
-    writing_chapters5_prompt = PromptTemplate(input_variables=["chapter_outlines", "alignment"], template=writing_chapters5_prompt_template)
-    revision_prompt = PromptTemplate(input_variables=["writing_chapters", "writing_chapters2", "writing_chapters3", "writing_chapters4", "writing_chapters5", "alignment"], template=revision_prompt_template)
+    writing_context = {"chapter_outlines": "Chapter Outlines", "alignment": "Alignment Guidelines"}
+    writing_chapters_prompt = shared_context_prompt(writing_context, writing_chapters_prompt_template)
+    writing_chapters2_prompt = shared_context_prompt(writing_context, writing_chapters2_prompt_template)
+    writing_chapters3_prompt = shared_context_prompt(writing_context, writing_chapters3_prompt_template)
+    writing_chapters4_prompt = shared_context_prompt(writing_context, writing_chapters4_prompt_template)
+    writing_chapters5_prompt = shared_context_prompt(writing_context, writing_chapters5_prompt_template)
+    style_digest_prompt = PromptTemplate(input_variables=["alignment"], template=style_digest_prompt_template)
+    revision_prompt = PromptTemplate(input_variables=["chapters", "style_digest", "draft"], template=revision_prompt_template)
+    chapter_summary_prompt = PromptTemplate(input_variables=["chapters", "revised"], template=chapter_summary_prompt_template)
+    consistency_prompt = PromptTemplate(input_variables=["summaries", "style_digest"], template=consistency_prompt_template)
     logger.info("Prompts set successfully")
 
     # Create chains
-    theme_selection_chain = theme_selection_prompt | llm1 | StrOutputParser()
-    theme_research_chain = theme_research_prompt | llm1 | StrOutputParser()
-    theme_exploration_chain = theme_exploration_prompt | llm3 | StrOutputParser()
-    key_takeaways_chain = key_takeaways_prompt | llm3 | StrOutputParser()
-    book_structure_chain = book_structure_prompt | llm1 | StrOutputParser()
-    chapter_outlines_chain = chapter_outlines_prompt | llm1 | StrOutputParser()
-    alignment_chapters_chain = alignment_chapters_prompt | llm3 | StrOutputParser()
-    writing_chapters_chain = writing_chapters_prompt | llm3 | StrOutputParser()
-    writing_chapters2_chain = writing_chapters2_prompt | llm3 | StrOutputParser()
-    writing_chapters3_chain = writing_chapters3_prompt | llm3 | StrOutputParser()
-    writing_chapters4_chain = writing_chapters4_prompt | llm3 | StrOutputParser()
-    writing_chapters5_chain = writing_chapters5_prompt | llm3 | StrOutputParser()
-    revision_chain = revision_prompt | llm3 | StrOutputParser()
-
-    output_theme_selection = theme_selection_chain.invoke({"theme": theme})
-    st_callback.write(f"Theme Selection Output:\n{output_theme_selection}")
-    logger.info("Theme selection concluded")
-
-    output_theme_research = theme_research_chain.invoke({"theme": theme})
-    st_callback.write(f"Theme Research Output:\n{output_theme_research}")
-    logger.info("Theme research concluded")
-
-    output_theme_exploration = theme_exploration_chain.invoke({"theme": theme, "theme_research_results": output_theme_research})
-    st_callback.write(f"Theme Exploration Output:\n{output_theme_exploration}")
-    logger.info("Theme exploration concluded")
-
-    output_key_takeaways = key_takeaways_chain.invoke({"theme": theme, "theme_exploration_results": output_theme_exploration})
-    st_callback.write(f"Key Takeaways Output:\n{output_key_takeaways}")
-    logger.info("Key takeaways concluded")
-
-    output_book_structure = book_structure_chain.invoke({"theme": theme, "key_takeaways_results": output_key_takeaways})
-    st_callback.write(f"Book Structure Output:\n{output_book_structure}")
-    logger.info("Book structure concluded")
-
-    output_chapter_outlines = chapter_outlines_chain.invoke({"book_structure": output_book_structure})
-    st_callback.write(f"Chapter Outlines Output:\n{output_chapter_outlines}")
-    logger.info("Chapter outlines concluded")
-
-    alignment = alignment_chapters_chain.invoke({"chapter_outlines": output_chapter_outlines})
-    st_callback.write(f"Alignment Output:\n{alignment}")
-    logger.info("Alignment concluded")
-
-    output_writing_chapters = writing_chapters_chain.invoke({"chapter_outlines": output_chapter_outlines, "alignment": alignment})
-    st_callback.write(f"Writing Chapters Output:\n{output_writing_chapters}")
-    logger.info("Writing chapters concluded")
-
-    output_writing_chapters2 = writing_chapters2_chain.invoke({"chapter_outlines": output_chapter_outlines, "alignment": alignment})
-    st_callback.write(f"Writing Chapters 2 Output:\n{output_writing_chapters2}")
-    logger.info("Writing chapters 2 concluded")
-
-    output_writing_chapters3 = writing_chapters3_chain.invoke({"chapter_outlines": output_chapter_outlines, "alignment": alignment})
-    st_callback.write(f"Writing Chapters 3 Output:\n{output_writing_chapters3}")
-    logger.info("Writing chapters 3 concluded")
-
-    output_writing_chapters4 = writing_chapters4_chain.invoke({"chapter_outlines": output_chapter_outlines, "alignment": alignment})
-    st_callback.write(f"Writing Chapters 4 Output:\n{output_writing_chapters4}")
-    logger.info("Writing chapters 4 concluded")
-
-    output_writing_chapters5 = writing_chapters5_chain.invoke({"chapter_outlines": output_chapter_outlines, "alignment": alignment})
-    st_callback.write(f"Writing Chapters 5 Output:\n{output_writing_chapters5}")
-    logger.info("Writing chapters 5 concluded")
-
-    revision = revision_chain.invoke({"writing_chapters": output_writing_chapters, "writing_chapters2": output_writing_chapters2, "writing_chapters3": output_writing_chapters3, "writing_chapters4": output_writing_chapters4, "writing_chapters5": output_writing_chapters5, "alignment": alignment})
-    st_callback.write(f"Revision Output:\n{revision}")
-    logger.info("Revision concluded")
-
-    total_time = time.time() - start_time
-    st_callback.write(f"Total Processing Time: {total_time} seconds")
+    theme_selection_chain = pack(theme_selection_prompt, llm1) | llm1 | StrOutputParser()
+    theme_research_chain = pack(theme_research_prompt, llm1) | llm1 | StrOutputParser()
+    theme_exploration_chain = pack(theme_exploration_prompt, llm3) | llm3 | StrOutputParser()
+    key_takeaways_chain = pack(key_takeaways_prompt, llm3) | llm3 | StrOutputParser()
+    book_structure_chain = pack(book_structure_prompt, llm1) | llm1 | StrOutputParser()
+    chapter_outlines_chain = pack(chapter_outlines_prompt, llm1) | llm1 | StrOutputParser()
+    alignment_chapters_chain = pack(alignment_chapters_prompt, llm3) | llm3 | StrOutputParser()
+    # Each writing chain only receives the outline sections of its own chapters. When over budget the
+    # alignment is cut before the outlines.
+    writing_sections = {"alignment": Section(priority=0), "chapter_outlines": Section(priority=1)}
+    writing_chapters_chain = outline_slicer([1, 2]) | pack(writing_chapters_prompt, llm3, writing_sections) | llm3 | StrOutputParser()
+    writing_chapters2_chain = outline_slicer([3, 4]) | pack(writing_chapters2_prompt, llm3, writing_sections) | llm3 | StrOutputParser()
+    writing_chapters3_chain = outline_slicer([5, 6]) | pack(writing_chapters3_prompt, llm3, writing_sections) | llm3 | StrOutputParser()
+    writing_chapters4_chain = outline_slicer([7, 8]) | pack(writing_chapters4_prompt, llm3, writing_sections) | llm3 | StrOutputParser()
+    writing_chapters5_chain = outline_slicer([9, 10]) | pack(writing_chapters5_prompt, llm3, writing_sections) | llm3 | StrOutputParser()
+    style_digest_chain = pack(style_digest_prompt, llm3) | llm3 | StrOutputParser()
+    consistency_chain = pack(consistency_prompt, llm3) | llm3 | StrOutputParser()
+
+    chapter_groups = [
+        ("writing_chapters", "chapters 1 and 2", [1, 2]),
+        ("writing_chapters2", "chapters 3 and 4", [3, 4]),
+        ("writing_chapters3", "chapters 5 and 6", [5, 6]),
+        ("writing_chapters4", "chapters 7 and 8", [7, 8]),
+        ("writing_chapters5", "chapters 9 and 10", [9, 10]),
+    ]
+
+    # Context tokens the writing prompts send now, against interpolating the alignment three times and the
+    # full outlines once in each of them
+    def writing_token_savings(chapter_outlines, alignment):
+        repeated = len(chapter_groups) * (3 * estimate_tokens(alignment) + estimate_tokens(chapter_outlines))
+        assembled = sum(estimate_tokens(alignment) + estimate_tokens(outline_slice(chapter_outlines, numbers))
+                        for _, _, numbers in chapter_groups)
+        saved = repeated - assembled
+        logger.info(f"Writing prompts saved {saved} of {repeated} context tokens")
+        return f"{saved} of {repeated} estimated context tokens saved ({saved / max(repeated, 1):.0%})"
+
+    # Each chapter is revised and summarized independently, in parallel with the others, from its part of the
+    # group's draft. The revision answers with the whole chapter, so half of the context window is kept for it.
+    # The revisions are the last calls before the book is shown, a slow one is hedged on Claude Haiku within the
+    # run's hedge budget.
+    hedge_budget = HedgeBudget()
+    revision_sections = {"style_digest": Section(priority=0), "draft": Section(priority=1)}
+    revision_reserve = context_window(llm3) // 2
+    chapters = [(draft, numbers, chapter) for draft, _, numbers in chapter_groups for chapter in numbers]
+    revision_stages = []
+
+    # Chapters missing from their group's draft stay empty instead of being sent to the model
+    def unless_empty(variable, chain):
+        return RunnableBranch((lambda inputs: not inputs[variable].strip(), RunnableLambda(lambda inputs: "")), chain)
+
+    for draft, numbers, chapter in chapters:
+        revision_chain = pack(revision_prompt.partial(chapters=f"chapter {chapter}"), llm3, revision_sections,
+                              reserve_output=revision_reserve) | hedged("llm3", "llm6", hedge_budget) | StrOutputParser()
+        summary_chain = pack(chapter_summary_prompt.partial(chapters=f"chapter {chapter}"), llm3) | llm3 | StrOutputParser()
+        revision_stages += [
+            Stage(f"chapter{chapter}_revision", draft_slicer(numbers, chapter) | unless_empty("draft", revision_chain),
+                  {"draft": draft, "style_digest": "style_digest"},
+                  retries=CHAPTER_WRITING_MAX_RETRIES, retry_on=(AllModelsFailed,)),
+            Stage(f"chapter{chapter}_summary", unless_empty("revised", summary_chain),
+                  {"revised": f"chapter{chapter}_revision"},
+                  retries=CHAPTER_WRITING_MAX_RETRIES, retry_on=(AllModelsFailed,)),
+        ]
+    revised_chapters = [f"chapter{chapter}_revision" for _, _, chapter in chapters]
+    summaries = [f"chapter{chapter}_summary" for _, _, chapter in chapters]
+
+    def join_summaries(**summary_outputs):
+        return "\n".join(f"- chapter {chapter}: {summary_outputs[name]}"
+                         for name, (_, _, chapter) in zip(summaries, chapters) if summary_outputs[name])
+
+    def assemble_book(**revised_outputs):
+        return "\n\n".join(revised_outputs[name] for name in revised_chapters if revised_outputs[name])
+
+    # Pipeline graph: each stage reads the outputs it needs, independent stages run in parallel
+    writing_inputs = ["chapter_outlines", "alignment"]
+    pipeline = Pipeline([
+        Stage("theme_selection", theme_selection_chain, ["theme"], title="Theme Selection Output"),
+        Stage("theme_research", theme_research_chain, ["theme"], title="Theme Research Output"),
+        Stage("theme_exploration", theme_exploration_chain, {"theme": "theme", "theme_research_results": "theme_research"},
+              title="Theme Exploration Output"),
+        Stage("key_takeaways", key_takeaways_chain, {"theme": "theme", "theme_exploration_results": "theme_exploration"},
+              title="Key Takeaways Output"),
+        Stage("book_structure", book_structure_chain, {"theme": "theme", "key_takeaways_results": "key_takeaways"},
+              title="Book Structure Output"),
+        Stage("chapter_outlines", chapter_outlines_chain, ["book_structure"], title="Chapter Outlines Output"),
+        Stage("alignment", alignment_chapters_chain, ["chapter_outlines"], title="Alignment Output"),
+        # Each chapter group keeps its own rate-limit retries, a failure does not affect the others
+        Stage("writing_chapters", writing_chapters_chain, writing_inputs, title="Writing Chapters Output",
+              retries=CHAPTER_WRITING_MAX_RETRIES, retry_on=(AllModelsFailed,)),
+        Stage("writing_chapters2", writing_chapters2_chain, writing_inputs, title="Writing Chapters 2 Output",
+              retries=CHAPTER_WRITING_MAX_RETRIES, retry_on=(AllModelsFailed,)),
+        Stage("writing_chapters3", writing_chapters3_chain, writing_inputs, title="Writing Chapters 3 Output",
+              retries=CHAPTER_WRITING_MAX_RETRIES, retry_on=(AllModelsFailed,)),
+        Stage("writing_chapters4", writing_chapters4_chain, writing_inputs, title="Writing Chapters 4 Output",
+              retries=CHAPTER_WRITING_MAX_RETRIES, retry_on=(AllModelsFailed,)),
+        Stage("writing_chapters5", writing_chapters5_chain, writing_inputs, title="Writing Chapters 5 Output",
+              retries=CHAPTER_WRITING_MAX_RETRIES, retry_on=(AllModelsFailed,)),
+        Stage("writing_token_savings", writing_token_savings, writing_inputs, title="Writing Prompt Token Savings"),
+        Stage("style_digest", style_digest_chain, ["alignment"]),
+        *revision_stages,
+        Stage("summaries", join_summaries, summaries),
+        Stage("consistency", consistency_chain, ["summaries", "style_digest"], title="Consistency Notes"),
+        Stage("revision", assemble_book, revised_chapters, title="Revision Output"),
+    ], max_workers=MAX_WORKERS)
+
+    # Stage outputs are checkpointed per theme, a rerun resumes from the first missing or failed stage
+    run_id = f"bookgen-{content_hash(theme)[:16]}"
+    run_store = RunStore()
+    if not resume:
+        run_store.clear(run_id)
+
+    inputs = {"theme": theme}
+    if chapter_outlines:
+        # Only the stages downstream of the edited outlines are regenerated
+        inputs["chapter_outlines"] = chapter_outlines
+
+    result = run_in_streamlit(pipeline, inputs, st_callback, stream=stream, store=run_store, run_id=run_id,
+                              telemetry=Telemetry("BookGen"))
     logger.info("Book generation concluded")
+    return result
 
 
 # Streamlit interface
-st.title("Book Generator")
-theme = st.text_input("Enter the book theme:")
-
-if st.button("Generate Book"):
-    with st.spinner("Generating book..."):
-        st_callback = st.container()
-        run_pipeline(theme, st_callback)
+def main():
+    st.title("Book Generator")
+    theme = st.text_input("Enter the book theme:")
+    stream = st.checkbox("Stream output", value=True)
+    resume = st.checkbox("Resume the previous run for this theme", value=True)
+    with st.expander("Edit chapter outlines"):
+        chapter_outlines = st.text_area("Replace the generated chapter outlines (optional):", height=200)
+
+    if st.button("Generate Book"):
+        if JOB_SERVER_URL:
+            # The job server runs the book, reruns of this page only poll it
+            st.session_state.job_id = submit_job("bookgen", {"theme": theme, "resume": resume,
+                                                             "chapter_outlines": chapter_outlines})
+        else:
+            with st.spinner("Generating book..."):
+                st_callback = st.container()
+                run_pipeline(theme, st_callback, stream, resume, chapter_outlines)
+
+    if JOB_SERVER_URL and st.session_state.get("job_id"):
+        follow_job(st.container(), st.session_state.job_id)
+
+
+if __name__ == "__main__":
+    main()
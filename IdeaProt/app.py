@@ -1,23 +1,31 @@
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from langchain_anthropic import ChatAnthropic, Anthropic
 from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
-import os
+from langchain_core.messages import messages_from_dict, messages_to_dict
+from utils.llms import get_api_key
+from utils.run_store import content_hash
+from utils.memory import RollingSummaryMemory
+from utils.telemetry import Telemetry
+from store import ProjectStore, ARTIFACT_FIELDS
 
-# Set up Anthropic API key
-def get_api_keys():
-    return {"anthropic_api_key": "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"}
 # Initialize Langchain with Anthropic's LLM
-llm = Anthropic(temperature=0.7)
-conversation = ConversationChain(
-    llm=llm,
-    memory=ConversationBufferMemory(),
-    api_key=anthropic_api_key
-)
+llm = Anthropic(temperature=0.7, anthropic_api_key=get_api_key("anthropic"))
 
 # Streamlit app
 st.set_page_config(page_title="AI Module Idea Explorer", layout="wide")
 
+
+@st.cache_resource
+def project_store():
+    return ProjectStore()
+
+
+store = project_store()
+
 # Initialize session state
 if 'phase' not in st.session_state:
     st.session_state.phase = "home"
@@ -29,15 +37,106 @@ if 'prd' not in st.session_state:
     st.session_state.prd = ""
 if 'prototype' not in st.session_state:
     st.session_state.prototype = ""
+if 'telemetry' not in st.session_state:
+    st.session_state.telemetry = Telemetry("IdeaProt")
+# The conversation lives in the session so its memory survives reruns. Older turns are summarized, so every
+# prompt carries about the same amount of history however long the session runs.
+if 'conversation' not in st.session_state:
+    st.session_state.conversation = ConversationChain(llm=llm, memory=RollingSummaryMemory(llm=llm))
+# Idea hash -> feedback, so every idea is answered once however often the page reruns
+if 'responses' not in st.session_state:
+    st.session_state.responses = {}
+# Project values as last written to the store
+if 'saved' not in st.session_state:
+    st.session_state.saved = {}
+
+
+# Values the project store keeps, memory included so a resumed conversation needs no model call
+def project_state():
+    memory = st.session_state.conversation.memory
+    return {
+        "phase": st.session_state.phase,
+        "ideas": st.session_state.ideas,
+        "responses": st.session_state.responses,
+        "plan": st.session_state.plan,
+        "prd": st.session_state.prd,
+        "prototype": st.session_state.prototype,
+        "memory_summary": memory.moving_summary_buffer,
+        "memory_messages": messages_to_dict(memory.chat_memory.messages),
+    }
+
+
+# Restores the project in the page's URL (?project=<id>) into the session, replacing the one open before. The PRD
+# and prototype stay in the store until the output phase asks for them, the previous project's are dropped.
+def open_project(project_id):
+    state = store.load(project_id)
+    if state is None:
+        st.query_params.clear()
+        return
+    memory = st.session_state.conversation.memory
+    memory.moving_summary_buffer = state.pop("memory_summary")
+    memory.chat_memory.messages = messages_from_dict(state.pop("memory_messages"))
+    for field, value in state.items():
+        st.session_state[field] = value
+    for field in ARTIFACT_FIELDS:
+        st.session_state[field] = ""
+    st.session_state.project_id = project_id
+    st.session_state.saved = copy.deepcopy(project_state())
+
+
+# Writes the fields that changed since the last save
+def save_project():
+    if not st.session_state.get("project_id"):
+        return
+    changed = {field: value for field, value in project_state().items() if st.session_state.saved.get(field) != value}
+    if changed:
+        store.save(st.session_state.project_id, **changed)
+        st.session_state.saved.update(copy.deepcopy(changed))
+
+
+def stored_artifact(name):
+    if not st.session_state[name] and st.session_state.get("project_id"):
+        st.session_state[name] = store.artifact(st.session_state.project_id, name)
+        st.session_state.saved[name] = st.session_state[name]
+    return st.session_state[name]
+
+
+if st.query_params.get("project") and st.session_state.get("project_id") != st.query_params["project"]:
+    open_project(st.query_params["project"])
+
+
+# Conversation turn, recorded under the given stage name
+def predict(stage, prompt):
+    return st.session_state.conversation.invoke({"input": prompt}, st.session_state.telemetry.config(stage))["response"]
+
+
+def idea_feedback(idea):
+    key = content_hash(idea)
+    if key not in st.session_state.responses:
+        with st.spinner("AI is thinking..."):
+            st.session_state.responses[key] = predict(
+                "feedback", f"Provide feedback and suggestions for this AI project idea: {idea}")
+    return st.session_state.responses[key]
 
 
 # Home screen
 def home_screen():
     st.title("AI Module Idea Explorer")
     if st.button("Start Brainstorming"):
+        st.session_state.project_id = store.create()
+        st.query_params["project"] = st.session_state.project_id
         st.session_state.phase = "brainstorming"
         st.rerun()
 
+    projects = store.recent()
+    if projects:
+        st.subheader("Recent Projects")
+    for project in projects:
+        ideas = ", ".join(project["ideas"][:3]) or "No ideas yet"
+        if st.button(f"Resume: {ideas} ({project['phase']})", key=f"resume-{project['id']}"):
+            st.query_params["project"] = project["id"]
+            st.rerun()
+
 
 # Brainstorming phase
 def brainstorming_phase():
@@ -47,17 +146,19 @@ def brainstorming_phase():
     with st.sidebar:
         st.subheader("Session Info")
         st.write(f"Ideas generated: {len(st.session_state.ideas)}")
+        st.write(f"Conversation memory: {st.session_state.conversation.memory.token_footprint} tokens")
 
-    # Main chat area
-    for idea in st.session_state.ideas:
+    # Main chat area, only ideas without a stored answer reach the model
+    for index, idea in enumerate(st.session_state.ideas):
         st.text(f"You: {idea}")
-        with st.spinner("AI is thinking..."):
-            response = conversation.predict(input=f"Provide feedback and suggestions for this AI project idea: {idea}")
-        st.text(f"AI: {response}")
+        st.text(f"AI: {idea_feedback(idea)}")
+        if st.button("Regenerate", key=f"regenerate-{index}"):
+            st.session_state.responses.pop(content_hash(idea), None)
+            st.rerun()
 
     # Input field
     new_idea = st.text_input("Enter your AI project idea:")
-    if st.button("Send"):
+    if st.button("Send") and new_idea.strip():
         st.session_state.ideas.append(new_idea)
         st.rerun()
 
@@ -90,7 +191,7 @@ def planning_phase():
     if st.button("Generate Plan"):
         prompt = f"Generate a comprehensive plan based on these ideas: {st.session_state.ideas}, steps: {steps}, and milestones: {milestones}"
         with st.spinner("Generating plan..."):
-            st.session_state.plan = conversation.predict(input=prompt)
+            st.session_state.plan = predict("plan", prompt)
         st.rerun()
 
     if st.session_state.plan:
@@ -102,44 +203,83 @@ def planning_phase():
         st.rerun()
 
 
+# Streams the answers to independent prompts (name -> (prompt, placeholder)) at the same time. They all see the
+# same snapshot of the conversation and are added to the memory once every one is done, in order.
+def generate_in_parallel(requests):
+    conversation = st.session_state.conversation
+    history = conversation.memory.load_memory_variables({})[conversation.memory.memory_key]
+    configs = {name: st.session_state.telemetry.config(name) for name in requests}
+    ctx = get_script_run_ctx()
+
+    def generate(name, prompt, placeholder):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        text = ""
+        for chunk in llm.stream(conversation.prompt.format(history=history, input=prompt), configs[name]):
+            text += chunk
+            placeholder.write(f"{text}▌")
+        placeholder.write(text)
+        return text
+
+    with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+        futures = {name: executor.submit(generate, name, prompt, placeholder)
+                   for name, (prompt, placeholder) in requests.items()}
+    # A failed document is reported in its tab, the other one is still kept and saved
+    for name, future in futures.items():
+        try:
+            st.session_state[name] = future.result()
+        except Exception as e:
+            requests[name][1].error(f"Could not generate this document, it is retried on the next run: {e}")
+            continue
+        conversation.memory.save_context({"input": requests[name][0]}, {"response": st.session_state[name]})
+
+
 # Output phase
 def output_phase():
     st.title("Output")
 
     tab1, tab2 = st.tabs(["Product Requirements Document", "Prototype Example"])
+    documents = {
+        "prd": (tab1, f"Generate a detailed Product Requirements Document based on these ideas: {st.session_state.ideas} and this plan: {st.session_state.plan}",
+                "Download PRD", "product_requirements_document.txt"),
+        "prototype": (tab2, f"Generate a prototype example description based on these ideas: {st.session_state.ideas} and this plan: {st.session_state.plan}",
+                      "Download Prototype Example", "prototype_example.txt"),
+    }
+
+    # Documents already in the session or the project store are shown as they are, the others are generated
+    placeholders = {name: tab.empty() for name, (tab, _, _, _) in documents.items()}
+    missing = {}
+    for name, (_, prompt, _, _) in documents.items():
+        if stored_artifact(name):
+            placeholders[name].write(st.session_state[name])
+        else:
+            missing[name] = (prompt, placeholders[name])
+    if missing:
+        generate_in_parallel(missing)
 
-    with tab1:
-        if not st.session_state.prd:
-            with st.spinner("Generating PRD..."):
-                prd_prompt = f"Generate a detailed Product Requirements Document based on these ideas: {st.session_state.ideas} and this plan: {st.session_state.plan}"
-                st.session_state.prd = conversation.predict(input=prd_prompt)
-        st.write(st.session_state.prd)
-        st.download_button("Download PRD", st.session_state.prd, "product_requirements_document.txt")
-
-    with tab2:
-        if not st.session_state.prototype:
-            with st.spinner("Generating Prototype Example..."):
-                prototype_prompt = f"Generate a prototype example description based on these ideas: {st.session_state.ideas} and this plan: {st.session_state.plan}"
-                st.session_state.prototype = conversation.predict(input=prototype_prompt)
-        st.write(st.session_state.prototype)
-        st.download_button("Download Prototype Example", st.session_state.prototype, "prototype_example.txt")
+    for name, (tab, _, label, file_name) in documents.items():
+        if st.session_state[name]:
+            tab.download_button(label, st.session_state[name], file_name)
 
     if st.button("Start New Project"):
         for key in list(st.session_state.keys()):
             del st.session_state[key]
+        st.query_params.clear()
         st.rerun()
 
 
-# Main app logic
+# Main app logic. Saving also runs when a phase stops the script with st.rerun().
 def main():
-    if st.session_state.phase == "home":
-        home_screen()
-    elif st.session_state.phase == "brainstorming":
-        brainstorming_phase()
-    elif st.session_state.phase == "planning":
-        planning_phase()
-    elif st.session_state.phase == "output":
-        output_phase()
+    try:
+        if st.session_state.phase == "home":
+            home_screen()
+        elif st.session_state.phase == "brainstorming":
+            brainstorming_phase()
+        elif st.session_state.phase == "planning":
+            planning_phase()
+        elif st.session_state.phase == "output":
+            output_phase()
+    finally:
+        save_project()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+import os
+import time
+import uuid
+import logging
+from sqlalchemy import create_engine, select, update, String, Text, Float, JSON
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+logger = logging.getLogger(__name__)
+
+PROJECT_STORE_URL = os.environ.get(
+    "PROJECT_STORE_URL", f"sqlite:///{os.path.expanduser('~/.cache/personall/ideaprot.sqlite')}")
+
+# Fields a project keeps across restarts. The generated documents are large and only needed by the output
+# phase, they are loaded on first use.
+STATE_FIELDS = ["phase", "ideas", "responses", "plan", "memory_summary", "memory_messages"]
+ARTIFACT_FIELDS = ["prd", "prototype"]
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Project(Base):
+    __tablename__ = "projects"
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    phase: Mapped[str] = mapped_column(String(32), default="brainstorming")
+    ideas: Mapped[list] = mapped_column(JSON, default=list)
+    responses: Mapped[dict] = mapped_column(JSON, default=dict)
+    plan: Mapped[str] = mapped_column(Text, default="")
+    memory_summary: Mapped[str] = mapped_column(Text, default="")
+    memory_messages: Mapped[list] = mapped_column(JSON, default=list)
+    prd: Mapped[str] = mapped_column(Text, default="", deferred=True)
+    prototype: Mapped[str] = mapped_column(Text, default="", deferred=True)
+    created_at: Mapped[float] = mapped_column(Float)
+    updated_at: Mapped[float] = mapped_column(Float)
+
+
+class ProjectStore:
+    def __init__(self, url=PROJECT_STORE_URL):
+        if url.startswith("sqlite:///"):
+            os.makedirs(os.path.dirname(os.path.abspath(url[len("sqlite:///"):])), exist_ok=True)
+        self.engine = create_engine(url)
+        Base.metadata.create_all(self.engine)
+
+    def create(self):
+        project_id = uuid.uuid4().hex
+        now = time.time()
+        with Session(self.engine) as session, session.begin():
+            session.add(Project(id=project_id, created_at=now, updated_at=now))
+        return project_id
+
+    # STATE_FIELDS of a project, or None when it does not exist
+    def load(self, project_id):
+        with Session(self.engine) as session:
+            project = session.get(Project, project_id)
+            return None if project is None else {field: getattr(project, field) for field in STATE_FIELDS}
+
+    def artifact(self, project_id, name):
+        with Session(self.engine) as session:
+            return session.scalar(select(getattr(Project, name)).where(Project.id == project_id)) or ""
+
+    # Writes the given fields only, callers pass what changed
+    def save(self, project_id, **fields):
+        if not fields:
+            return
+        with Session(self.engine) as session, session.begin():
+            session.execute(update(Project).where(Project.id == project_id).values(**fields, updated_at=time.time()))
+        logger.info(f"Saved {', '.join(fields)} of project {project_id}")
+
+    def recent(self, limit=10):
+        with Session(self.engine) as session:
+            rows = session.execute(select(Project.id, Project.phase, Project.ideas, Project.updated_at)
+                                   .order_by(Project.updated_at.desc()).limit(limit))
+            return [row._asdict() for row in rows]
+
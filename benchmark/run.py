@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import tempfile
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Every store the apps write to lives in a scratch directory, set before the utils modules read their settings
+WORKDIR = tempfile.mkdtemp(prefix="personall-benchmark-")
+for variable, name in [("TELEMETRY_DIR", "telemetry"), ("RUN_STORE_PATH", "runs.sqlite"),
+                       ("LLM_CACHE_PATH", "llm_cache.sqlite"), ("RATE_LIMIT_PATH", "rate_limits.sqlite"),
+                       ("FUNDAMENTALS_CACHE_PATH", "fundamentals.parquet"),
+                       ("SEARCH_CACHE_PATH", "search_cache.sqlite")]:
+    os.environ[variable] = os.path.join(WORKDIR, name)
+
+from utils import llms
+from utils.search import set_search_backend, DuckDuckGoBackend
+from utils.telemetry import TELEMETRY_DIR, EVENTS_FILE
+from utils.headless import NullContainer, load_app
+from utils.hedging import hedged
+from utils.rate_limiter import SharedRateLimiter
+from benchmark.simulated import SimulatedChatModel, SimulatedSearch, Cassette, MODEL_PROFILES, SEARCH_PROFILE
+
+logger = logging.getLogger(__name__)
+
+APPS = ["BookGen", "financial_wizard1", "financial_wizard_2", "AILawyer"]
+
+THEME = "The history and future of renewable energy"
+COMPANY = "Petrobras"
+FACTS = "The client was dismissed without notice after eight years of work and was not paid overtime."
+
+
+# Hedged calls whose primary is stuck behind its rate limit (a drained 1 RPM bucket) while other hedged calls run
+# alongside. Every call has to be answered by the backup shortly after the hedge delay; fails the benchmark otherwise.
+def hedging_throttled(apps, stream, calls=4, delay=0.2):
+    factory = llms._client_factory
+    limiter = SharedRateLimiter("throttled", 1, 10 ** 6, path=os.path.join(WORKDIR, f"throttled-{time.time_ns()}.sqlite"))
+    limiter.acquire()
+
+    def client(name, spec):
+        model = factory(name, spec)
+        if name == "llm3":
+            model.rate_limiter = limiter
+        return model
+
+    llms.set_client_factory(client)
+    model = hedged("llm3", "llm6", delay=delay)
+    started_at = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=calls) as executor:
+            answers = list(executor.map(lambda index: model.invoke(f"Hedged call {index}").content, range(calls)))
+    finally:
+        # Lets the abandoned primaries through, so their threads do not hold the process open
+        limiter.requests_per_minute = 10 ** 6
+        llms.set_client_factory(factory)
+    elapsed = time.time() - started_at
+    backup = llms.MODELS["llm6"]["model"]
+    if elapsed > 10 * delay + 2 or not all(answer.startswith(f"Simulated {backup}") for answer in answers):
+        raise RuntimeError(f"Throttled primary was not hedged: {calls} calls took {elapsed:.2f}s, "
+                           f"answers {[answer[:40] for answer in answers]}")
+
+
+SCENARIOS = {
+    "bookgen": lambda apps, stream: apps["BookGen"].run_pipeline(THEME, NullContainer(), stream, resume=False),
+    "financial_wizard1": lambda apps, stream: apps["financial_wizard1"].run_pipeline(THEME, stream),
+    "financial_wizard_2": lambda apps, stream: apps["financial_wizard_2"].run_pipeline(COMPANY, stream),
+    "ailawyer_new": lambda apps, stream: apps["AILawyer"].new_lawsuit_research_section(
+        NullContainer(), "Wrongful dismissal", FACTS, []),
+    "ailawyer_existing": lambda apps, stream: apps["AILawyer"].existing_lawsuit_research_section(
+        NullContainer(), "Overturn the dismissal ruling", "CLT articles 59 and 477", "Initial petition and response"),
+    "hedging_throttled": hedging_throttled,
+}
+
+
+def install_stand_ins(args):
+    cassette = Cassette(args.cassette) if args.mode != "simulate" else None
+    scale = args.time_scale
+
+    def client(name, spec):
+        profile = MODEL_PROFILES.get(spec["model"])
+        if args.error_rate is not None and profile is not None:
+            profile = type(profile)(**{**profile.__dict__, "error_rate": args.error_rate})
+        recorded = llms._build(name) if args.mode == "record" else None
+        return SimulatedChatModel(model_name=spec["model"], profile=profile, seed=args.seed, time_scale=scale,
+                                  cassette=cassette, mode=args.mode, recorded=recorded)
+
+    llms.set_client_factory(client)
+    set_search_backend(lambda: SimulatedSearch(SEARCH_PROFILE, args.seed, scale, cassette, args.mode,
+                                               DuckDuckGoBackend() if args.mode == "record" else None))
+
+
+def read_events(offset):
+    path = os.path.join(TELEMETRY_DIR, EVENTS_FILE)
+    if not os.path.exists(path):
+        return [], offset
+    with open(path) as events:
+        events.seek(offset)
+        lines = events.readlines()
+        return [json.loads(line) for line in lines], events.tell()
+
+
+def summarize(name, events, elapsed):
+    runs = [event for event in events if event["kind"] == "run"]
+    calls = [event for event in events if event["kind"] == "llm_call"]
+    walls = [run["wall_time"] for run in runs] or elapsed
+    output_tokens = sum(call["output_tokens"] for call in calls)
+    return {
+        "scenario": name,
+        "runs": len(runs),
+        "wall_mean": statistics.mean(walls),
+        "wall_max": max(walls),
+        "critical_path": runs[-1]["critical_path"] if runs else [],
+        "critical_path_time": statistics.mean(run["critical_path_time"] for run in runs) if runs else 0.0,
+        "llm_calls": len(calls),
+        "llm_errors": sum(1 for call in calls if call["error"]),
+        "input_tokens": sum(call["input_tokens"] for call in calls),
+        "output_tokens": output_tokens,
+        "output_tokens_per_second": output_tokens / max(sum(walls), 1e-9),
+    }
+
+
+def report(results):
+    print(f"{'scenario':<20} {'runs':>4} {'wall s':>8} {'max s':>8} {'crit s':>8} {'calls':>6} {'errors':>6} "
+          f"{'tok in':>8} {'tok out':>8} {'out tok/s':>10}")
+    for result in results:
+        print(f"{result['scenario']:<20} {result['runs']:>4} {result['wall_mean']:>8.2f} {result['wall_max']:>8.2f} "
+              f"{result['critical_path_time']:>8.2f} {result['llm_calls']:>6} {result['llm_errors']:>6} "
+              f"{result['input_tokens']:>8} {result['output_tokens']:>8} {result['output_tokens_per_second']:>10.1f}")
+        print(f"{'':<20} critical path: {' -> '.join(result['critical_path'])}")
+
+
+# Scenarios whose mean wall time grew by more than `tolerance` over the baseline
+def regressions(results, baseline, tolerance):
+    previous = {result["scenario"]: result for result in baseline}
+    slower = []
+    for result in results:
+        before = previous.get(result["scenario"])
+        if before and result["wall_mean"] > before["wall_mean"] * (1 + tolerance):
+            slower.append(f"{result['scenario']}: {before['wall_mean']:.2f}s -> {result['wall_mean']:.2f}s")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the app pipelines offline on simulated models and search")
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS), help=f"any of {', '.join(SCENARIOS)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stream", action="store_true", help="run the stages in streaming mode")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="multiplier applied to every simulated delay")
+    parser.add_argument("--error-rate", type=float, default=None, help="override every model's error rate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", choices=["simulate", "record", "replay"], default="simulate")
+    parser.add_argument("--cassette", default=os.path.join(ROOT, "benchmark", "cassette.jsonl"))
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios {unknown}")
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    apps = {name: load_app(name) for name in APPS}
+    install_stand_ins(args)
+
+    results = []
+    offset = 0
+    for name in args.scenarios:
+        _, offset = read_events(offset)
+        elapsed = []
+        for _ in range(args.repeat):
+            started_at = time.time()
+            SCENARIOS[name](apps, args.stream)
+            elapsed.append(time.time() - started_at)
+        events, offset = read_events(offset)
+        results.append(summarize(name, events, elapsed))
+
+    report(results)
+    if args.save:
+        with open(args.save, "w") as saved:
+            json.dump(results, saved, indent=2)
+    if args.baseline:
+        with open(args.baseline) as saved:
+            slower = regressions(results, json.load(saved), args.tolerance)
+        if slower:
+            print("Throughput regressions:\n  " + "\n  ".join(slower))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
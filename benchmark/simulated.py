@@ -0,0 +1,208 @@
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+_WORDS = ("market growth revenue chapter analysis strategy research evidence customer risk margin policy "
+          "history outcome trend court decision context argument value report summary detail").split()
+
+
+# Latency and reliability of a simulated model or search backend. Times are medians of log-normal draws,
+# in seconds; `time_scale` shrinks every sleep so a benchmark does not take as long as a real run.
+@dataclass
+class Profile:
+    first_token: float = 0.4
+    first_token_sigma: float = 0.5
+    tokens_per_second: float = 250.0
+    output_tokens: int = 300
+    output_tokens_sigma: float = 0.3
+    error_rate: float = 0.0
+    error_status: int = 503
+
+
+# Groq serves fast and small, Anthropic slower with a longer time to first token
+MODEL_PROFILES = {
+    "llama3-70b-8192": Profile(first_token=0.5, tokens_per_second=250),
+    "llama3-8b-8192": Profile(first_token=0.2, tokens_per_second=800),
+    "llama3-groq-8b-8192-tool-use-preview": Profile(first_token=0.25, tokens_per_second=700),
+    "gemma2-9b-it": Profile(first_token=0.25, tokens_per_second=600),
+    "claude-3-opus-20240229": Profile(first_token=2.0, tokens_per_second=25, output_tokens=500),
+    "claude-3-sonnet-20240229": Profile(first_token=1.0, tokens_per_second=60, output_tokens=500),
+    "claude-3-haiku-20240307": Profile(first_token=0.6, tokens_per_second=120, output_tokens=400),
+}
+SEARCH_PROFILE = Profile(first_token=1.2, first_token_sigma=0.6, tokens_per_second=0, output_tokens=400)
+
+
+# Carries a status code like the provider SDK errors, so the router treats it as transient
+class SimulatedError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"Simulated {status_code} error")
+        self.status_code = status_code
+
+
+def _key(*parts):
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+# Prompt -> response pairs captured from real models and searches, one JSON object per line
+class Cassette:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path) as cassette:
+                for line in cassette:
+                    entry = json.loads(line)
+                    self.entries[entry["key"]] = entry["response"]
+        except FileNotFoundError:
+            pass
+
+    def get(self, *parts):
+        return self.entries.get(_key(*parts))
+
+    def put(self, response, *parts):
+        key = _key(*parts)
+        with self._lock:
+            self.entries[key] = response
+            with open(self.path, "a") as cassette:
+                cassette.write(json.dumps({"key": key, "response": response}) + "\n")
+
+
+class _Simulation:
+    def __init__(self, profile, seed, time_scale):
+        self.profile = profile
+        self.time_scale = time_scale
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        profile = self.profile
+        with self._lock:
+            failed = self.random.random() < profile.error_rate
+            first_token = self.random.lognormvariate(0, profile.first_token_sigma) * profile.first_token
+            tokens = max(1, int(self.random.lognormvariate(0, profile.output_tokens_sigma) * profile.output_tokens))
+            words = [self.random.choice(_WORDS) for _ in range(tokens)]
+        return failed, first_token, words
+
+    def sleep(self, seconds):
+        time.sleep(seconds * self.time_scale)
+
+
+# Chat model with the latency, throughput and error profile of a real one. With a cassette in "replay" mode,
+# recorded responses are served with simulated timing; in "record" mode calls go to `recorded` (the real client)
+# and are written to the cassette.
+class SimulatedChatModel(BaseChatModel):
+    model_name: str
+    profile: Any = None
+    seed: int = 0
+    time_scale: float = 1.0
+    cassette: Any = None
+    mode: str = "simulate"
+    recorded: Any = None
+    simulation: Any = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.profile = self.profile or MODEL_PROFILES.get(self.model_name, Profile())
+        self.simulation = _Simulation(self.profile, self.seed, self.time_scale)
+
+    @property
+    def _llm_type(self):
+        return "simulated"
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": self.model_name}
+
+    def _get_ls_params(self, stop=None, **kwargs):
+        return {"ls_provider": "simulated", "ls_model_name": self.model_name, "ls_model_type": "chat"}
+
+    def _prompt(self, messages):
+        return "\n".join(str(message.content) for message in messages)
+
+    def _response(self, prompt, words):
+        if self.mode == "record":
+            text = self.recorded.invoke(prompt).content
+            self.cassette.put(text, "llm", self.model_name, prompt)
+            return text
+        if self.mode == "replay":
+            text = self.cassette.get("llm", self.model_name, prompt)
+            if text is not None:
+                return text
+            logger.warning(f"No recording of this {self.model_name} prompt, simulating it")
+        return f"Simulated {self.model_name} response. " + " ".join(words)
+
+    def _message_args(self, prompt, text):
+        input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        return {"usage_metadata": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                   "total_tokens": input_tokens + output_tokens}}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = self._prompt(messages)
+        failed, first_token, words = self.simulation.draw()
+        self.simulation.sleep(first_token)
+        if failed:
+            raise SimulatedError(self.profile.error_status)
+        text = self._response(prompt, words)
+        if self.mode != "record" and self.profile.tokens_per_second:
+            self.simulation.sleep(estimate_tokens(text) / self.profile.tokens_per_second)
+        message = AIMessage(content=text, **self._message_args(prompt, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = self._prompt(messages)
+        failed, first_token, words = self.simulation.draw()
+        self.simulation.sleep(first_token)
+        if failed:
+            raise SimulatedError(self.profile.error_status)
+        text = self._response(prompt, words)
+        pieces = text.split(" ")
+        for index, piece in enumerate(pieces):
+            if index and self.mode != "record" and self.profile.tokens_per_second:
+                self.simulation.sleep(estimate_tokens(piece) / self.profile.tokens_per_second)
+            last = index == len(pieces) - 1
+            chunk = ChatGenerationChunk(message=AIMessageChunk(
+                content=piece + ("" if last else " "),
+                **(self._message_args(prompt, text) if last else {}),
+            ))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+# Stand-in for the DuckDuckGo search backend of utils.search
+class SimulatedSearch:
+    def __init__(self, profile=SEARCH_PROFILE, seed=0, time_scale=1.0, cassette=None, mode="simulate", recorded=None):
+        self.simulation = _Simulation(profile, seed, time_scale)
+        self.cassette = cassette
+        self.mode = mode
+        self.recorded = recorded
+
+    def search(self, text, kind, max_results):
+        failed, latency, words = self.simulation.draw()
+        if self.mode == "record":
+            results = self.recorded.search(text, kind, max_results)
+            self.cassette.put(results, "search", kind, text)
+            return results
+        self.simulation.sleep(latency)
+        if failed:
+            raise SimulatedError(self.simulation.profile.error_status)
+        if self.mode == "replay":
+            results = self.cassette.get("search", kind, text)
+            if results is not None:
+                return results
+            logger.warning(f"No recording of search {text!r}, simulating it")
+        snippets = [" ".join(words[start:start + 40]) for start in range(0, len(words), 40)][:max_results]
+        return [{"title": f"{text} {index}", "url": f"https://example.com/{kind}/{index}", "snippet": snippet,
+                 "date": "2026-01-01" if kind == "news" else None} for index, snippet in enumerate(snippets, start=1)]
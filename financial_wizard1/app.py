@@ -1,4 +1,3 @@
-import time
 import logging
 import streamlit as st
 from langchain_core.prompts import PromptTemplate
@@ -6,16 +5,25 @@ from langchain.agents import create_openai_tools_agent, AgentExecutor
 from langchain_groq import ChatGroq
 from langchain_core.output_parsers import StrOutputParser
 from langchain_community.callbacks.streamlit import StreamlitCallbackHandler
-from langchain_community.tools import DuckDuckGoSearchRun, DuckDuckGoSearchResults
-from utils.llms import llm1, llm2, llm3, llm4, llm5, llm6
+from utils.router import routed
+from utils.pipeline import Pipeline, Stage
+from utils.prompt_packer import pack, Section
+from utils.search import SearchService
+from utils.streaming import run_in_streamlit
+from utils.telemetry import Telemetry
+from utils.job_client import JOB_SERVER_URL, submit_job, follow_job
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+# Each stage prefers one model and fails over to its substitutes
+llm1 = routed("llm1")
+llm2 = routed("llm2")
+llm3 = routed("llm3")
+
 
 # Function to execute the pipeline
-def run_pipeline(theme):
-    start_time = time.time()
+def run_pipeline(theme, stream=True, container=st):
     logger.info("Iniciando o processamento da rota /podcast/generate/")
 
     # Define all prompts based on the content generation process
@@ -76,67 +84,71 @@ def run_pipeline(theme):
     twitter_prompt = PromptTemplate(input_variables=["theme"], template=twitter_prompt_template)
 
     # Define chains for each stage
-    planning_chain = planning_prompt | llm1 | StrOutputParser()
-    search_tool = DuckDuckGoSearchRun()
-
-    # Web search for research articles and books
-    research_articles_results = search_tool.run(f"articles and books about {theme}")
-    research_articles_chain = research_articles_prompt | llm2 | StrOutputParser()
-    research_articles_output = research_articles_chain.invoke({"theme": research_articles_results})
-
-    # Web search for research websites
-    research_websites_results = search_tool.run(f"websites about {theme}")
-    research_websites_chain = research_websites_prompt | llm3 | StrOutputParser()
-    research_websites_output = research_websites_chain.invoke({"theme": research_websites_results})
-
-    target_public_analysis_chain = target_public_analysis_prompt | llm1 | StrOutputParser()
-    language_adaptation_chain = language_adaptation_prompt | llm2 | StrOutputParser()
-    first_draft_chain = first_draft_prompt | llm3 | StrOutputParser()
-    keynote_chain = keynote_prompt | llm1 | StrOutputParser()
-    linkedin_chain = linkedin_prompt | llm2 | StrOutputParser()
-    twitter_chain = twitter_prompt | llm3 | StrOutputParser()
-
-    # Run the chains and display the output
-    st.write("### Planning Stage")
-    planning_output = planning_chain.invoke({"theme": theme})
-    st.write(f"Planning Output:\n{planning_output}")
-
-    st.write("### Research Stage")
-    st.write(f"Research Articles Results:\n{research_articles_results}")
-    st.write(f"Research Articles Output:\n{research_articles_output}")
-
-    st.write(f"Research Websites Results:\n{research_websites_results}")
-    st.write(f"Research Websites Output:\n{research_websites_output}")
-
-    st.write("### Raw Content Stage")
-    target_public_analysis_output = target_public_analysis_chain.invoke({"theme": theme})
-    st.write(f"Target Public Analysis Output:\n{target_public_analysis_output}")
-
-    language_adaptation_output = language_adaptation_chain.invoke({"content": research_articles_output})
-    st.write(f"Language Adaptation Output:\n{language_adaptation_output}")
-
-    first_draft_output = first_draft_chain.invoke({"content": language_adaptation_output})
-    st.write(f"First Revised Main Draft Output:\n{first_draft_output}")
-
-    st.write("### Content Generation Stage")
-    keynote_output = keynote_chain.invoke({"theme": theme})
-    st.write(f"Keynote Presentation Output:\n{keynote_output}")
+    planning_chain = pack(planning_prompt, llm1) | llm1 | StrOutputParser()
+    # Search results are ranked down to the most informative snippets when over budget
+    search_sections = {"theme": Section(strategy="rank")}
+    research_articles_chain = pack(research_articles_prompt, llm2, search_sections) | llm2 | StrOutputParser()
+    research_websites_chain = pack(research_websites_prompt, llm3, search_sections) | llm3 | StrOutputParser()
+    target_public_analysis_chain = pack(target_public_analysis_prompt, llm1) | llm1 | StrOutputParser()
+    language_adaptation_chain = pack(language_adaptation_prompt, llm2) | llm2 | StrOutputParser()
+    first_draft_chain = pack(first_draft_prompt, llm3) | llm3 | StrOutputParser()
+    keynote_chain = pack(keynote_prompt, llm1) | llm1 | StrOutputParser()
+    linkedin_chain = pack(linkedin_prompt, llm2) | llm2 | StrOutputParser()
+    twitter_chain = pack(twitter_prompt, llm3) | llm3 | StrOutputParser()
+
+    # Web search for research articles, books and websites. Both queries run at once and share their
+    # deduplicated results.
+    search = SearchService()
+
+    def research(theme):
+        return search.search_text({"articles": f"articles and books about {theme}", "websites": f"websites about {theme}"})
+
+    # Pipeline graph: each stage reads the outputs it needs, independent stages run in parallel
+    pipeline = Pipeline([
+        Stage("planning", planning_chain, ["theme"], title="Planning Output", header="### Planning Stage"),
+        Stage("searches", research, ["theme"]),
+        Stage("research_articles_results", lambda searches: searches["articles"], ["searches"],
+              title="Research Articles Results", header="### Research Stage"),
+        Stage("research_articles", research_articles_chain, {"theme": "research_articles_results"},
+              title="Research Articles Output"),
+        Stage("research_websites_results", lambda searches: searches["websites"], ["searches"],
+              title="Research Websites Results"),
+        Stage("research_websites", research_websites_chain, {"theme": "research_websites_results"},
+              title="Research Websites Output"),
+        Stage("target_public_analysis", target_public_analysis_chain, ["theme"],
+              title="Target Public Analysis Output", header="### Raw Content Stage"),
+        Stage("language_adaptation", language_adaptation_chain, {"content": "research_articles"},
+              title="Language Adaptation Output"),
+        Stage("first_draft", first_draft_chain, {"content": "language_adaptation"},
+              title="First Revised Main Draft Output"),
+        Stage("keynote", keynote_chain, ["theme"], title="Keynote Presentation Output",
+              header="### Content Generation Stage"),
+        Stage("linkedin", linkedin_chain, ["theme"], title="LinkedIn Article Output"),
+        Stage("twitter", twitter_chain, ["theme"], title="Twitter Posts Output"),
+    ])
+
+    result = run_in_streamlit(pipeline, {"theme": theme}, container, stream=stream, telemetry=Telemetry("financial_wizard1"))
+    logger.info("Processamento total concluído")
+    return result
 
-    linkedin_output = linkedin_chain.invoke({"theme": theme})
-    st.write(f"LinkedIn Article Output:\n{linkedin_output}")
 
-    twitter_output = twitter_chain.invoke({"theme": theme})
-    st.write(f"Twitter Posts Output:\n{twitter_output}")
+# Streamlit interface
+def main():
+    st.title("Content Generation Pipeline")
+    theme = st.text_input("Enter the content theme:")
+    stream = st.checkbox("Stream output", value=True)
 
-    total_time = time.time() - start_time
-    st.write(f"Total Processing Time: {total_time} seconds")
-    logger.info("Processamento total concluído")
+    if st.button("Generate Content"):
+        if JOB_SERVER_URL:
+            # The job server runs the pipeline, reruns of this page only poll it
+            st.session_state.job_id = submit_job("content", {"theme": theme})
+        else:
+            with st.spinner("Generating content..."):
+                run_pipeline(theme, stream)
 
+    if JOB_SERVER_URL and st.session_state.get("job_id"):
+        follow_job(st.container(), st.session_state.job_id)
 
-# Streamlit interface
-st.title("Content Generation Pipeline")
-theme = st.text_input("Enter the content theme:")
 
-if st.button("Generate Content"):
-    with st.spinner("Generating content..."):
-        run_pipeline(theme)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,114 +1,148 @@
-import time
 import logging
+from dataclasses import asdict
 import streamlit as st
 from  langchain_core.prompts import PromptTemplate
-from langchain_groq import ChatGroq
 from langchain_core.output_parsers import StrOutputParser
-from langchain_community.tools import DuckDuckGoSearchResults
+from langchain_core.runnables import RunnableLambda
+from utils.router import routed, AllModelsFailed
+from utils.hedging import hedged, HedgeBudget
+from utils.pipeline import Pipeline, Stage
+from utils.prompt_packer import pack, Section
+from utils.search import SearchService, SearchQuery, format_records
+from utils.streaming import run_in_streamlit
+from utils.telemetry import Telemetry
+from utils.job_client import JOB_SERVER_URL, submit_job, follow_job
+from indicators import engine as indicator_engine
+from fundamentals import engine as fundamentals_engine
+from news import NEWS_SEARCH_RESULTS, condense, format_clusters
 
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
-# Function to get API keys
-def get_api_keys():
-    return {"groq_api_key": "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"}
+# Retries of a stage once every model it may use is rate limited or failing
+STAGE_MAX_RETRIES = 2
 
-# Function to execute the pipeline
-def run_pipeline(company):
-    start_time = time.time()
-    logger.info("Iniciando o processamento da rota /stock_analysis/")
-
-    api_keys = get_api_keys()
-    groq_api_key = api_keys["groq_api_key"]
-
-    if not groq_api_key:
-        logger.error("Groq API key está ausente")
-        raise Exception("Groq API key is missing")
-
-    llm1 = ChatGroq(
-        temperature=0.5,
-        model="llama3-70b-8192",
-        api_key=groq_api_key,
-    )
-
-    llm2 = ChatGroq(
-        temperature=0.5,
-        model="gemma2-9b-it",
-        api_key=groq_api_key,
-    )
 
-    llm3 = ChatGroq(
-        temperature=0.5,
-        model="llama3-groq-8b-8192-tool-use-preview",
-        api_key=groq_api_key,
-    )
+# Stock analysis graph for one company. Only runs someone waits on without streaming hedge the final report, a
+# hedged report arrives whole.
+def build_pipeline(hedge=True):
+    # Routed clients from the registry, llm3 is Groq's tool-use model in this pipeline
+    llm1 = routed("llm1")
+    llm2 = routed("llm2")
+    llm3 = routed("llm7")
 
     # Define prompts
     history_prompt_template = "Research the history of the company: {company}."
     news_prompt_template = "Research the news of the last month for the company: {company}."
     financial_results_prompt_template = "Research the latest financial results for the company: {company}."
-    kpis_prompt_template = "Analyze the key performance indicators (KPIs) for the company: {company}."
-    technical_analysis_prompt_template = "Perform a technical analysis for the company: {company}."
-    value_investing_kpis_prompt_template = "Evaluate the value investing KPIs for the company: {company}."
+    technical_analysis_prompt_template = """Perform a technical analysis for the company: {company}.
+    Base it only on these indicators, computed locally from its price history. When they are not available say so
+    instead of estimating them.
+    {indicators}"""
+    value_investing_kpis_prompt_template = """Evaluate the value investing KPIs for the company: {company}.
+    Base it only on these metrics, computed locally from its financial statements. When they are not available say so
+    instead of estimating them.
+    {fundamentals}"""
     report_consolidation_prompt_template = "Consolidate the following information into a comprehensive report: {information}."
 
     # Create prompt templates
     history_prompt = PromptTemplate(input_variables=["company"], template=history_prompt_template)
     news_prompt = PromptTemplate(input_variables=["company"], template=news_prompt_template)
     financial_results_prompt = PromptTemplate(input_variables=["company"], template=financial_results_prompt_template)
-    kpis_prompt = PromptTemplate(input_variables=["company"], template=kpis_prompt_template)
-    technical_analysis_prompt = PromptTemplate(input_variables=["company"], template=technical_analysis_prompt_template)
-    value_investing_kpis_prompt = PromptTemplate(input_variables=["company"], template=value_investing_kpis_prompt_template)
+    technical_analysis_prompt = PromptTemplate(input_variables=["company", "indicators"], template=technical_analysis_prompt_template)
+    value_investing_kpis_prompt = PromptTemplate(input_variables=["company", "fundamentals"], template=value_investing_kpis_prompt_template)
     report_consolidation_prompt = PromptTemplate(input_variables=["information"], template=report_consolidation_prompt_template)
 
     # Define chains for each stage
-    history_chain = history_prompt | llm1 | StrOutputParser()
-    news_chain = news_prompt | llm2 | StrOutputParser()
-    financial_results_chain = financial_results_prompt | llm3 | StrOutputParser()
-    kpis_chain = kpis_prompt | llm1 | StrOutputParser()
-    technical_analysis_chain = technical_analysis_prompt | llm2 | StrOutputParser()
-    value_investing_kpis_chain = value_investing_kpis_prompt | llm3 | StrOutputParser()
-    report_consolidation_chain = report_consolidation_prompt | llm1 | StrOutputParser()
-
-    # Web search for research stages
-    search_tool = DuckDuckGoSearchResults()
-
-    st.write("### Planning Stage")
-    history_output = history_chain.invoke({"company": company})
-    st.write(f"History Output:\n{history_output}")
-
-    news_results = search_tool.run(f"{company} news last month")
-    news_output = news_chain.invoke({"company": news_results})
-    st.write(f"News Results:\n{news_results}")
-    st.write(f"News Output:\n{news_output}")
-
-    financial_results_results = search_tool.run(f"{company} latest financial results for the last 5 years")
-    financial_results_output = financial_results_chain.invoke({"company": financial_results_results})
-    st.write(f"Financial Results:\n{financial_results_results}")
-    st.write(f"Financial Results Output:\n{financial_results_output}")
-
-    st.write("### Analysis Stage")
-    kpis_output = kpis_chain.invoke({"company": company})
-    st.write(f"KPIs Output:\n{kpis_output}")
-
-    technical_analysis_output = technical_analysis_chain.invoke({"company": company})
-    st.write(f"Technical Analysis Output:\n{technical_analysis_output}")
-
-    value_investing_kpis_output = value_investing_kpis_chain.invoke({"company": company})
-    st.write(f"Value Investing KPIs Output:\n{value_investing_kpis_output}")
-
-    report_consolidation_output = report_consolidation_chain.invoke({"information": f"{kpis_output}\n{technical_analysis_output}\n{value_investing_kpis_output}"})
-    st.write(f"Report Consolidation Output:\n{report_consolidation_output}")
-
-    total_time = time.time() - start_time
-    st.write(f"Total Processing Time: {total_time} seconds")
+    history_chain = pack(history_prompt, llm1) | llm1 | StrOutputParser()
+    # Raw search results are ranked down to the most informative snippets when over budget
+    search_sections = {"company": Section(strategy="rank")}
+    news_chain = pack(news_prompt, llm2, search_sections) | llm2 | StrOutputParser()
+    financial_results_chain = pack(financial_results_prompt, llm3, search_sections) | llm3 | StrOutputParser()
+    technical_analysis_chain = pack(technical_analysis_prompt, llm2) | llm2 | StrOutputParser()
+    value_investing_kpis_chain = pack(value_investing_kpis_prompt, llm3) | llm3 | StrOutputParser()
+    # The consolidated report is what the user waits on, a slow completion is hedged on Claude Haiku
+    report_llm = hedged("llm1", "llm6", HedgeBudget()) if hedge else llm1
+    # A chain rather than a function of the analyses, so the stage streams the report as it is written
+    analyses = ["kpis", "technical_analysis", "value_investing_kpis"]
+    join_analyses = RunnableLambda(lambda outputs: {"information": "\n".join(outputs[name] for name in analyses)})
+    report_consolidation_chain = join_analyses | pack(report_consolidation_prompt, llm1) | report_llm | StrOutputParser()
+
+    # Web search for research stages, both queries run at once and share their deduplicated results
+    search = SearchService()
+
+    def research(company):
+        records = search.search_many({
+            "news": SearchQuery(f"{company} news", "news", NEWS_SEARCH_RESULTS),
+            "financial_results": SearchQuery(f"{company} latest financial results for the last 5 years", "financial"),
+        })
+        return {"news": [asdict(record) for record in records["news"]],
+                "financial_results": format_records(records["financial_results"])}
+
+    # Pipeline graph: history, KPIs, technical and value-investing analysis only need the company,
+    # so they run alongside the searches
+    retry = {"retries": STAGE_MAX_RETRIES, "retry_on": (AllModelsFailed,)}
+    return Pipeline([
+        Stage("history", history_chain, ["company"], title="History Output", header="### Planning Stage", **retry),
+        Stage("searches", research, ["company"]),
+        # Syndicated copies of a story are clustered away, the prompt gets one item per story with its count
+        Stage("news_results", lambda searches: format_clusters(condense(searches["news"])), ["searches"],
+              title="News Results"),
+        Stage("news", news_chain, {"company": "news_results"}, title="News Output", **retry),
+        Stage("financial_results_results", lambda searches: searches["financial_results"], ["searches"],
+              title="Financial Results"),
+        Stage("financial_results", financial_results_chain, {"company": "financial_results_results"},
+              title="Financial Results Output", **retry),
+        # The ticker is looked up in the local financial statements (FUNDAMENTALS_PATH). The KPIs are these metrics
+        # themselves, only their value-investing reading needs a model.
+        Stage("kpis", lambda ticker: fundamentals_engine.summary(ticker), ["ticker"], title="KPIs Output",
+              header="### Analysis Stage"),
+        # The ticker is looked up in the local OHLCV data (OHLCV_PATH)
+        Stage("indicators", lambda ticker: indicator_engine.summary(ticker), ["ticker"], title="Technical Indicators"),
+        Stage("technical_analysis", technical_analysis_chain, ["company", "indicators"], title="Technical Analysis Output",
+              **retry),
+        Stage("value_investing_kpis", value_investing_kpis_chain, {"company": "company", "fundamentals": "kpis"},
+              title="Value Investing KPIs Output", **retry),
+        Stage("report_consolidation", report_consolidation_chain, analyses,
+              title="Report Consolidation Output", **retry),
+    ])
+
+
+# Pipeline inputs for a company. The research stages search for its name, the local price and statement data is
+# keyed by ticker, which defaults to the name when not given.
+def pipeline_inputs(company, ticker=None):
+    return {"company": company, "ticker": (ticker or "").strip() or company}
+
+
+# Function to execute the pipeline
+def run_pipeline(company, stream=True, container=st, ticker=None):
+    logger.info("Iniciando o processamento da rota /stock_analysis/")
+    pipeline = build_pipeline(hedge=not stream)
+    result = run_in_streamlit(pipeline, pipeline_inputs(company, ticker), container, stream=stream,
+                              telemetry=Telemetry("financial_wizard_2"))
     logger.info("Processamento total concluído")
+    return result
 
 # Streamlit interface
-st.title("Stock Analysis Pipeline")
-company = st.text_input("Enter the company name:")
-
-if st.button("Generate Stock Analysis"):
-    with st.spinner("Generating stock analysis..."):
-        run_pipeline(company)
+def main():
+    st.title("Stock Analysis Pipeline")
+    name_column, ticker_column = st.columns([3, 1])
+    company = name_column.text_input("Enter the company name:")
+    ticker = ticker_column.text_input("Ticker:", help="Symbol of the local price and statement data, e.g. PETR4")
+    stream = st.checkbox("Stream output", value=True)
+
+    if st.button("Generate Stock Analysis"):
+        if JOB_SERVER_URL:
+            # The job server runs the pipeline, reruns of this page only poll it
+            st.session_state.job_id = submit_job("stock_analysis", {"company": company, "ticker": ticker})
+        else:
+            with st.spinner("Generating stock analysis..."):
+                run_pipeline(company, stream, ticker=ticker)
+
+    if JOB_SERVER_URL and st.session_state.get("job_id"):
+        follow_job(st.container(), st.session_state.job_id)
+
+
+if __name__ == "__main__":
+    main()
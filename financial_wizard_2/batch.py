@@ -0,0 +1,181 @@
+import os
+import re
+import json
+import time
+import logging
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+from app import build_pipeline, pipeline_inputs
+from utils.run_store import RunStore, content_hash
+from utils.telemetry import Telemetry
+
+logger = logging.getLogger(__name__)
+
+# Companies analyzed at the same time. Their stages also share the pipeline's process-wide concurrency cap
+# (PIPELINE_MAX_CONCURRENCY) and every model's shared rate limiter, so this mostly keeps searches overlapping.
+WATCHLIST_MAX_COMPANIES = int(os.environ.get("WATCHLIST_MAX_COMPANIES", 4))
+# Stages that only list raw search results. They stay in the Markdown reports, the table keeps one column per
+# analysis and leaves them out along with the untitled internal stages.
+SEARCH_LISTINGS = {"news_results", "financial_results_results"}
+
+
+# Company -> ticker, in watchlist order. One company per line (blank lines and # comments are skipped), or a CSV
+# with a company column, a ticker column or both. Without a ticker the company is looked up as one.
+def read_watchlist(path):
+    if path.endswith(".csv"):
+        table = pd.read_csv(path, dtype=str)
+        columns = {name.lower(): name for name in table.columns}
+        company_column = columns.get("company", columns.get("ticker", table.columns[0]))
+        ticker_column = columns.get("ticker", company_column)
+        table = table.dropna(subset=[company_column])
+        entries = zip(table[company_column].str.strip(), table[ticker_column].fillna("").str.strip())
+    else:
+        with open(path) as watchlist:
+            entries = [(line.strip(), None) for line in watchlist if line.strip() and not line.lstrip().startswith("#")]
+    watchlist = {}
+    for company, ticker in entries:
+        if company:
+            watchlist.setdefault(company, ticker or None)
+    return watchlist
+
+
+# File name of a company's outputs. The hash suffix keeps companies that read the same ("AT&T" and "AT T", or
+# case variants) from overwriting each other.
+def slug(company):
+    readable = re.sub(r"[^\w.-]+", "_", company).strip("_").lower()
+    return f"{readable}-{content_hash(company)[:8]}" if readable else content_hash(company)[:16]
+
+
+def write_report(path, company, pipeline, result):
+    sections = [f"# {company}\n"]
+    for stage in pipeline.stages:
+        if stage.title is None:
+            continue
+        if stage.name in result.errors:
+            sections.append(f"## {stage.title}\n\nFailed: {result.errors[stage.name]}\n")
+        else:
+            sections.append(f"## {stage.title}\n\n{result.outputs.get(stage.name, '')}\n")
+    with open(path, "w") as report:
+        report.write("\n".join(sections))
+
+
+class WatchlistBatch:
+    def __init__(self, watchlist, output_dir, batch_id, max_companies=WATCHLIST_MAX_COMPANIES, restart=False):
+        self.companies = list(watchlist)
+        self.tickers = watchlist
+        self.output_dir = output_dir
+        self.reports_dir = os.path.join(output_dir, "reports")
+        self.batch_id = batch_id
+        self.max_companies = max_companies
+        self.restart = restart
+        self.pipeline = build_pipeline(hedge=False)
+        self.store = RunStore()
+
+    def run_id(self, company):
+        return f"watchlist-{self.batch_id}-{content_hash(company)[:16]}"
+
+    def row_path(self, company):
+        return os.path.join(self.reports_dir, f"{slug(company)}.json")
+
+    # Row of a company already analyzed by this batch, or None
+    def finished_row(self, company):
+        if self.restart or not os.path.exists(self.row_path(company)):
+            return None
+        with open(self.row_path(company)) as saved:
+            row = json.load(saved)
+        return row if row["status"] == "ok" else None
+
+    def analyze(self, company):
+        if self.restart:
+            self.store.clear(self.run_id(company))
+        inputs = pipeline_inputs(company, self.tickers[company])
+        # Stages finished before an interruption are restored from the run store
+        result = self.pipeline.run(inputs, store=self.store, run_id=self.run_id(company),
+                                   telemetry=Telemetry("financial_wizard_2_batch"))
+        report_path = os.path.join(self.reports_dir, f"{slug(company)}.md")
+        write_report(report_path, company, self.pipeline, result)
+        row = {
+            "company": company,
+            "ticker": inputs["ticker"],
+            "status": "ok" if result.ok else "failed",
+            **{stage.name: result.outputs.get(stage.name) for stage in self.pipeline.stages
+               if stage.title is not None and stage.name not in SEARCH_LISTINGS},
+            "errors": json.dumps({name: str(error) for name, error in result.errors.items()}),
+            "restored_stages": len(result.restored),
+            "wall_time": result.wall_time,
+            "report": report_path,
+            "analyzed_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        with open(self.row_path(company), "w") as saved:
+            json.dump(row, saved)
+        return row
+
+    def run(self):
+        os.makedirs(self.reports_dir, exist_ok=True)
+        rows, pending = [], []
+        for company in self.companies:
+            row = self.finished_row(company)
+            if row is None:
+                pending.append(company)
+            else:
+                rows.append(row)
+        if rows:
+            logger.info(f"Resuming batch {self.batch_id}: {len(rows)} companies already done, {len(pending)} left")
+
+        started_at = time.time()
+        analyzed = 0
+        with ThreadPoolExecutor(max_workers=self.max_companies) as executor:
+            futures = {executor.submit(self.analyze, company): company for company in pending}
+            for future in as_completed(futures):
+                company = futures[future]
+                try:
+                    rows.append(future.result())
+                except Exception as e:
+                    logger.exception(f"{company} failed")
+                    rows.append({"company": company, "status": "failed", "errors": json.dumps({"batch": str(e)})})
+                analyzed += 1
+                rate = analyzed / max(time.time() - started_at, 1e-9) * 3600
+                logger.info(f"{len(rows)}/{len(self.companies)} companies, {rate:.1f} companies/hour ({company})")
+
+        elapsed = time.time() - started_at
+        order = {company: index for index, company in enumerate(self.companies)}
+        table = pd.DataFrame(sorted(rows, key=lambda row: order[row["company"]]))
+        return table, analyzed, elapsed
+
+
+def write_table(table, path):
+    if path.endswith(".parquet"):
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the stock analysis pipeline over a watchlist")
+    parser.add_argument("watchlist", help="text file with one company per line, or a CSV with company and/or ticker columns")
+    parser.add_argument("--batch-id", default=datetime.date.today().isoformat(),
+                        help="runs with the same id resume each other (default: today)")
+    parser.add_argument("--output", help="output directory (default: watchlist_output/<batch id>)")
+    parser.add_argument("--table", default="watchlist.parquet", help="combined table, .parquet or .csv")
+    parser.add_argument("--max-companies", type=int, default=WATCHLIST_MAX_COMPANIES)
+    parser.add_argument("--restart", action="store_true", help="ignore the results of a previous run of this batch")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    output_dir = args.output or os.path.join("watchlist_output", args.batch_id)
+    batch = WatchlistBatch(read_watchlist(args.watchlist), output_dir, args.batch_id, args.max_companies, args.restart)
+    table, analyzed, elapsed = batch.run()
+    table_path = os.path.join(output_dir, args.table)
+    write_table(table, table_path)
+
+    failed = int((table["status"] != "ok").sum())
+    rate = analyzed / max(elapsed, 1e-9) * 3600
+    print(f"{len(table)} companies ({analyzed} analyzed now, {failed} failed) in {elapsed:.0f}s, "
+          f"{rate:.1f} companies/hour")
+    print(f"Reports: {batch.reports_dir}\nTable: {table_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import os
+import sys
+import glob
+import logging
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from indicators import engine as indicator_engine
+
+logger = logging.getLogger(__name__)
+
+# Financial statements as CSV or Parquet files (or a directory of them), one row per ticker and fiscal period with
+# columns named like STATEMENT_COLUMNS. Missing line items only leave the ratios that need them empty.
+FUNDAMENTALS_PATH = os.environ.get("FUNDAMENTALS_PATH",
+                                   os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "fundamentals"))
+FUNDAMENTALS_CACHE_PATH = os.environ.get("FUNDAMENTALS_CACHE_PATH",
+                                         os.path.expanduser("~/.cache/personall/fundamentals.parquet"))
+
+STATEMENT_COLUMNS = [
+    "revenue", "gross_profit", "ebit", "net_income", "interest_expense", "total_assets", "total_liabilities",
+    "total_equity", "current_assets", "current_liabilities", "total_debt", "cash", "operating_cash_flow", "capex",
+    "dividends_paid", "shares_outstanding", "price",
+]
+# Growth compares a filing with the same ticker's filing this many years earlier, give or take this many days.
+# Without one (a missing year) the growth is empty.
+PERIOD_TOLERANCE_DAYS = 45
+
+
+def _read(path):
+    frame = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path, float_precision="round_trip")
+    frame.columns = [str(column).strip().lower().replace(" ", "_") for column in frame.columns]
+    return frame.rename(columns={"symbol": "ticker", "period_end": "period", "fiscal_year": "period"})
+
+
+# Empty (with the expected columns) when there are no statement files
+def load_statements(path=FUNDAMENTALS_PATH):
+    paths = sorted(glob.glob(os.path.join(path, "*.csv")) + glob.glob(os.path.join(path, "*.parquet"))) \
+        if os.path.isdir(path) else [path] if os.path.exists(path) else []
+    if not paths:
+        return pd.DataFrame({"ticker": pd.Series(dtype=str), "period": pd.Series(dtype="datetime64[ns]"),
+                             **{column: pd.Series(dtype=float) for column in STATEMENT_COLUMNS}})
+    frame = pd.concat([_read(file) for file in paths], ignore_index=True)
+    frame["ticker"] = frame["ticker"].astype(str).str.upper()
+    frame["period"] = pd.to_datetime(frame["period"].astype(str), format="mixed")
+    for column in STATEMENT_COLUMNS:
+        frame[column] = pd.to_numeric(frame[column], errors="coerce") if column in frame else np.nan
+    return frame.drop_duplicates(["ticker", "period"], keep="last").sort_values(["ticker", "period"], ignore_index=True)
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator.where(denominator != 0)
+
+
+# `values` of each row's filing `years` earlier for the same ticker, matched by period end date so gaps and
+# quarterly rows never pair a filing with the wrong year
+def _years_before(frame, values, years):
+    rows = pd.DataFrame({"ticker": frame["ticker"].to_numpy(), "row": np.arange(len(frame)),
+                         "date": (frame["period"] - pd.Timedelta(days=round(365.25 * years))).to_numpy()})
+    filings = pd.DataFrame({"ticker": frame["ticker"].to_numpy(), "date": frame["period"].to_numpy(),
+                            "value": values.to_numpy()})
+    matched = pd.merge_asof(rows.sort_values("date"), filings.sort_values("date"), on="date", by="ticker",
+                            direction="nearest", tolerance=pd.Timedelta(days=PERIOD_TOLERANCE_DAYS))
+    return pd.Series(matched.sort_values("row")["value"].to_numpy(), index=frame.index)
+
+
+def _growth(frame, values, years=1):
+    return _ratio(values, _years_before(frame, values, years)) - 1
+
+
+# Ratios and growth rates that only depend on the filings, for every ticker and period in one pass
+def statement_metrics(statements):
+    frame = statements
+    equity = frame["total_equity"]
+    metrics = pd.DataFrame({
+        "ticker": frame["ticker"],
+        "period": frame["period"],
+        "eps": _ratio(frame["net_income"], frame["shares_outstanding"]),
+        "book_value_per_share": _ratio(equity, frame["shares_outstanding"]),
+        "gross_margin": _ratio(frame["gross_profit"], frame["revenue"]),
+        "operating_margin": _ratio(frame["ebit"], frame["revenue"]),
+        "net_margin": _ratio(frame["net_income"], frame["revenue"]),
+        "roe": _ratio(frame["net_income"], equity),
+        "roa": _ratio(frame["net_income"], frame["total_assets"]),
+        "roic": _ratio(frame["ebit"], frame["total_debt"] + equity - frame["cash"].fillna(0)),
+        "debt_to_equity": _ratio(frame["total_debt"], equity),
+        "liabilities_to_assets": _ratio(frame["total_liabilities"], frame["total_assets"]),
+        "current_ratio": _ratio(frame["current_assets"], frame["current_liabilities"]),
+        "interest_coverage": _ratio(frame["ebit"], frame["interest_expense"].abs()),
+        "free_cash_flow": frame["operating_cash_flow"] - frame["capex"].abs(),
+        "dividends_paid": frame["dividends_paid"].abs(),
+        "shares_outstanding": frame["shares_outstanding"],
+        "filing_price": frame["price"],
+    })
+    metrics["revenue_growth"] = _growth(frame, frame["revenue"])
+    metrics["earnings_growth"] = _growth(frame, frame["net_income"])
+    metrics["eps_growth"] = _growth(frame, metrics["eps"])
+    # Compound annual growth over the last three years
+    revenue_3y = _years_before(frame, frame["revenue"], 3)
+    metrics["revenue_cagr_3y"] = (_ratio(frame["revenue"], revenue_3y.where(revenue_3y > 0))) ** (1 / 3) - 1
+    metrics["free_cash_flow_per_share"] = _ratio(metrics["free_cash_flow"], frame["shares_outstanding"])
+    return metrics
+
+
+# Price-dependent ratios on top of the statement metrics, priced at `prices` (ticker -> price) when given
+def valuation(metrics, prices=None):
+    frame = metrics.copy()
+    price = frame["filing_price"]
+    if prices is not None:
+        price = frame["ticker"].map(prices).fillna(price)
+    frame["price"] = price
+    frame["market_cap"] = price * frame["shares_outstanding"]
+    frame["pe"] = _ratio(price, frame["eps"].where(frame["eps"] > 0))
+    frame["pb"] = _ratio(price, frame["book_value_per_share"].where(frame["book_value_per_share"] > 0))
+    frame["earnings_yield"] = _ratio(frame["eps"], price)
+    frame["free_cash_flow_yield"] = _ratio(frame["free_cash_flow"], frame["market_cap"])
+    frame["dividend_yield"] = _ratio(frame["dividends_paid"], frame["market_cap"])
+    frame["peg"] = _ratio(frame["pe"], frame["eps_growth"].where(frame["eps_growth"] > 0) * 100)
+    graham = np.sqrt(22.5 * frame["eps"].clip(lower=0) * frame["book_value_per_share"].clip(lower=0))
+    frame["graham_number"] = graham.where(graham > 0)
+    frame["margin_of_safety"] = _ratio(frame["graham_number"], price) - 1
+    return frame
+
+
+def _input_hashes(statements):
+    return pd.util.hash_pandas_object(statements[["ticker", "period"] + STATEMENT_COLUMNS], index=False)
+
+
+# Statement metrics of every filing, cached per ticker and period. Only tickers with a new, restated or removed
+# filing are recomputed, and their cached rows are replaced as a whole (growth rates depend on earlier filings).
+class FundamentalsEngine:
+    def __init__(self, path=FUNDAMENTALS_PATH, cache_path=FUNDAMENTALS_CACHE_PATH, prices=None):
+        self.path = path
+        self.cache_path = cache_path
+        # Callable returning current prices (ticker -> price), filings' own price column otherwise
+        self.prices = prices
+        self._metrics = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _current_version(self):
+        paths = glob.glob(os.path.join(self.path, "*")) if os.path.isdir(self.path) else [self.path]
+        return tuple(sorted((path, os.path.getmtime(path)) for path in paths if os.path.exists(path)))
+
+    def _compute(self):
+        statements = load_statements(self.path)
+        if statements.empty:
+            logger.warning(f"No financial statement files in {self.path}")
+            return None
+        statements["input_hash"] = _input_hashes(statements).to_numpy()
+        cached = pd.read_parquet(self.cache_path) if os.path.exists(self.cache_path) else None
+        if cached is not None:
+            known = statements[["ticker", "period", "input_hash"]].merge(
+                cached[["ticker", "period", "input_hash"]], how="outer", on=["ticker", "period", "input_hash"],
+                indicator=True)
+            changed = set(known.loc[known["_merge"] != "both", "ticker"]) & set(statements["ticker"])
+            reused = cached[~cached["ticker"].isin(changed) & cached["ticker"].isin(set(statements["ticker"]))]
+        else:
+            changed, reused = set(statements["ticker"]), None
+        fresh = statements[statements["ticker"].isin(changed)]
+        computed = statement_metrics(fresh).assign(input_hash=fresh["input_hash"].to_numpy())
+        metrics = pd.concat([reused, computed], ignore_index=True) if reused is not None else computed
+        logger.info(f"Fundamentals: {len(changed)} tickers recomputed, "
+                    f"{metrics['ticker'].nunique() - len(changed)} reused from the cache")
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        metrics.to_parquet(self.cache_path + ".tmp", index=False)
+        os.replace(self.cache_path + ".tmp", self.cache_path)
+        return metrics.sort_values(["ticker", "period"], ignore_index=True)
+
+    def metrics(self):
+        with self._lock:
+            version = self._current_version()
+            if not version:
+                return None
+            if version != self._version:
+                self._metrics = self._compute()
+                self._version = version
+            return self._metrics
+
+    # Latest filing of every ticker with its valuation at current prices
+    def latest(self):
+        metrics = self.metrics()
+        if metrics is None:
+            return None
+        latest = metrics.groupby("ticker", sort=False).tail(1).set_index("ticker", drop=False)
+        return valuation(latest, self.prices() if self.prices else None)
+
+    # pandas query over the latest table, e.g. "pe < 15 and roe > 0.15 and debt_to_equity < 1"
+    def screen(self, query, sort_by=None, ascending=False, limit=None):
+        table = self.latest()
+        if table is None:
+            return pd.DataFrame()
+        result = table.query(query) if query else table
+        if sort_by:
+            result = result.sort_values(sort_by, ascending=ascending)
+        return result.head(limit) if limit else result
+
+    def summary(self, ticker):
+        table = self.latest()
+        ticker = ticker.strip().upper()
+        if table is None or ticker not in table.index:
+            return f"No local financial statements for {ticker}."
+        return summarize(table.loc[ticker])
+
+
+def _value(value, kind):
+    if pd.isna(value):
+        return "n/a"
+    if kind == "percent":
+        return f"{value * 100:.1f}%"
+    if kind == "money":
+        for limit, suffix in [(1e12, "T"), (1e9, "B"), (1e6, "M")]:
+            if abs(value) >= limit:
+                return f"{value / limit:.2f}{suffix}"
+        return f"{value:,.0f}"
+    return f"{value:.2f}"
+
+
+SUMMARY_FIELDS = [
+    ("Valuation", [("P/E", "pe", "ratio"), ("P/B", "pb", "ratio"), ("PEG", "peg", "ratio"),
+                   ("Earnings yield", "earnings_yield", "percent"), ("FCF yield", "free_cash_flow_yield", "percent"),
+                   ("Dividend yield", "dividend_yield", "percent"), ("Market cap", "market_cap", "money"),
+                   ("Graham number", "graham_number", "ratio"), ("Margin of safety", "margin_of_safety", "percent")]),
+    ("Profitability", [("ROE", "roe", "percent"), ("ROA", "roa", "percent"), ("ROIC", "roic", "percent"),
+                       ("Gross margin", "gross_margin", "percent"), ("Operating margin", "operating_margin", "percent"),
+                       ("Net margin", "net_margin", "percent")]),
+    ("Balance sheet", [("Debt/Equity", "debt_to_equity", "ratio"), ("Liabilities/Assets", "liabilities_to_assets", "ratio"),
+                       ("Current ratio", "current_ratio", "ratio"), ("Interest coverage", "interest_coverage", "ratio")]),
+    ("Growth", [("Revenue YoY", "revenue_growth", "percent"), ("Earnings YoY", "earnings_growth", "percent"),
+                ("EPS YoY", "eps_growth", "percent"), ("Revenue 3y CAGR", "revenue_cagr_3y", "percent")]),
+]
+
+
+# Compact text for the prompts, one line per group
+def summarize(row):
+    lines = [f"{row['ticker']}, fiscal period ending {row['period'].date()}, price {_value(row['price'], 'ratio')}"]
+    for group, fields in SUMMARY_FIELDS:
+        lines.append(f"{group}: " + ", ".join(f"{label} {_value(row[column], kind)}" for label, column, kind in fields))
+    return "\n".join(lines)
+
+
+# Latest closes from the local OHLCV data, so valuations follow the market rather than the filing date
+def current_prices():
+    table = indicator_engine.table()
+    return None if table is None else table["close"]
+
+
+engine = FundamentalsEngine(prices=current_prices)
+
+
+# python fundamentals.py "pe < 15 and roe > 0.15" --sort roe
+def main():
+    parser = argparse.ArgumentParser(description="Screens the latest fundamentals of every company")
+    parser.add_argument("query", nargs="?", default="", help="pandas query over the metric columns")
+    parser.add_argument("--sort", help="column to sort by, descending")
+    parser.add_argument("--ascending", action="store_true")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--columns", default="pe,pb,roe,debt_to_equity,revenue_growth,free_cash_flow_yield,margin_of_safety")
+    parser.add_argument("--output", help="write the full result to this .csv or .parquet file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    result = engine.screen(args.query, args.sort, args.ascending, args.limit)
+    if result.empty:
+        print("No companies match")
+        sys.exit(0)
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(result[["period"] + args.columns.split(",")].round(3))
+    if args.output and args.output.endswith(".parquet"):
+        result.to_parquet(args.output, index=False)
+    elif args.output:
+        result.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import os
+import glob
+import logging
+import threading
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# A CSV or Parquet file in long format (ticker, date, open, high, low, close, volume), or a directory of them.
+# Files without a ticker column hold one ticker, named after the file.
+OHLCV_PATH = os.environ.get("OHLCV_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ohlcv"))
+
+FIELDS = ["open", "high", "low", "close", "volume"]
+TRADING_DAYS = 252
+
+
+def _read(path):
+    frame = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+    frame.columns = [str(column).strip().lower().replace(" ", "_") for column in frame.columns]
+    frame = frame.rename(columns={"symbol": "ticker"})
+    if "close" not in frame and "adj_close" in frame:
+        frame["close"] = frame["adj_close"]
+    if "ticker" not in frame:
+        frame["ticker"] = os.path.splitext(os.path.basename(path))[0]
+    return frame
+
+
+# Empty (with the expected columns) when there are no data files, e.g. before the first download
+def load_ohlcv(path=OHLCV_PATH):
+    paths = sorted(glob.glob(os.path.join(path, "*.csv")) + glob.glob(os.path.join(path, "*.parquet"))) \
+        if os.path.isdir(path) else [path] if os.path.exists(path) else []
+    if not paths:
+        return pd.DataFrame({"ticker": pd.Series(dtype=str), "date": pd.Series(dtype="datetime64[ns]"),
+                             **{field: pd.Series(dtype=float) for field in FIELDS}})
+    frame = pd.concat([_read(file) for file in paths], ignore_index=True)
+    frame["ticker"] = frame["ticker"].astype(str).str.upper()
+    frame["date"] = pd.to_datetime(frame["date"])
+    return frame
+
+
+# Wide frames (dates x tickers), one per OHLCV field, so every indicator runs over all tickers at once
+def to_panel(frame):
+    fields = [field for field in FIELDS if field in frame]
+    frame = frame.drop_duplicates(["date", "ticker"], keep="last")
+    wide = frame.set_index(["date", "ticker"])[fields].astype(float).unstack("ticker").sort_index()
+    return {field: wide[field] for field in fields}
+
+
+def _last_valid_dates(frame):
+    valid = frame.notna().to_numpy()
+    last = len(frame) - 1 - valid[::-1].argmax(axis=0)
+    return pd.Series(frame.index[last], index=frame.columns).where(valid.any(axis=0))
+
+
+def sma(close, window):
+    return close.rolling(window, min_periods=window).mean()
+
+
+def ema(close, span):
+    return close.ewm(span=span, adjust=False, min_periods=span).mean()
+
+
+# Wilder's smoothing, as used by RSI and ATR
+def _wilder(values, window):
+    return values.ewm(alpha=1 / window, adjust=False, min_periods=window).mean()
+
+
+def rsi(close, window=14):
+    change = close.diff()
+    gain = _wilder(change.clip(lower=0), window)
+    loss = _wilder(-change.clip(upper=0), window)
+    return 100 - 100 / (1 + gain / loss.replace(0, np.nan))
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = line.ewm(span=signal, adjust=False, min_periods=signal).mean()
+    return line, signal_line, line - signal_line
+
+
+def bollinger(close, window=20, width=2.0):
+    middle = sma(close, window)
+    deviation = close.rolling(window, min_periods=window).std()
+    upper, lower = middle + width * deviation, middle - width * deviation
+    return upper, lower, (close - lower) / (upper - lower)
+
+
+def atr(high, low, close, window=14):
+    previous = close.shift()
+    true_range = np.maximum(high - low, np.maximum((high - previous).abs(), (low - previous).abs()))
+    return _wilder(true_range, window)
+
+
+def drawdown(close):
+    return close / close.cummax() - 1
+
+
+# Latest value of every indicator for every ticker, one row per ticker. Tickers whose market was closed on
+# the last dates (other exchanges, halts) carry their last prices forward.
+def compute_indicators(panel):
+    close = panel["close"].ffill()
+    last = close.iloc[-1]
+    macd_line, macd_signal, macd_hist = macd(close)
+    bb_upper, bb_lower, bb_percent = bollinger(close)
+    columns = {
+        "as_of": _last_valid_dates(panel["close"]),
+        "close": last,
+        "change_1m": last / close.shift(21).iloc[-1] - 1,
+        "change_1y": last / close.shift(TRADING_DAYS).iloc[-1] - 1,
+        "sma50": sma(close, 50).iloc[-1],
+        "sma200": sma(close, 200).iloc[-1],
+        "ema20": ema(close, 20).iloc[-1],
+        "rsi14": rsi(close).iloc[-1],
+        "macd": macd_line.iloc[-1],
+        "macd_signal": macd_signal.iloc[-1],
+        "macd_hist": macd_hist.iloc[-1],
+        "bb_upper": bb_upper.iloc[-1],
+        "bb_lower": bb_lower.iloc[-1],
+        "bb_percent": bb_percent.iloc[-1],
+        "drawdown": drawdown(close).iloc[-1],
+        "max_drawdown_1y": drawdown(close.iloc[-TRADING_DAYS:]).min(),
+    }
+    if "high" in panel and "low" in panel:
+        columns["atr14"] = atr(panel["high"].ffill(), panel["low"].ffill(), close).iloc[-1]
+        columns["atr_percent"] = columns["atr14"] / last
+    if "volume" in panel:
+        columns["volume_ratio"] = panel["volume"].iloc[-1] / panel["volume"].rolling(20, min_periods=20).mean().iloc[-1]
+    return pd.DataFrame(columns)
+
+
+def _number(value, pattern="{:.2f}"):
+    return "n/a" if pd.isna(value) else pattern.format(value)
+
+
+def _percent(value):
+    return _number(value * 100 if not pd.isna(value) else value, "{:+.1f}%")
+
+
+def _relative(price, level):
+    return f"{_number(level)} ({_percent(price / level - 1)})" if not pd.isna(level) else "n/a"
+
+
+# Compact text for the prompt, a few hundred characters per ticker
+def summarize(ticker, row):
+    price = row["close"]
+    as_of = row["as_of"].date() if not pd.isna(row["as_of"]) else "n/a"
+    lines = [
+        f"{ticker} as of {as_of}: close {_number(price)}, 1m {_percent(row['change_1m'])}, 1y {_percent(row['change_1y'])}",
+        f"SMA50 {_relative(price, row['sma50'])}, SMA200 {_relative(price, row['sma200'])}, "
+        f"EMA20 {_relative(price, row['ema20'])}",
+        f"RSI14 {_number(row['rsi14'], '{:.1f}')}, MACD {_number(row['macd'])} vs signal {_number(row['macd_signal'])} "
+        f"(histogram {_number(row['macd_hist'], '{:+.2f}')})",
+        f"Bollinger 20/2 {_number(row['bb_lower'])}-{_number(row['bb_upper'])}, %B {_number(row['bb_percent'])}",
+        f"Drawdown {_percent(row['drawdown'])}, max 1y drawdown {_percent(row['max_drawdown_1y'])}",
+    ]
+    if "atr14" in row:
+        lines.append(f"ATR14 {_number(row['atr14'])} ({_number(row['atr_percent'] * 100, '{:.1f}%')} of price)")
+    if "volume_ratio" in row:
+        lines.append(f"Volume {_number(row['volume_ratio'], '{:.2f}')}x its 20-day average")
+    return "\n".join(lines)
+
+
+# Indicators of every ticker in OHLCV_PATH, computed once and recomputed when the data changes
+class IndicatorEngine:
+    def __init__(self, path=OHLCV_PATH):
+        self.path = path
+        self._table = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _current_version(self):
+        paths = glob.glob(os.path.join(self.path, "*")) if os.path.isdir(self.path) else [self.path]
+        return tuple(sorted((path, os.path.getmtime(path)) for path in paths if os.path.exists(path)))
+
+    def table(self):
+        with self._lock:
+            version = self._current_version()
+            if not version:
+                return None
+            if version != self._version:
+                frame = load_ohlcv(self.path)
+                self._table = compute_indicators(to_panel(frame)) if not frame.empty else None
+                self._version = version
+                if self._table is None:
+                    logger.warning(f"No OHLCV files in {self.path}")
+                else:
+                    logger.info(f"Computed indicators for {len(self._table)} tickers")
+            return self._table
+
+    def summary(self, ticker):
+        table = self.table()
+        ticker = ticker.strip().upper()
+        if table is None or ticker not in table.index:
+            return f"No local price data for {ticker}."
+        return summarize(ticker, table.loc[ticker])
+
+
+engine = IndicatorEngine()
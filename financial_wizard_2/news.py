@@ -0,0 +1,106 @@
+import os
+import re
+import zlib
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# News items fetched per company, the clustering keeps the prompt small whatever this is
+NEWS_SEARCH_RESULTS = int(os.environ.get("NEWS_SEARCH_RESULTS", 50))
+# Stories (clusters) that reach the prompt
+NEWS_MAX_CLUSTERS = int(os.environ.get("NEWS_MAX_CLUSTERS", 12))
+# Estimated Jaccard similarity of word shingles above which two items are the same story
+NEWS_SIMILARITY = 0.5
+# Weight of a story halves every this many days
+NEWS_HALF_LIFE_DAYS = 7
+# Undated items count as old as the search window
+UNDATED_AGE_DAYS = 30
+
+SHINGLE_SIZE = 3
+# 32 bands of 4 rows: pairs above ~0.42 similarity share a bucket with high probability
+BANDS, ROWS = 32, 4
+_PRIME = np.uint64(4294967291)
+_random = np.random.default_rng(1)
+_A = _random.integers(1, int(_PRIME), BANDS * ROWS, dtype=np.uint64)
+_B = _random.integers(0, int(_PRIME), BANDS * ROWS, dtype=np.uint64)
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    words = re.findall(r"\w+", (text or "").lower())
+    grams = {" ".join(words[index:index + size]) for index in range(max(len(words) - size + 1, 1))}
+    return [zlib.crc32(gram.encode("utf-8")) for gram in grams if gram]
+
+
+# One MinHash signature (BANDS * ROWS values) per text, computed a chunk of texts per array pass
+def minhash_signatures(texts, chunk_size=1000):
+    signatures = []
+    for start in range(0, len(texts), chunk_size):
+        hashed = [shingles(text) or [0] for text in texts[start:start + chunk_size]]
+        lengths = np.array([len(values) for values in hashed])
+        values = np.fromiter((value for values in hashed for value in values), dtype=np.uint64, count=lengths.sum())
+        # (a * x + b) mod p with a, b, x below 2**32 fits in uint64
+        permuted = (np.outer(_A, values) + _B[:, None]) % _PRIME
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        signatures.append(np.minimum.reduceat(permuted, offsets, axis=1).T)
+    return np.concatenate(signatures) if signatures else np.empty((0, BANDS * ROWS), dtype=np.uint64)
+
+
+def _find(parents, item):
+    while parents[item] != item:
+        parents[item] = parents[parents[item]]
+        item = parents[item]
+    return item
+
+
+# Cluster ids for the signatures. Items sharing an LSH bucket join the bucket's first item when their
+# signatures agree enough, so the work grows with the number of items rather than the pairs.
+def cluster(signatures, similarity=NEWS_SIMILARITY):
+    parents = list(range(len(signatures)))
+    for band in range(BANDS):
+        buckets = {}
+        rows = np.ascontiguousarray(signatures[:, band * ROWS:(band + 1) * ROWS])
+        for item, key in enumerate(rows):
+            buckets.setdefault(key.tobytes(), []).append(item)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            first = members[0]
+            agreement = (signatures[members[1:]] == signatures[first]).mean(axis=1)
+            for other, estimate in zip(members[1:], agreement):
+                if estimate >= similarity:
+                    parents[_find(parents, other)] = _find(parents, first)
+    return np.array([_find(parents, item) for item in range(len(signatures))])
+
+
+# One row per story: its most recent item, how many items it covers and a recency-weighted size score
+def condense(records, max_clusters=NEWS_MAX_CLUSTERS, now=None):
+    if not records:
+        return pd.DataFrame(columns=["title", "url", "snippet", "date", "count", "score"])
+    items = pd.DataFrame(records).reindex(columns=["title", "url", "snippet", "date"])
+    items["rank"] = np.arange(len(items))
+    texts = (items["title"].fillna("") + " " + items["snippet"].fillna("")).tolist()
+    items["cluster"] = cluster(minhash_signatures(texts))
+    dates = pd.to_datetime(items["date"], errors="coerce", utc=True)
+    now = now or pd.Timestamp.now(tz="UTC")
+    items["age"] = ((now - dates).dt.total_seconds() / 86400).fillna(UNDATED_AGE_DAYS).clip(lower=0)
+    grouped = items.groupby("cluster")
+    clusters = items.sort_values(["age", "rank"]).drop_duplicates("cluster").set_index("cluster")
+    clusters["count"] = grouped.size()
+    clusters["rank"] = grouped["rank"].min()
+    clusters["score"] = clusters["count"] * 0.5 ** (clusters["age"] / NEWS_HALF_LIFE_DAYS)
+    clusters = clusters.sort_values(["score", "rank"], ascending=[False, True]).head(max_clusters)
+    logger.info(f"Condensed {len(items)} news items into {items['cluster'].nunique()} stories, kept {len(clusters)}")
+    return clusters.reset_index(drop=True)
+
+
+def format_clusters(clusters):
+    if clusters.empty:
+        return "No news found."
+    blocks = []
+    for story in clusters.itertuples():
+        date = f" ({str(story.date)[:10]})" if isinstance(story.date, str) and story.date else ""
+        count = f" [reported {story.count} times]" if story.count > 1 else ""
+        blocks.append(f"{story.title}{date}{count} - {story.url}\n{story.snippet}")
+    return "\n\n".join(blocks)
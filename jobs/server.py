@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import logging
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import tornado.web
+import tornado.ioloop
+from utils.headless import load_app
+from utils.job_queue import JobQueue, JobLog
+
+logger = logging.getLogger(__name__)
+
+JOB_SERVER_PORT = int(os.environ.get("JOB_SERVER_PORT", 8765))
+# Jobs run at the same time; their stages also share the pipeline's process-wide concurrency cap
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+POLL_INTERVAL = 1.0
+
+# Job name -> (app directory, required params, how to run it). Pipelines write their stages to the job's log.
+PIPELINES = {
+    "bookgen": ("BookGen", ["theme"], lambda app, log, params: app.run_pipeline(
+        params["theme"], log, False, params.get("resume", True), params.get("chapter_outlines"))),
+    "content": ("financial_wizard1", ["theme"], lambda app, log, params: app.run_pipeline(params["theme"], False, log)),
+    "stock_analysis": ("financial_wizard_2", ["company"], lambda app, log, params: app.run_pipeline(
+        params["company"], False, log, params.get("ticker"))),
+}
+
+
+def summarize(result):
+    return {
+        "outputs": result.outputs,
+        "errors": {name: f"{type(error).__name__}: {error}" for name, error in result.errors.items()},
+        "restored": result.restored,
+        "critical_path": result.critical_path,
+        "critical_path_time": result.critical_path_time,
+        "wall_time": result.wall_time,
+    }
+
+
+class Worker(threading.Thread):
+    def __init__(self, queue, apps, stopped):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.apps = apps
+        self.stopped = stopped
+
+    def run(self):
+        while not self.stopped.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self.stopped.wait(POLL_INTERVAL)
+                continue
+            app_name, _, run = PIPELINES[job["pipeline"]]
+            logger.info(f"Running job {job['id']} ({job['pipeline']}, attempt {job['attempts']})")
+            try:
+                result = run(self.apps[app_name], JobLog(self.queue, job["id"]), job["params"])
+                self.queue.finish(job["id"], summarize(result))
+                logger.info(f"Job {job['id']} done in {result.wall_time:.1f}s")
+            except Exception as e:
+                logger.exception(f"Job {job['id']} failed")
+                self.queue.fail(job["id"], f"{type(e).__name__}: {e}")
+
+
+class JobsHandler(tornado.web.RequestHandler):
+    def initialize(self, queue):
+        self.queue = queue
+
+    def get(self):
+        self.write({"jobs": self.queue.recent()})
+
+    def post(self):
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="Body must be JSON")
+        pipeline, params = body.get("pipeline"), body.get("params") or {}
+        if pipeline not in PIPELINES:
+            raise tornado.web.HTTPError(400, reason=f"Unknown pipeline, use one of {sorted(PIPELINES)}")
+        missing = [name for name in PIPELINES[pipeline][1] if not params.get(name)]
+        if missing:
+            raise tornado.web.HTTPError(400, reason=f"Missing params {missing}")
+        job_id = self.queue.submit(pipeline, params)
+        self.set_status(201)
+        self.write({"id": job_id, "status": "queued"})
+
+
+class JobHandler(tornado.web.RequestHandler):
+    def initialize(self, queue):
+        self.queue = queue
+
+    def get(self, job_id):
+        job = self.queue.get(job_id)
+        if job is None:
+            raise tornado.web.HTTPError(404)
+        self.write(json.dumps(job, default=str))
+        self.set_header("Content-Type", "application/json")
+
+    # Only queued jobs can be cancelled, running ones keep their spend
+    def delete(self, job_id):
+        self.write({"cancelled": self.queue.cancel(job_id)})
+
+
+def make_app(queue):
+    return tornado.web.Application([
+        (r"/jobs", JobsHandler, {"queue": queue}),
+        (r"/jobs/([0-9a-f]+)", JobHandler, {"queue": queue}),
+    ])
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    queue = JobQueue()
+    requeued = queue.requeue_running()
+    if requeued:
+        logger.info(f"Queued again {requeued} jobs left running by the previous server")
+    apps = {app_name: load_app(app_name) for app_name, _, _ in PIPELINES.values()}
+    stopped = threading.Event()
+    for _ in range(JOB_WORKERS):
+        Worker(queue, apps, stopped).start()
+    make_app(queue).listen(JOB_SERVER_PORT, address="127.0.0.1")
+    logger.info(f"Job server listening on http://127.0.0.1:{JOB_SERVER_PORT} with {JOB_WORKERS} workers")
+    try:
+        tornado.ioloop.IOLoop.current().start()
+    finally:
+        stopped.set()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import os
+import sys
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Swallows every Streamlit call made on a container, for pipelines run without a page
+class NullContainer:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# Imports an app's app.py without drawing its page (the UI only runs under `streamlit run`). The app's directory
+# goes on the path, as `streamlit run` does, for its local modules.
+def load_app(name):
+    directory = os.path.join(ROOT, name)
+    if directory not in sys.path:
+        sys.path.append(directory)
+    spec = importlib.util.spec_from_file_location(f"{name}_app", os.path.join(ROOT, name, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
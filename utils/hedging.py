@@ -0,0 +1,156 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.runnables import Runnable
+from utils.llms import MODELS, get_llm, call_cost
+from utils.router import tracker, MIN_SAMPLES, AllModelsFailed, provider_latency, is_cache_hit
+from utils.rate_limiter import reset_queue_wait
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# How long to wait for the primary before hedging while it has too few answered, uncached calls for a p95, in seconds
+DEFAULT_HEDGE_DELAY = float(os.environ.get("LLM_HEDGE_DELAY", 20))
+# Extra spend one run may put into duplicate requests, in USD
+DEFAULT_HEDGE_BUDGET = float(os.environ.get("LLM_HEDGE_BUDGET", 0.05))
+# Model calls of every hedge in flight. Throttled primaries hold theirs while they queue, so this is sized by the
+# concurrency of the apps rather than by the CPUs.
+HEDGE_MAX_THREADS = int(os.environ.get("LLM_HEDGE_MAX_THREADS", 32))
+
+
+# Extra spend of the duplicate requests of one run. Create one per run and share it between its hedged chains.
+class HedgeBudget:
+    def __init__(self, max_cost=DEFAULT_HEDGE_BUDGET):
+        self.max_cost = max_cost
+        self.spent = 0.0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, cost):
+        with self._lock:
+            if self.spent + cost > self.max_cost:
+                return False
+            self.spent += cost
+            self.hedges += 1
+            return True
+
+    def adjust(self, delta):
+        with self._lock:
+            self.spent += delta
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+# Event loop shared by every hedge, running in a daemon thread. It only times the race, the model calls themselves
+# run in its worker threads.
+def _hedge_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop.set_default_executor(ThreadPoolExecutor(max_workers=HEDGE_MAX_THREADS, thread_name_prefix="hedge"))
+            threading.Thread(target=_loop.run_forever, name="hedge-loop", daemon=True).start()
+        return _loop
+
+
+def _usage(message):
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("input_tokens"), usage.get("output_tokens")
+
+
+# Drop-in replacement for an llm client in a chain: prompt | HedgedModel("llm1", "llm6", budget) | StrOutputParser().
+# When the primary has not answered after its observed p95 latency, the same prompt is sent to the backup,
+# the first answer wins and the other one is dropped (its thread finishes in the background). Duplicates stop once
+# the run's budget is spent. Streaming callers get the winning answer as one chunk. `delay` fixes the wait in seconds.
+class HedgedModel(Runnable):
+    def __init__(self, primary, backup, budget=None, delay=None):
+        self.primary = primary
+        self.backup = backup
+        self.budget = budget if budget is not None else HedgeBudget()
+        self.fixed_delay = delay
+        # Lets pack() and context_window() size prompts for the primary model
+        self.model_name = MODELS[primary]["model"]
+
+    def delay(self):
+        if self.fixed_delay is not None:
+            return self.fixed_delay
+        # The tracker only holds provider latencies, cache hits and rate-limit queueing would make the hedge fire early
+        stats = tracker.stats(self.primary)
+        if stats["samples"] < MIN_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        return stats["p95"]
+
+    # Runs in a worker thread of the loop: the clients' rate limiters wait with time.sleep, even on the async path,
+    # and a throttled primary must not keep the loop from starting the backup
+    def _call(self, name, input, config, **kwargs):
+        reset_queue_wait()
+        started_at = time.time()
+        try:
+            output = get_llm(name).invoke(input, config, **kwargs)
+        except Exception:
+            tracker.record(name, provider_latency(started_at), ok=False)
+            raise
+        if not is_cache_hit(output):
+            tracker.record(name, provider_latency(started_at), ok=True)
+        return output
+
+    def _estimated_cost(self, input):
+        prompt_tokens = estimate_tokens(input.to_string() if hasattr(input, "to_string") else input)
+        # The completion is not known yet, assume it is about as long as the prompt
+        return call_cost(MODELS[self.backup]["model"], prompt_tokens, prompt_tokens)
+
+    async def _race(self, input, config=None, **kwargs):
+        primary = asyncio.ensure_future(asyncio.to_thread(self._call, self.primary, input, config, **kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=self.delay())
+        if done and primary.exception() is None:
+            return primary.result()
+
+        # A failed primary is failed over whatever the budget, a slow one is only hedged while the budget lasts
+        hedging = not done
+        estimated_cost = self._estimated_cost(input)
+        if hedging and not self.budget.reserve(estimated_cost):
+            logger.info(f"Hedge budget of {self.budget.max_cost} USD spent, waiting for {self.primary}")
+            return await primary
+        if hedging:
+            logger.info(f"{self.primary} is slower than {self.delay():.1f}s, hedging with {self.backup}")
+        else:
+            logger.warning(f"{self.primary} failed ({primary.exception()}), falling back to {self.backup}")
+
+        backup = asyncio.ensure_future(asyncio.to_thread(self._call, self.backup, input, config, **kwargs))
+        pending = {primary, backup} if hedging else {backup}
+        errors = [] if hedging else [primary.exception()]
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    input_tokens, output_tokens = _usage(task.result())
+                    if hedging and task is backup and input_tokens is not None:
+                        # Charges what the duplicate actually cost instead of the estimate
+                        actual_cost = call_cost(MODELS[self.backup]["model"], input_tokens, output_tokens or 0)
+                        self.budget.adjust(actual_cost - estimated_cost)
+                    return task.result()
+        finally:
+            # The loser is no longer awaited, its call runs to completion in its thread
+            for task in pending:
+                task.cancel()
+        raise AllModelsFailed(f"{self.primary} and {self.backup} both failed: {errors}") from errors[-1]
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        future = asyncio.run_coroutine_threadsafe(self._race(input, config, **kwargs), _hedge_loop())
+        return await asyncio.wrap_future(future)
+
+    # Pipeline stages run in worker threads, they wait on the shared loop
+    def invoke(self, input, config=None, **kwargs):
+        return asyncio.run_coroutine_threadsafe(self._race(input, config, **kwargs), _hedge_loop()).result()
+
+
+def hedged(primary, backup, budget=None, delay=None):
+    return HedgedModel(primary, backup, budget, delay)
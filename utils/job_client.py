@@ -0,0 +1,41 @@
+import os
+import time
+import logging
+import requests
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+# Pages hand their pipelines to the job server (jobs/server.py) when this is set, and run them inline otherwise
+JOB_SERVER_URL = os.environ.get("JOB_SERVER_URL")
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 2))
+
+
+def submit_job(pipeline, params):
+    response = requests.post(f"{JOB_SERVER_URL}/jobs", json={"pipeline": pipeline, "params": params}, timeout=10)
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+def get_job(job_id):
+    response = requests.get(f"{JOB_SERVER_URL}/jobs/{job_id}", timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+
+# Renders what the job has written so far and, while it is not finished, reruns the page after a short wait.
+# The job keeps running on the server whatever happens to the page.
+def follow_job(container, job_id):
+    job = get_job(job_id)
+    for entry in job["log"]:
+        if entry["kind"] == "error":
+            container.error(entry["text"])
+        else:
+            container.write(entry["text"])
+    if job["status"] in ("queued", "running"):
+        container.info(f"Job {job_id[:8]} is {job['status']}, this page refreshes until it is done.")
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
+    if job["status"] == "failed":
+        container.error(f"Job failed: {job['error']}")
+    return job
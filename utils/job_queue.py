@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+from contextlib import contextmanager
+
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", os.path.expanduser("~/.cache/personall/jobs.sqlite"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+# Persistent FIFO of pipeline jobs. A job is claimed by one worker at a time; jobs left running by a
+# server that stopped are queued again when the next one starts.
+class JobQueue:
+    def __init__(self, path=JOB_QUEUE_PATH):
+        self.path = path
+
+    @contextmanager
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, pipeline TEXT, params TEXT, status TEXT, log TEXT DEFAULT '[]',
+            result TEXT, error TEXT, attempts INTEGER DEFAULT 0,
+            created_at REAL, started_at REAL, finished_at REAL)""")
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _row(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["log"] = json.loads(job["log"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def submit(self, pipeline, params):
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute("INSERT INTO jobs (id, pipeline, params, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                         (job_id, pipeline, json.dumps(params), QUEUED, time.time()))
+        return job_id
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            return self._row(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def recent(self, limit=50):
+        with self._connect() as conn:
+            rows = conn.execute("""SELECT id, pipeline, status, attempts, created_at, started_at, finished_at
+                FROM jobs ORDER BY created_at DESC LIMIT ?""", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    # Oldest queued job, marked running, or None
+    def claim(self):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                                   (QUEUED,)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                                 (RUNNING, time.time(), row["id"]))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return self._row(row)
+
+    def append_log(self, job_id, entry):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET log = json_insert(log, '$[#]', json(?)) WHERE id = ?",
+                         (json.dumps(entry), job_id))
+
+    def finish(self, job_id, result):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, result = ?, finished_at = ? WHERE id = ?",
+                         (DONE, json.dumps(result, default=str), time.time(), job_id))
+
+    def fail(self, job_id, error):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                         (FAILED, error, time.time(), job_id))
+
+    def cancel(self, job_id):
+        with self._connect() as conn:
+            return conn.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                                (CANCELLED, time.time(), job_id, QUEUED)).rowcount > 0
+
+    # Queues again the jobs a previous server left running, keeping their log
+    def requeue_running(self):
+        with self._connect() as conn:
+            return conn.execute("UPDATE jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING)).rowcount
+
+
+# Streamlit-like container that appends what a pipeline writes to its job's log, so pages polling the
+# job see each stage as soon as it is done
+class JobLog:
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+
+    def write(self, text):
+        self.queue.append_log(self.job_id, {"kind": "write", "text": str(text), "at": time.time()})
+        return self
+
+    def error(self, text):
+        self.queue.append_log(self.job_id, {"kind": "error", "text": str(text), "at": time.time()})
+        return self
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
@@ -0,0 +1,139 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import logging
+from contextlib import contextmanager
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.messages import AIMessageChunk, message_chunk_to_message
+from langchain_core.outputs import ChatGeneration
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.expanduser("~/.cache/personall/llm_cache.sqlite"))
+MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 10000))
+DEFAULT_TTL = int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+
+
+@contextmanager
+def _connect(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at REAL, accessed_at REAL)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS llm_cache_stats (
+        model TEXT PRIMARY KEY, hits INTEGER DEFAULT 0, misses INTEGER DEFAULT 0)""")
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+# Disk-backed response cache for one model. Every model shares the same SQLite file and LRU budget,
+# entries are keyed on the model configuration (name, temperature and other params) and the rendered prompt.
+class LLMCache(BaseCache):
+    def __init__(self, model, ttl=DEFAULT_TTL, path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        self.model = model
+        self.ttl = ttl
+        self.path = path
+        self.max_entries = max_entries
+
+    @staticmethod
+    def _key(prompt, llm_string):
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def _count(self, conn, column):
+        conn.execute("INSERT OR IGNORE INTO llm_cache_stats (model) VALUES (?)", (self.model,))
+        conn.execute(f"UPDATE llm_cache_stats SET {column} = {column} + 1 WHERE model = ?", (self.model,))
+
+    def lookup(self, prompt, llm_string):
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with _connect(self.path) as conn:
+            row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self._count(conn, "misses")
+                return None
+            conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._count(conn, "hits")
+        try:
+            generations = [loads(generation) for generation in json.loads(row[0])]
+        except Exception:
+            logger.warning(f"Unreadable cache entry for {self.model}, ignoring it")
+            return None
+        # Lets callbacks (telemetry) tell cached responses apart
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            if message is not None:
+                message.response_metadata["cache_hit"] = True
+        return generations
+
+    # Whether a fresh entry exists, without touching it. A miss is counted, since the caller is about to compute
+    # the response; a hit is counted by the lookup that follows.
+    def contains(self, prompt, llm_string):
+        key = self._key(prompt, llm_string)
+        with _connect(self.path) as conn:
+            row = conn.execute("SELECT created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and time.time() - row[0] <= self.ttl:
+                return True
+            self._count(conn, "misses")
+        return False
+
+    def update(self, prompt, llm_string, return_val):
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        response = json.dumps([dumps(generation) for generation in return_val])
+        with _connect(self.path) as conn:
+            conn.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?)",
+                         (key, self.model, response, now, now))
+            # Evict the least recently used entries once the shared cap is exceeded
+            conn.execute("""DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)""", (self.max_entries,))
+
+    def clear(self, **kwargs):
+        with _connect(self.path) as conn:
+            conn.execute("DELETE FROM llm_cache WHERE model = ?", (self.model,))
+            conn.execute("DELETE FROM llm_cache_stats WHERE model = ?", (self.model,))
+
+    def stats(self):
+        with _connect(self.path) as conn:
+            row = conn.execute("SELECT hits, misses FROM llm_cache_stats WHERE model = ?", (self.model,)).fetchone()
+        hits, misses = row or (0, 0)
+        return {"model": self.model, "hits": hits, "misses": misses}
+
+
+# chat_model.stream() with its LLMCache, which BaseChatModel.stream skips. A cached response is fetched with invoke
+# (so callbacks still see the call) and yielded as one chunk; a streamed response is stored once it is complete.
+def cached_stream(chat_model, input, config=None, **kwargs):
+    cache = getattr(chat_model, "cache", None)
+    if not isinstance(cache, LLMCache):
+        yield from chat_model.stream(input, config, **kwargs)
+        return
+    prompt = dumps(chat_model._convert_input(input).to_messages())
+    llm_string = chat_model._get_llm_string(**kwargs)
+    if cache.contains(prompt, llm_string):
+        message = chat_model.invoke(input, config, **kwargs)
+        yield AIMessageChunk(content=message.content, response_metadata=message.response_metadata,
+                             usage_metadata=message.usage_metadata)
+        return
+    streamed = None
+    for chunk in chat_model.stream(input, config, **kwargs):
+        streamed = chunk if streamed is None else streamed + chunk
+        yield chunk
+    if streamed is not None:
+        cache.update(prompt, llm_string, [ChatGeneration(message=message_chunk_to_message(streamed))])
+
+
+# Hit and miss counters for every cached model
+def cache_stats(path=CACHE_PATH):
+    with _connect(path) as conn:
+        rows = conn.execute("SELECT model, hits, misses FROM llm_cache_stats ORDER BY model").fetchall()
+    return [{"model": model, "hits": hits, "misses": misses} for model, hits, misses in rows]
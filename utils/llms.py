@@ -1,58 +1,204 @@
+import os
 import logging
+import threading
+from typing import Any
+import httpx
+import toml
+import anthropic
+from langchain_core.pydantic_v1 import root_validator
 from langchain_groq import ChatGroq
 from langchain_anthropic import ChatAnthropic
+from utils.llm_cache import LLMCache, DEFAULT_TTL
+from utils.rate_limiter import SharedRateLimiter
 
 
 logger = logging.getLogger(__name__)
 
-groq_api_key = "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"
+# API keys come from the environment (GROQ_API_KEY, ANTHROPIC_API_KEY) or from this TOML file
+# (groq_api_key = "...", anthropic_api_key = "...")
+CONFIG_PATH = os.environ.get("LLM_CONFIG_PATH", os.path.expanduser("~/.config/personall/llms.toml"))
 
-anthropic_api_key = "sk-ant-REDACTED"
+# Client settings of every model the apps use. Clients are built on first use and shared by the whole process.
+MODELS = {
+    "llm1": {"provider": "groq", "model": "llama3-70b-8192", "temperature": 0.5},
+    "llm2": {"provider": "groq", "model": "gemma2-9b-it", "temperature": 0.5},
+    "llm3": {"provider": "groq", "model": "llama3-8b-8192", "temperature": 0.5},
+    "llm4": {"provider": "anthropic", "model": "claude-3-opus-20240229", "temperature": 0, "timeout": 60000,
+             "max_retries": 5},
+    "llm5": {"provider": "anthropic", "model": "claude-3-sonnet-20240229", "temperature": 0, "timeout": 600,
+             "max_retries": 5},
+    "llm6": {"provider": "anthropic", "model": "claude-3-haiku-20240307", "temperature": 0, "timeout": 600,
+             "max_retries": 5},
+    "llm7": {"provider": "groq", "model": "llama3-groq-8b-8192-tool-use-preview", "temperature": 0.5},
+}
 
-if not groq_api_key:
-    logger.error("Groq API key está ausente")
-    raise Exception("Groq API key is missing")
+# Requests and tokens per minute allowed for each model, shared by every process using the same key on this host
+RATE_LIMITS = {
+    "llama3-70b-8192": (30, 6000),
+    "llama3-8b-8192": (30, 30000),
+    "llama3-groq-8b-8192-tool-use-preview": (30, 15000),
+    "gemma2-9b-it": (30, 15000),
+    "claude-3-opus-20240229": (50, 20000),
+    "claude-3-sonnet-20240229": (50, 40000),
+    "claude-3-haiku-20240307": (50, 50000),
+}
 
-llm1 = ChatGroq(
-    temperature=0.5,
-    model="llama3-70b-8192",
-    api_key=groq_api_key,
-)
+# Price of every model in USD per million tokens, as (input, output)
+PRICES = {
+    "llama3-70b-8192": (0.59, 0.79),
+    "llama3-8b-8192": (0.05, 0.08),
+    "llama3-groq-8b-8192-tool-use-preview": (0.19, 0.19),
+    "gemma2-9b-it": (0.20, 0.20),
+    "claude-3-opus-20240229": (15.0, 75.0),
+    "claude-3-sonnet-20240229": (3.0, 15.0),
+    "claude-3-haiku-20240307": (0.25, 1.25),
+}
 
-llm2 = ChatGroq(
-    temperature=0.5,
-    model="gemma2-9b-it",
-    api_key=groq_api_key,
+# Context window of every model the apps use, in tokens (prompt and completion together)
+CONTEXT_WINDOWS = {
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "llama3-groq-8b-8192-tool-use-preview": 8192,
+    "gemma2-9b-it": 8192,
+    "claude-3-opus-20240229": 200000,
+    "claude-3-sonnet-20240229": 200000,
+    "claude-3-haiku-20240307": 200000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Response cache TTLs per model, in seconds
+CACHE_TTLS = {
+    "claude-3-opus-20240229": 30 * 24 * 3600,
+    "claude-3-sonnet-20240229": 30 * 24 * 3600,
+    "claude-3-haiku-20240307": 7 * 24 * 3600,
+}
+
+# Sampled (non-zero temperature) models are only cached when explicitly enabled
+CACHE_SAMPLED_MODELS = os.environ.get("LLM_CACHE_SAMPLED_MODELS", "0") == "1"
+
+# Connection pool shared by every client, so keep-alive connections and TLS sessions are reused
+HTTP_MAX_CONNECTIONS = int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", 20))
+
+_lock = threading.RLock()
+_clients = {}
+_http_client = None
+_client_factory = None
+
+
+def model_name(llm):
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None)
+
+
+def context_window(llm):
+    return CONTEXT_WINDOWS.get(model_name(llm), DEFAULT_CONTEXT_WINDOW)
+
+
+def call_cost(model, input_tokens, output_tokens):
+    input_price, output_price = PRICES.get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def response_cache(model, temperature):
+    if temperature != 0 and not CACHE_SAMPLED_MODELS:
+        return None
+    return LLMCache(model, ttl=CACHE_TTLS.get(model, DEFAULT_TTL))
+
+
+def get_api_key(provider):
+    variable = f"{provider.upper()}_API_KEY"
+    api_key = os.environ.get(variable)
+    if not api_key and os.path.exists(CONFIG_PATH):
+        api_key = toml.load(CONFIG_PATH).get(f"{provider}_api_key")
+    if not api_key:
+        logger.error(f"{provider} API key está ausente")
+        raise Exception(f"{variable} is missing, set it in the environment or in {CONFIG_PATH}")
+    return api_key
+
+
+def shared_http_client():
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+                timeout=httpx.Timeout(600, connect=10),
+            )
+        return _http_client
+
+
+# ChatAnthropic does not take an httpx client, this rebuilds its sync client on the shared one
+class PooledChatAnthropic(ChatAnthropic):
+    http_client: Any = None
+
+    @root_validator(pre=False, skip_on_failure=True)
+    def use_http_client(cls, values):
+        if values.get("http_client") is not None:
+            values["_client"] = anthropic.Client(
+                api_key=values["anthropic_api_key"].get_secret_value(),
+                base_url=values["anthropic_api_url"],
+                max_retries=values["max_retries"],
+                timeout=values["default_request_timeout"],
+                default_headers=values.get("default_headers"),
+                http_client=values["http_client"],
+            )
+        return values
+
+
+def rate_limiter(model):
+    if model not in RATE_LIMITS:
+        return None
+    requests_per_minute, tokens_per_minute = RATE_LIMITS[model]
+    return SharedRateLimiter(model, requests_per_minute, tokens_per_minute)
+
+
+def _build(name):
+    spec = MODELS[name]
+    cache = response_cache(spec["model"], spec["temperature"])
+    # The limiter is also a callback, it charges the tokens each call used
+    limiter = rate_limiter(spec["model"])
+    callbacks = [limiter] if limiter else None
+    if spec["provider"] == "groq":
+        return ChatGroq(
+            temperature=spec["temperature"],
+            model=spec["model"],
+            api_key=get_api_key("groq"),
+            http_client=shared_http_client(),
+            cache=cache,
+            rate_limiter=limiter,
+            callbacks=callbacks,
+        )
+    return PooledChatAnthropic(
+        temperature=spec["temperature"],
+        model_name=spec["model"],
+        api_key=get_api_key("anthropic"),
+        timeout=spec["timeout"],
+        max_retries=spec["max_retries"],
+        http_client=shared_http_client(),
+        cache=cache,
+        rate_limiter=limiter,
+        callbacks=callbacks,
     )
 
-llm3 = ChatGroq(    
-    temperature=0.5,
-    model="llama3-8b-8192",
-    api_key=groq_api_key,
-)
-
-
-
-llm4 = ChatAnthropic(
-    temperature=0,
-    model_name="claude-3-opus-20240229",
-    api_key=anthropic_api_key,
-    timeout=60000,
-    max_retries=5,
-)
-
-llm5 = ChatAnthropic(
-    temperature=0,
-    model_name="claude-3-sonnet-20240229",
-    api_key=anthropic_api_key,
-    timeout=600,
-    max_retries=5,
-)
-
-llm6 = ChatAnthropic(
-    temperature=0,
-    model_name="claude-3-haiku-20240307",
-    api_key=anthropic_api_key,
-    timeout=600,
-    max_retries=5,
-)
\ No newline at end of file
+
+# Replaces how clients are built, `factory(name, spec)` returns the client for a registry name. Used by the
+# benchmark to run the apps on simulated models; None restores the real clients.
+def set_client_factory(factory):
+    global _client_factory
+    with _lock:
+        _client_factory = factory
+        _clients.clear()
+
+
+def get_llm(name):
+    with _lock:
+        if name not in _clients:
+            logger.info(f"Building client {name} ({MODELS[name]['model']})")
+            _clients[name] = _client_factory(name, MODELS[name]) if _client_factory else _build(name)
+        return _clients[name]
+
+
+# `from utils.llms import llm1` keeps working, but only the clients actually imported are built
+def __getattr__(name):
+    if name in MODELS:
+        return get_llm(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
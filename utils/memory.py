@@ -0,0 +1,64 @@
+import os
+import logging
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import get_buffer_string
+from langchain_core.prompts import PromptTemplate
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Tokens of recent turns kept verbatim, older turns are folded into the summary
+MEMORY_TOKEN_LIMIT = int(os.environ.get("MEMORY_TOKEN_LIMIT", 1500))
+# Turns (an input and its answer) kept verbatim at most, whatever their size
+MEMORY_KEEP_TURNS = int(os.environ.get("MEMORY_KEEP_TURNS", 3))
+MEMORY_SUMMARY_WORDS = int(os.environ.get("MEMORY_SUMMARY_WORDS", 250))
+
+ROLLING_SUMMARY_TEMPLATE = """Progressively summarize the lines of conversation provided, adding onto the previous summary.
+Keep every idea, decision and open question, drop pleasantries and repetition. Return the new summary only, in at
+most {words} words.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+
+New summary:"""
+
+
+# Summary buffer memory whose size stays flat: the last `keep_turns` turns within `max_token_limit` tokens are sent
+# verbatim, everything older lives in a summary that is updated with the turns that leave the buffer. Token counts
+# use the local estimate, the default implementation asks the model's tokenizer.
+class RollingSummaryMemory(ConversationSummaryBufferMemory):
+    max_token_limit: int = MEMORY_TOKEN_LIMIT
+    keep_turns: int = MEMORY_KEEP_TURNS
+    prompt: PromptTemplate = PromptTemplate.from_template(ROLLING_SUMMARY_TEMPLATE).partial(words=MEMORY_SUMMARY_WORDS)
+
+    def _tokens(self, messages):
+        return estimate_tokens(get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix))
+
+    # Tokens the memory adds to every prompt
+    @property
+    def token_footprint(self):
+        return estimate_tokens(self.moving_summary_buffer) + self._tokens(self.chat_memory.messages)
+
+    # Folds whole turns, so the buffer never starts with an answer whose input was summarized away
+    def _pop_old_messages(self):
+        buffer = self.chat_memory.messages
+        pruned = []
+        while buffer and (len(buffer) > 2 * self.keep_turns or self._tokens(buffer) > self.max_token_limit):
+            turn = 2 if len(buffer) > 1 and buffer[0].type == "human" and buffer[1].type == "ai" else 1
+            pruned += buffer[:turn]
+            del buffer[:turn]
+        return pruned
+
+    def prune(self):
+        pruned = self._pop_old_messages()
+        if pruned:
+            self.moving_summary_buffer = self.predict_new_summary(pruned, self.moving_summary_buffer)
+            logger.info(f"Folded {len(pruned)} messages into the summary, memory is now {self.token_footprint} tokens")
+
+    async def aprune(self):
+        pruned = self._pop_old_messages()
+        if pruned:
+            self.moving_summary_buffer = await self.apredict_new_summary(pruned, self.moving_summary_buffer)
@@ -0,0 +1,245 @@
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from langchain_core.runnables import RunnableLambda
+from utils.run_store import content_hash
+
+logger = logging.getLogger(__name__)
+
+# Process-wide cap on stages running at the same time, shared by every pipeline
+MAX_CONCURRENCY = int(os.environ.get("PIPELINE_MAX_CONCURRENCY", 4))
+_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+
+
+class StageSkipped(Exception):
+    pass
+
+
+# A pipeline stage: a chain (or plain callable) and the names it reads its inputs from.
+# `inputs` is either a list of names or a mapping of chain variable -> stage or pipeline input name.
+@dataclass
+class Stage:
+    name: str
+    runnable: object
+    inputs: object = ()
+    title: str = None
+    header: str = None
+    retries: int = 0
+    retry_on: tuple = (Exception,)
+
+    def __post_init__(self):
+        if not isinstance(self.inputs, dict):
+            self.inputs = {name: name for name in self.inputs}
+
+    def arguments(self, values):
+        return {variable: values[source] for variable, source in self.inputs.items()}
+
+    # Streams the output through `on_token(stage, text_so_far)` when a callback is given and the
+    # runnable supports it, the joined text is still returned for downstream stages. `config` (callbacks,
+    # metadata) is passed to chains, plain callables run inside a lambda runnable so the chains they
+    # invoke inherit it.
+    def call(self, values, on_token=None, config=None):
+        kwargs = self.arguments(values)
+        runnable = self.runnable
+        if config is not None and not hasattr(runnable, "invoke"):
+            runnable = RunnableLambda(lambda arguments: self.runnable(**arguments), name=self.name)
+        if on_token is not None and hasattr(self.runnable, "stream"):
+            text = ""
+            for chunk in runnable.stream(kwargs, config):
+                text += chunk
+                on_token(self, text)
+            return text
+        if hasattr(runnable, "invoke"):
+            return runnable.invoke(kwargs, config)
+        return runnable(**kwargs)
+
+
+@dataclass
+class PipelineResult:
+    outputs: dict = field(default_factory=dict)
+    errors: dict = field(default_factory=dict)
+    durations: dict = field(default_factory=dict)
+    queue_waits: dict = field(default_factory=dict)
+    first_token_times: dict = field(default_factory=dict)
+    attempts: dict = field(default_factory=dict)
+    restored: list = field(default_factory=list)
+    critical_path: list = field(default_factory=list)
+    critical_path_time: float = 0.0
+    wall_time: float = 0.0
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+class Pipeline:
+    def __init__(self, stages, max_workers=None):
+        self.stages = list(stages)
+        self.by_name = {stage.name: stage for stage in self.stages}
+        if len(self.by_name) != len(self.stages):
+            raise ValueError("Stage names must be unique")
+        self.max_workers = max_workers or MAX_CONCURRENCY
+
+    # Stages a stage depends on; every other input must be supplied when the pipeline runs
+    def dependencies(self, stage):
+        return {source for source in stage.inputs.values() if source in self.by_name}
+
+    def _check(self, inputs):
+        for stage in self.stages:
+            if stage.name in inputs:
+                continue
+            missing = [source for source in stage.inputs.values()
+                       if source not in self.by_name and source not in inputs]
+            if missing:
+                raise ValueError(f"Stage {stage.name} reads unknown inputs: {missing}")
+        # Kahn's algorithm, only to reject cycles before anything is submitted
+        remaining = {stage.name: self.dependencies(stage) - set(inputs) for stage in self.stages}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"Pipeline has a dependency cycle between {sorted(remaining)}")
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def _execute(self, stage, values, result, on_token, telemetry):
+        queued_at = time.time()
+        with _slots:
+            result.queue_waits[stage.name] = time.time() - queued_at
+            started_at = time.time()
+
+            def record_token(stage, text):
+                result.first_token_times.setdefault(stage.name, time.time() - started_at)
+                on_token(stage, text)
+
+            try:
+                config = telemetry.config(stage.name) if telemetry is not None else None
+                for attempt in range(stage.retries + 1):
+                    result.attempts[stage.name] = attempt + 1
+                    try:
+                        return stage.call(values, record_token if on_token else None, config)
+                    except stage.retry_on as e:
+                        if attempt == stage.retries:
+                            raise
+                        backoff = 2 ** (attempt + 1)
+                        logger.warning(f"Stage {stage.name} failed ({e}), retrying in {backoff} seconds")
+                        time.sleep(backoff)
+            finally:
+                result.durations[stage.name] = time.time() - started_at
+
+    def _critical_path(self, result):
+        # Longest chain of dependent stages, weighted by how long each stage actually took
+        best = {}
+        for stage in self.stages:
+            if stage.name not in result.durations:
+                continue
+            previous = max((best[dep] for dep in self.dependencies(stage) if dep in best),
+                           key=lambda path: path[0], default=(0.0, []))
+            best[stage.name] = (previous[0] + result.durations[stage.name], previous[1] + [stage.name])
+        if best:
+            result.critical_path_time, result.critical_path = max(best.values(), key=lambda path: path[0])
+
+    # Runs every stage as soon as its dependencies are done. `on_stage_done(stage, output, error)`
+    # is called from the calling thread, in declaration order, as soon as each stage and the
+    # ones declared before it have finished. `on_token(stage, text_so_far)` switches stages to
+    # streaming and is called from the worker threads.
+    # Inputs named after a stage replace that stage's output (an edited outline, for example). With a
+    # `store` and `run_id`, finished stages are checkpointed and reused while their inputs are unchanged.
+    # With a `telemetry` recorder, llm calls are attributed to their stage and the run's stages are recorded.
+    def run(self, inputs, on_stage_done=None, on_token=None, store=None, run_id=None, telemetry=None):
+        self._check(inputs)
+        start_time = time.time()
+        result = PipelineResult()
+        values = dict(inputs)
+        pending = []
+        for stage in self.stages:
+            if stage.name in inputs:
+                result.outputs[stage.name] = inputs[stage.name]
+            else:
+                pending.append(stage)
+        input_hashes = {}
+        running = {}
+        emitted = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for stage in list(pending):
+                    deps = self.dependencies(stage)
+                    failed = [dep for dep in deps if dep in result.errors]
+                    if failed:
+                        pending.remove(stage)
+                        result.errors[stage.name] = StageSkipped(f"{stage.name} skipped, {failed[0]} did not finish")
+                    elif all(dep in result.outputs for dep in deps):
+                        pending.remove(stage)
+                        if store is not None:
+                            input_hashes[stage.name] = content_hash([stage.name, stage.arguments(values)])
+                            output = store.get(run_id, stage.name, input_hashes[stage.name])
+                            if output is not None:
+                                logger.info(f"Stage {stage.name} restored from run {run_id}")
+                                result.restored.append(stage.name)
+                                result.outputs[stage.name] = output
+                                values[stage.name] = output
+                                continue
+                        running[executor.submit(self._execute, stage, values, result, on_token, telemetry)] = stage
+
+                if running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        stage = running.pop(future)
+                        try:
+                            output = future.result()
+                            result.outputs[stage.name] = output
+                            values[stage.name] = output
+                            logger.info(f"Stage {stage.name} concluded")
+                            if store is not None:
+                                store.put(run_id, stage.name, input_hashes[stage.name], output)
+                        except Exception as e:
+                            logger.exception(f"Stage {stage.name} failed")
+                            result.errors[stage.name] = e
+
+                while emitted < len(self.stages):
+                    stage = self.stages[emitted]
+                    if stage.name in result.outputs:
+                        output, error = result.outputs[stage.name], None
+                    elif stage.name in result.errors:
+                        output, error = None, result.errors[stage.name]
+                    else:
+                        break
+                    if on_stage_done:
+                        on_stage_done(stage, output, error)
+                    emitted += 1
+
+        result.wall_time = time.time() - start_time
+        self._critical_path(result)
+        logger.info(f"Critical path: {' -> '.join(result.critical_path)} ({result.critical_path_time:.2f}s)")
+        if telemetry is not None:
+            telemetry.record_run(self.stages, result)
+        return result
+
+
+# Stage callback that writes titled stages to a Streamlit container (or `st` itself)
+def streamlit_writer(container):
+    def write(stage, output, error):
+        if stage.header:
+            container.write(stage.header)
+        if stage.title is None:
+            return
+        if error is not None:
+            container.error(f"{stage.title} failed: {error}")
+        else:
+            container.write(f"{stage.title}:\n{output}")
+    return write
+
+
+def write_summary(container, result):
+    if result.restored:
+        container.write(f"Restored Stages: {', '.join(result.restored)}")
+    if result.first_token_times:
+        first_tokens = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result.first_token_times.items())
+        container.write(f"Time to First Token: {first_tokens}")
+    container.write(f"Critical Path: {' -> '.join(result.critical_path)} ({result.critical_path_time:.2f} seconds)")
+    container.write(f"Total Processing Time: {result.wall_time} seconds")
@@ -0,0 +1,124 @@
+import re
+import logging
+from dataclasses import dataclass
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import RunnableLambda
+from langchain_core.output_parsers import StrOutputParser
+from utils.llms import context_window, model_name
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Tokens kept free for the completion
+DEFAULT_OUTPUT_RESERVE = 1024
+TRUNCATION_MARKER = " [...]"
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+_TERMS = re.compile(r"\w{3,}")
+
+summarize_prompt_template = """
+Summarize the following text in at most {max_words} words. Keep names, numbers, dates and sources.
+Text: {text}
+"""
+
+
+# How a prompt variable may be shrunk when the prompt is over budget. Lower priorities are shrunk first.
+# strategy: "truncate" keeps the beginning, "rank" keeps the most informative items (search results,
+# paragraphs), "summarize" asks the packer's summarizer model for a shorter version.
+@dataclass
+class Section:
+    priority: int = 0
+    strategy: str = "truncate"
+    min_tokens: int = 64
+
+
+def truncate_to_tokens(text, max_tokens):
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Leaves room for the truncation marker
+    limit = max_tokens - estimate_tokens(TRUNCATION_MARKER)
+    used = 0
+    for piece in _PIECES.finditer(text):
+        used += 1 + (len(piece.group()) - 1) // 6
+        if used > limit:
+            return text[:piece.start()].rstrip() + TRUNCATION_MARKER
+    return text
+
+
+def _split_items(text):
+    for pattern in (r"\n\s*\n", r"\],\s*\[", r"\n"):
+        items = [item.strip() for item in re.split(pattern, text) if item.strip()]
+        if len(items) > 1:
+            return items
+    return [item for item in re.split(r"(?<=[.!?])\s+", text) if item]
+
+
+# Greedily keeps the items that add the most unseen terms per token (earlier items win ties, search
+# results come ranked), then returns them in their original order
+def rank_to_tokens(text, max_tokens):
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    items = _split_items(text)
+    costs = [estimate_tokens(item) + 1 for item in items]
+    terms = [set(_TERMS.findall(item.lower())) for item in items]
+    seen, kept, used = set(), set(), 0
+    while True:
+        candidates = [index for index in range(len(items))
+                      if index not in kept and used + costs[index] <= max_tokens]
+        if not candidates:
+            break
+        best = max(candidates, key=lambda index: len(terms[index] - seen) / costs[index] / (1 + 0.05 * index))
+        kept.add(best)
+        seen |= terms[best]
+        used += costs[best]
+    if not kept:
+        return truncate_to_tokens(text, max_tokens)
+    return "\n".join(items[index] for index in sorted(kept))
+
+
+class PromptPacker:
+    def __init__(self, prompt, llm, sections=None, reserve_output=DEFAULT_OUTPUT_RESERVE, summarizer=None):
+        self.prompt = prompt
+        self.model = model_name(llm)
+        self.budget = context_window(llm) - reserve_output
+        # Without explicit sections every variable may be truncated, all with the same priority
+        self.sections = sections if sections is not None else {variable: Section() for variable in prompt.input_variables}
+        self.summarizer = summarizer
+
+    def _shrink(self, section, text, max_tokens):
+        if section.strategy == "rank":
+            return rank_to_tokens(text, max_tokens)
+        if section.strategy == "summarize" and self.summarizer is not None:
+            summarize_prompt = PromptTemplate(input_variables=["max_words", "text"], template=summarize_prompt_template)
+            chain = summarize_prompt | self.summarizer | StrOutputParser()
+            text = chain.invoke({"max_words": int(max_tokens * 0.7), "text": truncate_to_tokens(text, self.budget // 2)})
+        return truncate_to_tokens(text, max_tokens)
+
+    def pack(self, values):
+        values = dict(values)
+        packed = [variable for variable in self.sections if variable in values]
+        fixed = estimate_tokens(self.prompt.format(**{**values, **{variable: "" for variable in packed}}))
+        sizes = {variable: estimate_tokens(values[variable]) for variable in packed}
+        overflow = fixed + sum(sizes.values()) - self.budget
+        if overflow <= 0:
+            return values
+
+        logger.warning(f"Prompt for {self.model} is {overflow} tokens over budget, packing {packed}")
+        for variable in sorted(packed, key=lambda variable: self.sections[variable].priority):
+            section = self.sections[variable]
+            cut = min(overflow, sizes[variable] - section.min_tokens)
+            if cut <= 0:
+                continue
+            values[variable] = self._shrink(section, str(values[variable]), sizes[variable] - cut)
+            overflow -= sizes[variable] - estimate_tokens(values[variable])
+            if overflow <= 0:
+                break
+        if overflow > 0:
+            logger.error(f"Prompt for {self.model} is still {overflow} tokens over budget after packing")
+        return values
+
+
+# Chain step that fits the prompt's variables into the model's context window before rendering it:
+# pack(prompt, llm) | llm | StrOutputParser()
+def pack(prompt, llm, sections=None, **kwargs):
+    return RunnableLambda(PromptPacker(prompt, llm, sections, **kwargs).pack) | prompt
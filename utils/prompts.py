@@ -0,0 +1,61 @@
+import re
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import RunnableLambda
+
+_NUMBER_WORDS = ["one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven", "twelve"]
+_CHAPTER_HEADING = re.compile(
+    r"^[\s#*>\-]*(?:chapter|cap[ií]tulo)\s+(\d+|" + "|".join(_NUMBER_WORDS) + r")\b",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+# Builds a prompt where each shared context block is rendered exactly once, under its own heading, followed by
+# instructions that refer to the blocks by heading. `blocks` maps prompt variable -> heading.
+def shared_context_prompt(blocks, instructions):
+    repeated = [variable for variable in blocks if f"{{{variable}}}" in instructions]
+    if repeated:
+        raise ValueError(f"Instructions must refer to {repeated} by heading instead of interpolating them again")
+    sections = "".join(f"\n    {heading}:\n    {{{variable}}}\n" for variable, heading in blocks.items())
+    return PromptTemplate.from_template(sections + instructions)
+
+
+def _chapter_number(label):
+    label = label.lower()
+    return int(label) if label.isdigit() else _NUMBER_WORDS.index(label) + 1
+
+
+# Text of each chapter of an outline or a draft, keyed by chapter number, from its heading to the next one
+def chapter_sections(text):
+    headings = list(_CHAPTER_HEADING.finditer(text))
+    sections = {}
+    for index, heading in enumerate(headings):
+        end = headings[index + 1].start() if index + 1 < len(headings) else len(text)
+        sections.setdefault(_chapter_number(heading.group(1)), text[heading.start():end].strip())
+    return sections
+
+
+# Returns only the outline sections of the given chapters, or the whole outline when its chapters
+# cannot be told apart
+def outline_slice(outline, chapters):
+    sections = chapter_sections(outline)
+    selected = [sections[chapter] for chapter in chapters if chapter in sections]
+    return "\n\n".join(selected) if selected else outline
+
+
+# Chain step that replaces the `chapter_outlines` input with the slice for the given chapters
+def outline_slicer(chapters):
+    return RunnableLambda(lambda inputs: {**inputs, "chapter_outlines": outline_slice(inputs["chapter_outlines"], chapters)})
+
+
+# The part of a draft covering `chapter`, one of the `chapters` the draft was written for. When the draft's
+# chapters cannot all be told apart, the first chapter gets the whole draft and the others an empty string.
+def draft_slice(draft, chapters, chapter):
+    sections = chapter_sections(draft)
+    if all(number in sections for number in chapters):
+        return sections[chapter]
+    return draft if chapter == chapters[0] else ""
+
+
+# Chain step that replaces the `draft` input with the part covering `chapter`
+def draft_slicer(chapters, chapter):
+    return RunnableLambda(lambda inputs: {**inputs, "draft": draft_slice(inputs["draft"], chapters, chapter)})
@@ -0,0 +1,219 @@
+import os
+import time
+import random
+import asyncio
+import sqlite3
+import logging
+import contextvars
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import get_buffer_string
+from langchain_core.rate_limiters import BaseRateLimiter
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_PATH = os.environ.get("RATE_LIMIT_PATH", os.path.expanduser("~/.cache/personall/rate_limits.sqlite"))
+
+# A queued caller whose process stopped refreshing its ticket for this long is dropped from the queue
+STALE_TICKET_SECONDS = 30
+# Completion tokens reserved for a call that does not set max_tokens
+RATE_LIMIT_OUTPUT_RESERVE = int(os.environ.get("RATE_LIMIT_OUTPUT_RESERVE", 1024))
+
+# Set per call: its estimated tokens, whether the limiter was acquired (cache hits skip it), the tokens it reserved
+# and how long the caller queued
+_estimate = contextvars.ContextVar("rate_limiter_estimate", default=0)
+_acquired = contextvars.ContextVar("rate_limiter_acquired", default=False)
+_reserved = contextvars.ContextVar("rate_limiter_reserved", default=0)
+_last_wait = contextvars.ContextVar("rate_limiter_last_wait", default=0.0)
+
+
+def last_queue_wait():
+    return _last_wait.get()
+
+
+# Clears the queue wait before a call, models without a limiter never reset it themselves
+def reset_queue_wait():
+    _last_wait.set(0.0)
+
+
+@contextmanager
+def _connect(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS buckets (
+        model TEXT PRIMARY KEY, requests REAL, tokens REAL, updated_at REAL)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS queue (
+        ticket INTEGER PRIMARY KEY AUTOINCREMENT, model TEXT, pid INTEGER, heartbeat REAL)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS queue_waits (
+        model TEXT PRIMARY KEY, calls INTEGER DEFAULT 0, total_wait REAL DEFAULT 0, max_wait REAL DEFAULT 0)""")
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@contextmanager
+def _transaction(conn):
+    # BEGIN IMMEDIATE takes the write lock up front, so refill-and-take is atomic across processes
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# Requests-per-minute and tokens-per-minute token buckets for one model, shared by every process on the host
+# through SQLite. Callers queue in FIFO order across processes. A request takes one request token and reserves
+# its estimated prompt plus completion tokens, so a burst of parallel calls is admitted only as far as the balance
+# covers them. This object is also registered as a callback on the client: the estimate is made when the call
+# starts and the reservation is settled against the tokens actually used when it ends.
+class SharedRateLimiter(BaseRateLimiter, BaseCallbackHandler):
+    run_inline = True
+
+    def __init__(self, model, requests_per_minute, tokens_per_minute, path=RATE_LIMIT_PATH, poll_interval=0.05):
+        self.model = model
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.path = path
+        self.poll_interval = poll_interval
+
+    def _refill(self, conn, now):
+        row = conn.execute("SELECT requests, tokens, updated_at FROM buckets WHERE model = ?", (self.model,)).fetchone()
+        if row is None:
+            requests, tokens = self.requests_per_minute, self.tokens_per_minute
+        else:
+            elapsed = now - row[2]
+            requests = min(self.requests_per_minute, row[0] + elapsed * self.requests_per_minute / 60)
+            tokens = min(self.tokens_per_minute, row[1] + elapsed * self.tokens_per_minute / 60)
+        return requests, tokens
+
+    def _save(self, conn, requests, tokens, now):
+        conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)", (self.model, requests, tokens, now))
+
+    # One attempt to take a request and `cost` tokens for `ticket`: returns 0 when taken, otherwise how long to
+    # wait. A call larger than the whole bucket only waits for a full one.
+    def _try_take(self, conn, ticket, cost):
+        now = time.time()
+        needed = min(cost, self.tokens_per_minute)
+        with _transaction(conn):
+            conn.execute("DELETE FROM queue WHERE heartbeat < ?", (now - STALE_TICKET_SECONDS,))
+            conn.execute("UPDATE queue SET heartbeat = ? WHERE ticket = ?", (now, ticket))
+            head = conn.execute("SELECT MIN(ticket) FROM queue WHERE model = ?", (self.model,)).fetchone()[0]
+            requests, tokens = self._refill(conn, now)
+            if head == ticket and requests >= 1 and tokens >= needed:
+                self._save(conn, requests - 1, tokens - cost, now)
+                conn.execute("DELETE FROM queue WHERE ticket = ?", (ticket,))
+                return 0
+        if head != ticket:
+            return self.poll_interval
+        wait_requests = (1 - requests) * 60 / self.requests_per_minute if requests < 1 else 0
+        wait_tokens = (needed - tokens) * 60 / self.tokens_per_minute if tokens < needed else 0
+        return max(self.poll_interval, min(max(wait_requests, wait_tokens), 1.0))
+
+    def _enqueue(self, conn):
+        with _transaction(conn):
+            return conn.execute("INSERT INTO queue (model, pid, heartbeat) VALUES (?, ?, ?)",
+                                (self.model, os.getpid(), time.time())).lastrowid
+
+    def _record_wait(self, conn, waited):
+        _last_wait.set(waited)
+        with _transaction(conn):
+            conn.execute("INSERT OR IGNORE INTO queue_waits (model) VALUES (?)", (self.model,))
+            conn.execute("""UPDATE queue_waits SET calls = calls + 1, total_wait = total_wait + ?,
+                max_wait = MAX(max_wait, ?) WHERE model = ?""", (waited, waited, self.model))
+        if waited > 1:
+            logger.info(f"Waited {waited:.2f}s for the {self.model} rate limit")
+
+    def _dequeue(self, conn, ticket):
+        with _transaction(conn):
+            conn.execute("DELETE FROM queue WHERE ticket = ?", (ticket,))
+
+    # Queues for a request and the call's estimated tokens, yielding how long to sleep between attempts. Returns
+    # whether they were taken, which only fails when not blocking.
+    def _attempts(self, blocking):
+        started_at = time.time()
+        cost = _estimate.get()
+        with _connect(self.path) as conn:
+            ticket = self._enqueue(conn)
+            try:
+                while True:
+                    delay = self._try_take(conn, ticket, cost)
+                    if delay == 0:
+                        break
+                    if not blocking:
+                        self._dequeue(conn, ticket)
+                        return False
+                    # A little jitter keeps processes polling the same bucket from waking up together
+                    yield delay * random.uniform(0.8, 1.2)
+            except BaseException:
+                self._dequeue(conn, ticket)
+                raise
+            self._record_wait(conn, time.time() - started_at)
+        _acquired.set(True)
+        _reserved.set(cost)
+        return True
+
+    def acquire(self, *, blocking=True):
+        attempts = self._attempts(blocking)
+        try:
+            while True:
+                time.sleep(next(attempts))
+        except StopIteration as done:
+            return done.value
+
+    # langchain-core 0.2 calls acquire on the async path too, this serves async callers of the limiter itself
+    async def aacquire(self, *, blocking=True):
+        attempts = self._attempts(blocking)
+        try:
+            while True:
+                await asyncio.sleep(next(attempts))
+        except StopIteration as done:
+            return done.value
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        completion = (kwargs.get("invocation_params") or {}).get("max_tokens") or RATE_LIMIT_OUTPUT_RESERVE
+        prompt = sum(estimate_tokens(get_buffer_string(conversation)) for conversation in messages)
+        _estimate.set(prompt + completion * len(messages))
+        _acquired.set(False)
+        _reserved.set(0)
+        _last_wait.set(0.0)
+
+    def on_llm_end(self, response, **kwargs):
+        # Cached responses never acquired the limiter and are not charged
+        if not _acquired.get():
+            return
+        used = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                used += usage.get("total_tokens", 0)
+        # Without reported usage the reservation stands as the charge
+        if used:
+            self.debit(used - _reserved.get())
+        _acquired.set(False)
+
+    # A failed call (rate limited, timed out) gives its reservation back
+    def on_llm_error(self, error, **kwargs):
+        if _acquired.get():
+            self.debit(-_reserved.get())
+            _acquired.set(False)
+
+    def debit(self, tokens):
+        now = time.time()
+        with _connect(self.path) as conn:
+            with _transaction(conn):
+                requests, balance = self._refill(conn, now)
+                self._save(conn, requests, min(self.tokens_per_minute, balance - tokens), now)
+
+    def stats(self):
+        with _connect(self.path) as conn:
+            row = conn.execute("SELECT calls, total_wait, max_wait FROM queue_waits WHERE model = ?",
+                               (self.model,)).fetchone()
+            queued = conn.execute("SELECT COUNT(*) FROM queue WHERE model = ?", (self.model,)).fetchone()[0]
+        calls, total_wait, max_wait = row or (0, 0.0, 0.0)
+        return {"model": self.model, "calls": calls, "queued": queued, "max_wait": max_wait,
+                "mean_wait": total_wait / calls if calls else 0.0}
@@ -0,0 +1,211 @@
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+import httpx
+import groq
+import anthropic
+from langchain_core.runnables import Runnable
+from utils.llms import MODELS, CONTEXT_WINDOWS, DEFAULT_CONTEXT_WINDOW, get_llm
+from utils.llm_cache import cached_stream
+from utils.rate_limiter import last_queue_wait, reset_queue_wait
+from utils.prompt_packer import DEFAULT_OUTPUT_RESERVE
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Calls kept per model for the rolling latency percentiles and error rate
+LATENCY_WINDOW = 100
+# A model needs this many recent calls before its latency or error rate can demote it
+MIN_SAMPLES = 5
+# Models failing more often than this are tried after the healthy ones
+MAX_ERROR_RATE = 0.5
+
+# Substitutes tried, in order, when a model is over its SLO, too small for the prompt or failing.
+# Groq models fall back to each other first and then to Claude Haiku, which is on another provider.
+DEFAULT_SUBSTITUTES = {
+    "llm1": ("llm2", "llm6"),
+    "llm2": ("llm3", "llm6"),
+    "llm3": ("llm2", "llm6"),
+    "llm4": ("llm5", "llm6"),
+    "llm5": ("llm6", "llm4"),
+    "llm6": ("llm5",),
+    "llm7": ("llm3", "llm6"),
+}
+
+# Errors worth retrying on another model: rate limits, server errors, timeouts and dropped connections
+_TRANSIENT = (
+    groq.APITimeoutError, groq.APIConnectionError,
+    anthropic.APITimeoutError, anthropic.APIConnectionError,
+    httpx.TimeoutException, httpx.TransportError, TimeoutError,
+)
+
+
+class AllModelsFailed(Exception):
+    pass
+
+
+def is_transient(error):
+    if isinstance(error, _TRANSIENT):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+class LatencyTracker:
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def record(self, name, latency, ok):
+        with self._lock:
+            self._calls.setdefault(name, deque(maxlen=self.window)).append((latency, ok))
+
+    def stats(self, name):
+        with self._lock:
+            calls = list(self._calls.get(name, ()))
+        latencies = sorted(latency for latency, ok in calls if ok)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+        return {
+            "calls": len(calls),
+            "samples": len(latencies),
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "error_rate": sum(1 for _, ok in calls if not ok) / len(calls) if calls else 0.0,
+        }
+
+
+# Shared by every router in the process, so all stages learn from each other's calls. It only holds what the
+# providers took: cache hits are not recorded and time queued for our own rate limits is left out.
+tracker = LatencyTracker()
+
+
+def provider_latency(started_at):
+    return time.time() - started_at - last_queue_wait()
+
+
+def is_cache_hit(message):
+    return bool((getattr(message, "response_metadata", None) or {}).get("cache_hit"))
+
+
+def model_stats():
+    return {name: tracker.stats(name) for name in MODELS}
+
+
+# Which models a call may use: the preferred one, acceptable substitutes in order of preference, the largest
+# prompt (in tokens) it may be sent, and the p95 latency in seconds above which a model is tried last
+@dataclass
+class RoutePolicy:
+    preferred: str
+    substitutes: tuple = ()
+    max_prompt_tokens: int = None
+    latency_slo: float = None
+    reserve_output: int = DEFAULT_OUTPUT_RESERVE
+
+
+# Drop-in replacement for an llm client in a chain: prompt | ModelRouter(policy) | StrOutputParser().
+# Each call goes to the best candidate of the policy and fails over to the next one on rate limits,
+# server errors and timeouts. Clients are only built when a call reaches them.
+class ModelRouter(Runnable):
+    def __init__(self, policy):
+        self.policy = policy
+        # Lets pack() and context_window() size prompts for the preferred model
+        self.model_name = MODELS[policy.preferred]["model"]
+
+    def fits(self, name, prompt_tokens):
+        window = CONTEXT_WINDOWS.get(MODELS[name]["model"], DEFAULT_CONTEXT_WINDOW) - self.policy.reserve_output
+        if self.policy.max_prompt_tokens is not None:
+            window = min(window, self.policy.max_prompt_tokens)
+        return prompt_tokens <= window
+
+    def degraded(self, name):
+        stats = tracker.stats(name)
+        if stats["calls"] < MIN_SAMPLES:
+            return False
+        if stats["error_rate"] > MAX_ERROR_RATE:
+            return True
+        slo = self.policy.latency_slo
+        return slo is not None and stats["p95"] is not None and stats["p95"] > slo
+
+    # Candidates that fit the prompt, healthy ones first, keeping the policy's order otherwise
+    def candidates(self, input):
+        prompt_tokens = estimate_tokens(input.to_string() if hasattr(input, "to_string") else input)
+        names = [self.policy.preferred] + [name for name in self.policy.substitutes if name != self.policy.preferred]
+        fitting = [name for name in names if self.fits(name, prompt_tokens)]
+        if not fitting:
+            logger.warning(f"No model of {names} fits a {prompt_tokens} token prompt, trying {names[-1]}")
+            fitting = names[-1:]
+        return sorted(fitting, key=self.degraded)
+
+    def _client(self, name):
+        try:
+            return get_llm(name)
+        except Exception as e:
+            logger.warning(f"Skipping {name}, its client could not be built: {e}")
+            return None
+
+    def _failed(self, name, started_at, error):
+        tracker.record(name, provider_latency(started_at), ok=False)
+        if not is_transient(error):
+            raise error
+        logger.warning(f"{name} failed ({type(error).__name__}: {error}), failing over")
+
+    def invoke(self, input, config=None, **kwargs):
+        errors = []
+        for name in self.candidates(input):
+            client = self._client(name)
+            if client is None:
+                continue
+            reset_queue_wait()
+            started_at = time.time()
+            try:
+                output = client.invoke(input, config, **kwargs)
+            except Exception as e:
+                self._failed(name, started_at, e)
+                errors.append(f"{name}: {e}")
+                continue
+            if not is_cache_hit(output):
+                tracker.record(name, provider_latency(started_at), ok=True)
+            return output
+        raise AllModelsFailed(f"Every model failed for {self.policy.preferred}: {errors}")
+
+    # Fails over only until the first chunk, a partially streamed answer is not restarted on another model.
+    # Cached answers arrive as a single chunk.
+    def stream(self, input, config=None, **kwargs):
+        errors = []
+        for name in self.candidates(input):
+            client = self._client(name)
+            if client is None:
+                continue
+            reset_queue_wait()
+            started_at = time.time()
+            streamed = cached = False
+            try:
+                for chunk in cached_stream(client, input, config, **kwargs):
+                    streamed = True
+                    cached = cached or is_cache_hit(chunk)
+                    yield chunk
+            except Exception as e:
+                if streamed:
+                    tracker.record(name, provider_latency(started_at), ok=False)
+                    raise
+                self._failed(name, started_at, e)
+                errors.append(f"{name}: {e}")
+                continue
+            if not cached:
+                tracker.record(name, provider_latency(started_at), ok=True)
+            return
+        raise AllModelsFailed(f"Every model failed for {self.policy.preferred}: {errors}")
+
+
+def routed(preferred, substitutes=None, **kwargs):
+    if substitutes is None:
+        substitutes = DEFAULT_SUBSTITUTES.get(preferred, ())
+    return ModelRouter(RoutePolicy(preferred, tuple(substitutes), **kwargs))
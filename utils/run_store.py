@@ -0,0 +1,49 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+
+RUN_STORE_PATH = os.environ.get("RUN_STORE_PATH", os.path.expanduser("~/.cache/personall/runs.sqlite"))
+
+
+def content_hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+# Stage outputs of pipeline runs. An output is stored under the run id, the stage name and a hash of
+# the stage's inputs, so a rerun reuses everything whose inputs did not change and recomputes the rest.
+class RunStore:
+    def __init__(self, path=RUN_STORE_PATH):
+        self.path = path
+
+    @contextmanager
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("""CREATE TABLE IF NOT EXISTS stage_outputs (
+            run_id TEXT, stage TEXT, input_hash TEXT, output TEXT, created_at REAL,
+            PRIMARY KEY (run_id, stage, input_hash))""")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, run_id, stage, input_hash):
+        with self._connect() as conn:
+            row = conn.execute("SELECT output FROM stage_outputs WHERE run_id = ? AND stage = ? AND input_hash = ?",
+                               (run_id, stage, input_hash)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, run_id, stage, input_hash, output):
+        with self._connect() as conn:
+            # Only the latest output of a stage is kept for a run
+            conn.execute("DELETE FROM stage_outputs WHERE run_id = ? AND stage = ?", (run_id, stage))
+            conn.execute("INSERT INTO stage_outputs VALUES (?, ?, ?, ?, ?)",
+                         (run_id, stage, input_hash, json.dumps(output), time.time()))
+
+    def clear(self, run_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM stage_outputs WHERE run_id = ?", (run_id,))
@@ -0,0 +1,210 @@
+import os
+import re
+import time
+import json
+import sqlite3
+import hashlib
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_PATH = os.environ.get("SEARCH_CACHE_PATH", os.path.expanduser("~/.cache/personall/search_cache.sqlite"))
+# Queries of one pipeline in flight at the same time
+SEARCH_MAX_CONCURRENCY = int(os.environ.get("SEARCH_MAX_CONCURRENCY", 4))
+SEARCH_MAX_RESULTS = int(os.environ.get("SEARCH_MAX_RESULTS", 8))
+# Snippets sharing at least this fraction of their word trigrams count as the same result
+SNIPPET_SIMILARITY = 0.8
+
+# Query class -> seconds its results stay cached. News is searched in the news vertical for the last month.
+SEARCH_TTLS = {
+    "news": 6 * 3600,
+    "financial": 24 * 3600,
+    "general": 7 * 24 * 3600,
+    "history": 28 * 24 * 3600,
+}
+
+_TRACKING_PARAMS = re.compile(r"^(utm_\w+|ref|fbclid|gclid|mc_cid|mc_eid)$")
+
+
+class SearchFailed(Exception):
+    pass
+
+
+@dataclass
+class SearchRecord:
+    title: str
+    url: str
+    snippet: str
+    date: str = None
+    query: str = None
+
+
+@dataclass
+class SearchQuery:
+    text: str
+    kind: str = "general"
+    max_results: int = SEARCH_MAX_RESULTS
+
+
+# DuckDuckGo through duckduckgo_search, text results for every class but news
+class DuckDuckGoBackend:
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+
+    def search(self, text, kind, max_results):
+        from duckduckgo_search import DDGS
+
+        with DDGS(timeout=self.timeout) as ddgs:
+            if kind == "news":
+                return [{"title": item.get("title"), "url": item.get("url"), "snippet": item.get("body"),
+                         "date": item.get("date")} for item in ddgs.news(text, timelimit="m", max_results=max_results)]
+            return [{"title": item.get("title"), "url": item.get("href"), "snippet": item.get("body")}
+                    for item in ddgs.text(text, max_results=max_results)]
+
+
+_backend_factory = DuckDuckGoBackend
+
+
+# Replaces the backend every search service builds by default, e.g. with a local stand-in for tests and
+# benchmarks. The factory takes no arguments and returns an object with search(text, kind, max_results).
+def set_search_backend(factory):
+    global _backend_factory
+    _backend_factory = factory
+
+
+def normalize_query(text):
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def canonical_url(url):
+    parts = urlsplit((url or "").strip())
+    host = parts.netloc.lower().removeprefix("www.")
+    query = urlencode([(key, value) for key, value in parse_qsl(parts.query) if not _TRACKING_PARAMS.match(key)])
+    return f"{host}{parts.path.rstrip('/')}" + (f"?{query}" if query else "")
+
+
+def _shingles(text):
+    words = re.findall(r"\w+", (text or "").lower())
+    return {" ".join(words[index:index + 3]) for index in range(max(len(words) - 2, 1))}
+
+
+def _parse(raw, query):
+    records = []
+    for item in raw:
+        snippet = " ".join((item.get("snippet") or "").split())
+        if not snippet and not item.get("url"):
+            continue
+        records.append(SearchRecord(title=(item.get("title") or "").strip(), url=item.get("url") or "",
+                                    snippet=snippet, date=item.get("date"), query=query))
+    return records
+
+
+# Drops results already seen under the same URL or with a near-identical snippet. Earlier records win,
+# so queries listed first (and better ranked results) keep theirs.
+def dedupe(records):
+    urls, kept, kept_shingles = set(), [], []
+    for record in records:
+        url = canonical_url(record.url)
+        if url and url in urls:
+            continue
+        shingles = _shingles(record.snippet)
+        if shingles and any(len(shingles & other) / len(shingles | other) >= SNIPPET_SIMILARITY
+                            for other in kept_shingles):
+            continue
+        urls.add(url)
+        kept.append(record)
+        kept_shingles.append(shingles)
+    return kept
+
+
+# Compact text for prompts, one block per record so the prompt packer ranks whole results
+def format_records(records):
+    if not records:
+        return "No search results."
+    blocks = []
+    for record in records:
+        date = f" ({record.date[:10]})" if record.date else ""
+        blocks.append(f"{record.title}{date} - {record.url}\n{record.snippet}")
+    return "\n\n".join(blocks)
+
+
+@contextmanager
+def _connect(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS search_cache (
+        key TEXT PRIMARY KEY, kind TEXT, query TEXT, records TEXT, created_at REAL)""")
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+# Runs a pipeline's queries concurrently, caching each one's records by normalized query and class
+class SearchService:
+    def __init__(self, backend=None, path=SEARCH_CACHE_PATH, ttls=SEARCH_TTLS, max_concurrency=SEARCH_MAX_CONCURRENCY):
+        self.backend = backend if backend is not None else _backend_factory()
+        self.path = path
+        self.ttls = ttls
+        self.max_concurrency = max_concurrency
+
+    @staticmethod
+    def _key(query):
+        return hashlib.sha256(f"{query.kind}\x00{query.max_results}\x00{normalize_query(query.text)}"
+                              .encode("utf-8")).hexdigest()
+
+    def _cached(self, query):
+        with _connect(self.path) as conn:
+            row = conn.execute("SELECT records, created_at FROM search_cache WHERE key = ?",
+                               (self._key(query),)).fetchone()
+        if row is None or time.time() - row[1] > self.ttls.get(query.kind, self.ttls["general"]):
+            return None
+        return [SearchRecord(**record) for record in json.loads(row[0])]
+
+    def _store(self, query, records):
+        with _connect(self.path) as conn:
+            conn.execute("INSERT OR REPLACE INTO search_cache (key, kind, query, records, created_at) "
+                         "VALUES (?, ?, ?, ?, ?)", (self._key(query), query.kind, normalize_query(query.text),
+                                                     json.dumps([asdict(record) for record in records]), time.time()))
+
+    def search(self, query):
+        if isinstance(query, str):
+            query = SearchQuery(query)
+        records = self._cached(query)
+        if records is not None:
+            logger.info(f"Search cache hit for {query.text!r}")
+            return records
+        records = _parse(self.backend.search(query.text, query.kind, query.max_results), query.text)
+        # Empty answers are usually a throttled backend, they are not worth keeping
+        if records:
+            self._store(query, records)
+        return records
+
+    # Query name -> records, deduplicated across all the queries. A failing query comes back empty unless
+    # every query failed.
+    def search_many(self, queries):
+        queries = {name: SearchQuery(query) if isinstance(query, str) else query for name, query in queries.items()}
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(queries)))) as executor:
+            futures = {name: executor.submit(self.search, query) for name, query in queries.items()}
+        results, errors = {}, {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logger.warning(f"Search {queries[name].text!r} failed: {e}")
+                errors[name] = e
+                results[name] = []
+        if errors and len(errors) == len(queries):
+            raise SearchFailed(f"Every search failed: {', '.join(f'{name}: {error}' for name, error in errors.items())}")
+        kept = {id(record) for record in dedupe([record for name in queries for record in results[name]])}
+        return {name: [record for record in records if id(record) in kept] for name, records in results.items()}
+
+    # Same as search_many, formatted for prompts
+    def search_text(self, queries):
+        return {name: format_records(records) for name, records in self.search_many(queries).items()}
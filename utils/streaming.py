@@ -0,0 +1,45 @@
+import threading
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from utils.pipeline import streamlit_writer, write_summary
+
+
+# Reserves one placeholder per titled stage, in declaration order, and renders tokens into it as they arrive.
+# Stages run in worker threads, so each of them is attached to the page's script context before writing.
+class StreamlitStageView:
+    def __init__(self, container, stages):
+        self.ctx = get_script_run_ctx()
+        self.placeholders = {}
+        for stage in stages:
+            if stage.header:
+                container.write(stage.header)
+            if stage.title is not None:
+                self.placeholders[stage.name] = container.empty()
+
+    def on_token(self, stage, text):
+        placeholder = self.placeholders.get(stage.name)
+        if placeholder is None:
+            return
+        if self.ctx is not None:
+            add_script_run_ctx(threading.current_thread(), self.ctx)
+        placeholder.write(f"{stage.title}:\n{text}▌")
+
+    def on_stage_done(self, stage, output, error):
+        placeholder = self.placeholders.get(stage.name)
+        if placeholder is None:
+            return
+        if error is not None:
+            placeholder.error(f"{stage.title} failed: {error}")
+        else:
+            placeholder.write(f"{stage.title}:\n{output}")
+
+
+# Runs a pipeline on a Streamlit page, streaming stage outputs when `stream` is set
+def run_in_streamlit(pipeline, inputs, container, stream=True, summary=True, **run_kwargs):
+    if stream:
+        view = StreamlitStageView(container, pipeline.stages)
+        result = pipeline.run(inputs, on_stage_done=view.on_stage_done, on_token=view.on_token, **run_kwargs)
+    else:
+        result = pipeline.run(inputs, on_stage_done=streamlit_writer(container), **run_kwargs)
+    if summary:
+        write_summary(container, result)
+    return result
@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import time
+import uuid
+import fcntl
+import logging
+import threading
+from collections import defaultdict
+from langchain_core.callbacks import BaseCallbackHandler
+from utils.llms import call_cost
+from utils.rate_limiter import last_queue_wait
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Every app appends to the same JSONL file, the Prometheus text file is rebuilt from it after each run
+TELEMETRY_DIR = os.environ.get("TELEMETRY_DIR", os.path.expanduser("~/.cache/personall/telemetry"))
+EVENTS_FILE = "events.jsonl"
+METRICS_FILE = "metrics.prom"
+
+
+def _model(serialized, kwargs):
+    metadata = kwargs.get("metadata") or {}
+    params = kwargs.get("invocation_params") or {}
+    return (metadata.get("ls_model_name") or params.get("model") or params.get("model_name")
+            or (serialized or {}).get("name") or "unknown")
+
+
+# Records every llm call made under it and, through Pipeline.run(telemetry=...), every stage of a run.
+# Calls are attributed to the stage named in the run config metadata: chain.invoke(inputs, telemetry.config("stage")).
+# Events go to TELEMETRY_DIR/events.jsonl, aggregated counters to TELEMETRY_DIR/metrics.prom.
+class Telemetry(BaseCallbackHandler):
+    # Inline, so the rate limiter's queue wait is read from the calling thread's context
+    run_inline = True
+
+    def __init__(self, app, run_id=None, directory=TELEMETRY_DIR):
+        self.app = app
+        self.run_id = run_id or uuid.uuid4().hex[:16]
+        self.directory = directory
+        self.calls = []
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def config(self, stage=None):
+        return {"callbacks": [self], "metadata": {"stage": stage, "app": self.app, "telemetry_run_id": self.run_id}}
+
+    def _start(self, run_id, serialized, prompt, kwargs):
+        with self._lock:
+            self._open[run_id] = {
+                "stage": (kwargs.get("metadata") or {}).get("stage"),
+                "model": _model(serialized, kwargs),
+                "started_at": time.time(),
+                "first_token": None,
+                "prompt_tokens": estimate_tokens(prompt),
+            }
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        prompt = "\n".join(str(message.content) for batch in messages for message in batch)
+        self._start(run_id, serialized, prompt, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, serialized, "\n".join(prompts), kwargs)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        call = self._open.get(run_id)
+        if call is not None and call["first_token"] is None:
+            call["first_token"] = time.time() - call["started_at"]
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            call = self._open.pop(run_id, None)
+        if call is None:
+            return
+        input_tokens = output_tokens = 0
+        estimated = cache_hit = False
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if usage:
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+                else:
+                    estimated = True
+                    output_tokens += estimate_tokens(generation.text)
+                cache_hit = cache_hit or bool(getattr(message, "response_metadata", {}).get("cache_hit"))
+        if estimated and not input_tokens:
+            input_tokens = call["prompt_tokens"]
+        self._finish(call, input_tokens=input_tokens, output_tokens=output_tokens, estimated_tokens=estimated,
+                     cache_hit=cache_hit, cost=0.0 if cache_hit else call_cost(call["model"], input_tokens, output_tokens))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            call = self._open.pop(run_id, None)
+        if call is not None:
+            self._finish(call, input_tokens=call["prompt_tokens"], output_tokens=0, estimated_tokens=True,
+                         cache_hit=False, cost=0.0, error=f"{type(error).__name__}: {error}")
+
+    def _finish(self, call, **fields):
+        record = {
+            "kind": "llm_call",
+            "app": self.app,
+            "run_id": self.run_id,
+            "stage": call["stage"],
+            "model": call["model"],
+            "started_at": call["started_at"],
+            "latency": time.time() - call["started_at"],
+            "first_token": call["first_token"],
+            "rate_limit_wait": last_queue_wait(),
+            "error": None,
+            **fields,
+        }
+        with self._lock:
+            self.calls.append(record)
+        self.write([record])
+
+    def write(self, records):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, EVENTS_FILE), "a") as events:
+            fcntl.flock(events, fcntl.LOCK_EX)
+            events.write("".join(json.dumps(record, default=str) + "\n" for record in records))
+
+    # Writes one record per stage of a finished pipeline run and one for the run, then refreshes the metrics file
+    def record_run(self, stages, result):
+        records = []
+        for stage in stages:
+            calls = [call for call in self.calls if call["stage"] == stage.name]
+            error = result.errors.get(stage.name)
+            records.append({
+                "kind": "stage",
+                "app": self.app,
+                "run_id": self.run_id,
+                "stage": stage.name,
+                "queue_wait": result.queue_waits.get(stage.name),
+                "duration": result.durations.get(stage.name),
+                "first_token": result.first_token_times.get(stage.name),
+                "retries": max(result.attempts.get(stage.name, 1) - 1, 0),
+                "restored": stage.name in result.restored,
+                "error": f"{type(error).__name__}: {error}" if error is not None else None,
+                "llm_calls": len(calls),
+                "rate_limit_wait": sum(call["rate_limit_wait"] for call in calls),
+                "input_tokens": sum(call["input_tokens"] for call in calls),
+                "output_tokens": sum(call["output_tokens"] for call in calls),
+                "cost": sum(call["cost"] for call in calls),
+                "cache_hits": sum(1 for call in calls if call["cache_hit"]),
+            })
+        records.append({
+            "kind": "run",
+            "app": self.app,
+            "run_id": self.run_id,
+            "wall_time": result.wall_time,
+            "critical_path": result.critical_path,
+            "critical_path_time": result.critical_path_time,
+            "cost": sum(call["cost"] for call in self.calls),
+            "ok": result.ok,
+        })
+        self.write(records)
+        try:
+            write_metrics(self.directory)
+        except Exception:
+            logger.exception("Could not refresh the metrics file")
+
+
+def _read_events(directory):
+    path = os.path.join(directory, EVENTS_FILE)
+    if not os.path.exists(path):
+        return
+    with open(path) as events:
+        for line in events:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def _labels(**labels):
+    return ",".join(f'{name}="{str(value).replace(chr(34), "")}"' for name, value in labels.items())
+
+
+# Rebuilds the Prometheus text-format file (node_exporter textfile collector) with totals per app, stage and model
+def write_metrics(directory=TELEMETRY_DIR):
+    counters = defaultdict(float)
+    for event in _read_events(directory):
+        if event["kind"] == "stage":
+            labels = _labels(app=event["app"], stage=event["stage"])
+            counters[("personall_stage_runs_total", labels)] += 1
+            counters[("personall_stage_seconds_total", labels)] += event["duration"] or 0
+            counters[("personall_stage_queue_wait_seconds_total", labels)] += event["queue_wait"] or 0
+            counters[("personall_stage_retries_total", labels)] += event["retries"]
+            counters[("personall_stage_errors_total", labels)] += 1 if event["error"] else 0
+            counters[("personall_stage_restored_total", labels)] += 1 if event["restored"] else 0
+        elif event["kind"] == "llm_call":
+            labels = _labels(app=event["app"], stage=event["stage"] or "", model=event["model"])
+            counters[("personall_llm_calls_total", labels)] += 1
+            counters[("personall_llm_seconds_total", labels)] += event["latency"]
+            counters[("personall_llm_rate_limit_wait_seconds_total", labels)] += event["rate_limit_wait"] or 0
+            counters[("personall_llm_first_token_seconds_total", labels)] += event["first_token"] or 0
+            counters[("personall_llm_input_tokens_total", labels)] += event["input_tokens"]
+            counters[("personall_llm_output_tokens_total", labels)] += event["output_tokens"]
+            counters[("personall_llm_cost_usd_total", labels)] += event["cost"]
+            counters[("personall_llm_cache_hits_total", labels)] += 1 if event["cache_hit"] else 0
+            counters[("personall_llm_errors_total", labels)] += 1 if event["error"] else 0
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {name} counter")
+        lines += [f"{metric}{{{labels}}} {value:g}" for (metric, labels), value in sorted(counters.items()) if metric == name]
+    path = os.path.join(directory, METRICS_FILE)
+    with open(path + ".tmp", "w") as metrics:
+        metrics.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+# python -m utils.telemetry [app]: stages and models ranked by wall time and by spend
+if __name__ == "__main__":
+    app = sys.argv[1] if len(sys.argv) > 1 else None
+    seconds, spend = defaultdict(float), defaultdict(float)
+    for event in _read_events(TELEMETRY_DIR):
+        if app and event["app"] != app:
+            continue
+        if event["kind"] == "stage":
+            seconds[(event["app"], event["stage"])] += event["duration"] or 0
+        elif event["kind"] == "llm_call":
+            spend[(event["app"], event["stage"], event["model"])] += event["cost"]
+    print("Wall time by stage:")
+    for key, value in sorted(seconds.items(), key=lambda item: -item[1])[:15]:
+        print(f"  {' / '.join(key)}: {value:.1f}s")
+    print("Spend by stage and model:")
+    for key, value in sorted(spend.items(), key=lambda item: -item[1])[:15]:
+        print(f"  {' / '.join(str(part) for part in key)}: {value:.4f} USD")
+    write_metrics(TELEMETRY_DIR)
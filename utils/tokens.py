@@ -0,0 +1,12 @@
+import re
+
+# Rough local token count for Llama/Gemma/Claude style BPE vocabularies: whole short words are one token,
+# long words split about every 6 characters and punctuation marks are a token each. No network or tokenizer
+# download is involved, the estimate is meant for budgeting and reporting, not billing.
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return sum(1 + (len(piece) - 1) // 6 for piece in _PIECES.findall(str(text)))